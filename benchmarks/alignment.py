@@ -0,0 +1,88 @@
+"""
+Compares the page-alignment throughput of AlignmentEngine with the original
+per-page ORB + brute-force matching path.
+
+    python -m benchmarks.alignment [--pairs long_test1.pdf:long_test2.pdf ...]
+"""
+import argparse
+import json
+import os
+import time
+
+import cv2
+import fitz
+import numpy as np
+
+from compare.alignment import AlignmentEngine
+from compare.viewsPdf import render_page
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'media', 'temp_files')
+DEFAULT_PAIRS = ['long_test1.pdf:long_test2.pdf', 'tag1.pdf:tag2.pdf']
+
+
+def legacy_estimate_homography(gray1, gray2):
+    """The alignment path compare_pdfs used before AlignmentEngine."""
+    orb = cv2.ORB_create(
+        nfeatures=10000, scaleFactor=1.1, nlevels=32,
+        edgeThreshold=31, firstLevel=0, WTA_K=2,
+        patchSize=31, fastThreshold=1
+    )
+    kp1, des1 = orb.detectAndCompute(gray1, None)
+    kp2, des2 = orb.detectAndCompute(gray2, None)
+    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    matches = bf.match(des1, des2)
+    matches = sorted(matches, key=lambda x: x.distance, reverse=False)
+    src_pts = np.float32([kp1[m.queryIdx].pt for m in matches]).reshape(-1, 1, 2)
+    dst_pts = np.float32([kp2[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
+    H, _ = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC)
+    return H
+
+def load_page_pairs(pairs):
+    page_pairs = []
+    for pair in pairs:
+        name1, name2 = pair.split(':')
+        with fitz.open(os.path.join(CORPUS_DIR, name1)) as pdf1, fitz.open(os.path.join(CORPUS_DIR, name2)) as pdf2:
+            for page_number in range(min(len(pdf1), len(pdf2))):
+                page_pairs.append((
+                    render_page(pdf1[page_number], grayscale=True),
+                    render_page(pdf2[page_number], grayscale=True),
+                ))
+    return page_pairs
+
+def corner_error(H, reference):
+    """Mean displacement in pixels of the page corners between H and reference."""
+    if H is None or reference is None:
+        return None
+    corners = np.float32([[0, 0], [1000, 0], [1000, 1000], [0, 1000]]).reshape(-1, 1, 2)
+    return float(np.mean(np.linalg.norm(
+        cv2.perspectiveTransform(corners, H) - cv2.perspectiveTransform(corners, reference), axis=2
+    )))
+
+def run(page_pairs, estimate):
+    start = time.perf_counter()
+    homographies = [estimate(gray1, gray2) for gray1, gray2 in page_pairs]
+    elapsed = time.perf_counter() - start
+    return homographies, {"seconds": round(elapsed, 3), "pages_per_second": round(len(page_pairs) / elapsed, 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pairs', nargs='+', default=DEFAULT_PAIRS, help="file1:file2 pairs from media/temp_files")
+    args = parser.parse_args()
+
+    page_pairs = load_page_pairs(args.pairs)
+    legacy_homographies, legacy = run(page_pairs, legacy_estimate_homography)
+    report = {"pages": len(page_pairs), "legacy": legacy}
+
+    for matcher in ('bruteforce', 'flann'):
+        engine = AlignmentEngine(matcher=matcher)
+        homographies, stats = run(page_pairs, engine.estimate_homography)
+        stats["speedup"] = round(legacy["seconds"] / stats["seconds"], 2)
+        errors = [corner_error(H, reference) for H, reference in zip(homographies, legacy_homographies)]
+        errors = [error for error in errors if error is not None]
+        stats["max_corner_error_px"] = round(max(errors), 3) if errors else None
+        report[matcher] = stats
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Profiles the memory allocated per page by the raster PDF pipeline, in color
+and grayscale, against the original render-RGB-then-convert path.
+
+    python -m benchmarks.allocations [--pages long_test1.pdf:long_test2.pdf ...] [--zoom 3]
+
+Each variant runs in a fresh process. Per page, traced_peak_mb is the
+tracemalloc peak of the Python and NumPy heap (rendered copies, grays, warped
+pages, masks and highlights); MuPDF pixmaps are not traced, so maxrss_mb, the
+peak resident size of the process, is reported as well.
+"""
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import cv2
+import fitz
+import numpy as np
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'media', 'temp_files')
+DEFAULT_PAIRS = ['long_test1.pdf:long_test2.pdf']
+VARIANTS = ('legacy', 'color', 'grayscale')
+
+
+def legacy_render_page(page, zoom):
+    """The page rendering used before pixmaps were wrapped without copying."""
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    if pix.n == 1:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    return img
+
+def legacy_compare_page(page1, page2, output_dir, zoom):
+    """The color page comparison of compare_and_save_page before the grayscale pipeline."""
+    from compare.alignment import get_alignment_engine
+    from compare.diffresult import mask_regions
+    from compare.viewsPdf import visualize_differences
+
+    image1, image2 = legacy_render_page(page1, zoom), legacy_render_page(page2, zoom)
+    gray1 = cv2.cvtColor(image1, cv2.COLOR_BGR2GRAY)
+    gray2 = cv2.cvtColor(image2, cv2.COLOR_BGR2GRAY)
+    H, alignment = get_alignment_engine().align(gray1, gray2)
+    if alignment == "identity":
+        image2_aligned = image2
+    else:
+        image2_aligned = cv2.warpPerspective(image2, H, (image1.shape[1], image1.shape[0]))
+    diff_gray = cv2.cvtColor(cv2.absdiff(image1, image2_aligned), cv2.COLOR_BGR2GRAY)
+    _, diff_thresh = cv2.threshold(diff_gray, 150, 255, cv2.THRESH_BINARY)
+    if cv2.countNonZero(diff_thresh) == 0:
+        return
+    labels, regions = mask_regions(diff_thresh, image1, image2_aligned)
+    highlighted = visualize_differences(image1, diff_thresh, labels, regions)
+    cv2.imwrite(os.path.join(output_dir, f"highlighted_page_{page1.number + 1}.png"),
+                cv2.cvtColor(highlighted, cv2.COLOR_BGR2RGB))
+
+def profile_variant(variant, pairs, zoom):
+    """Runs one variant over the page pairs and returns its per-page profile."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pdf_compare.settings')
+    from django.conf import settings
+    from compare.viewsPdf import compare_page_pair
+
+    settings.PDF_GRAYSCALE_PIPELINE = variant == 'grayscale'
+    settings.PDF_RENDER_ZOOM = zoom
+    # Compare every page whole at zoom
+    settings.PDF_RENDER_PIXEL_BUDGET = 10 ** 12
+    memory_limit = 10 ** 12
+
+    pages = []
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as output_dir:
+        for pair in pairs:
+            name1, name2 = pair.split(':')
+            with fitz.open(os.path.join(CORPUS_DIR, name1)) as pdf1, fitz.open(os.path.join(CORPUS_DIR, name2)) as pdf2:
+                for page_number in range(min(len(pdf1), len(pdf2))):
+                    tracemalloc.reset_peak()
+                    start = time.perf_counter()
+                    if variant == 'legacy':
+                        legacy_compare_page(pdf1[page_number], pdf2[page_number], output_dir, zoom)
+                    else:
+                        compare_page_pair(pdf1, pdf2, page_number, page_number, output_dir, 'raster', memory_limit)
+                    seconds = time.perf_counter() - start
+                    pages.append({
+                        "page": f"{pair}#{page_number + 1}",
+                        "traced_peak_mb": round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 1),
+                        "seconds": round(seconds, 3),
+                    })
+    tracemalloc.stop()
+    return {
+        "pages": pages,
+        "traced_peak_mb": max(page["traced_peak_mb"] for page in pages),
+        "traced_peak_mb_mean": round(sum(page["traced_peak_mb"] for page in pages) / len(pages), 1),
+        "seconds": round(sum(page["seconds"] for page in pages), 3),
+        "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pairs', nargs='+', default=DEFAULT_PAIRS, help="first.pdf:second.pdf from media/temp_files")
+    parser.add_argument('--zoom', type=float, default=3)
+    parser.add_argument('--per-page', action='store_true', help="include the profile of every page")
+    args = parser.parse_args()
+
+    report = {"zoom": args.zoom}
+    for variant in VARIANTS:
+        # A fresh process per variant, so maxrss is its own
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            report[variant] = executor.submit(profile_variant, variant, args.pairs, args.zoom).result()
+        if not args.per_page:
+            del report[variant]["pages"]
+    for variant in ('color', 'grayscale'):
+        report[variant]["traced_peak_reduction"] = round(
+            1 - report[variant]["traced_peak_mb_mean"] / report["legacy"]["traced_peak_mb_mean"], 3
+        )
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Compares merge_boxes() with the original adjacent-pair merging of
+merge_overlapping_boxes on dense box sets.
+
+    python -m benchmarks.boxmerge [--images photo.jpg ...] [--counts 1000 10000 50000] [--repeat 3]
+
+Synthetic inputs are random text-line sized boxes scattered over a page;
+--images adds the contour boxes get_bounding_boxes() finds in real images.
+For every input the report has the time of both functions, the boxes they
+return and how many pairs of returned boxes are still near each other
+(always 0 for merge_boxes).
+"""
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from compare.boxmerge import merge_boxes
+
+DEFAULT_COUNTS = [1000, 10000, 50000]
+
+
+def legacy_merge_overlapping_boxes(boxes, overlap_threshold=0.3):
+    """merge_overlapping_boxes before merge_boxes(): only merges a box with the next one in x order."""
+    if not boxes:
+        return []
+    boxes = sorted(boxes, key=lambda b: b[0])
+    merged_boxes = []
+    current_box = boxes[0]
+    for next_box in boxes[1:]:
+        x1, y1, w1, h1 = current_box
+        x2, y2, w2, h2 = next_box
+        if (x2 < x1 + w1 + overlap_threshold * w1) and (y2 < y1 + h1 + overlap_threshold * h1):
+            x = min(x1, x2)
+            y = min(y1, y2)
+            w = max(x1 + w1, x2 + w2) - x
+            h = max(y1 + h1, y2 + h2) - y
+            current_box = (x, y, w, h)
+        else:
+            merged_boxes.append(current_box)
+            current_box = next_box
+    merged_boxes.append(current_box)
+    return merged_boxes
+
+def random_boxes(count, seed=0):
+    """Word-sized boxes on a page whose area grows with count, so density stays constant."""
+    rng = np.random.default_rng(seed)
+    side = int(np.sqrt(count) * 150)
+    widths = rng.integers(8, 60, count)
+    heights = rng.integers(8, 20, count)
+    xs = rng.integers(0, side, count)
+    ys = rng.integers(0, side, count)
+    return [tuple(map(int, box)) for box in zip(xs, ys, widths, heights)]
+
+def contour_boxes(path):
+    """The boxes get_bounding_boxes() merges for an image."""
+    gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 21, 15)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = [cv2.boundingRect(contour) for contour in contours]
+    return [box for box in boxes if box[2] > 1 and box[3] > 1]
+
+def near_pairs(boxes, margin=0.3):
+    """Counts the pairs of boxes that merge_boxes() would still merge."""
+    array = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    x, y, w, h = array.T
+    left, top = x - margin * w / 2, y - margin * h / 2
+    right, bottom = x + w + margin * w / 2, y + h + margin * h / 2
+    count = 0
+    for i in range(len(array)):
+        near = (left[i] <= right[i + 1:]) & (left[i + 1:] <= right[i]) & (top[i] <= bottom[i + 1:]) & (top[i + 1:] <= bottom[i])
+        count += int(near.sum())
+    return count
+
+def timed(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', nargs='*', default=[], help="images to take contour boxes from")
+    parser.add_argument('--counts', nargs='*', type=int, default=DEFAULT_COUNTS, help="random box counts")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    inputs = [(f"random {count}", random_boxes(count)) for count in args.counts]
+    inputs += [(os.path.basename(path), contour_boxes(path)) for path in args.images]
+    report = []
+    for name, boxes in inputs:
+        legacy, legacy_seconds = timed(lambda: legacy_merge_overlapping_boxes(boxes), args.repeat)
+        merged, seconds = timed(lambda: merge_boxes(boxes), args.repeat)
+        report.append({
+            "input": name,
+            "boxes": len(boxes),
+            "legacy": {"seconds": round(legacy_seconds, 4), "boxes": len(legacy), "near_pairs": near_pairs(legacy)},
+            "merge_boxes": {"seconds": round(seconds, 4), "boxes": len(merged), "near_pairs": near_pairs(merged)},
+        })
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Benchmarks the PDF and image comparison pipelines stage by stage over the
+bundled corpus in media/temp_files.
+
+    python -m benchmarks.pipeline [--pdf first.pdf:second.pdf ...] [--image first.jpg:second.jpg ...]
+                                  [--repeat 3] [--output report.json]
+                                  [--save-baseline baseline.json | --baseline baseline.json [--tolerance 0.25]]
+
+Every pair is compared in a fresh process, through the same functions the
+compare_pdfs and compare_images endpoints run on a result cache miss
+(run_pdf_comparison and run_image_comparison), with artifacts written to a
+temporary directory. For each pair the report has the best wall time of
+--repeat runs, pages per second, the time spent in every pipeline stage
+(compare.timing.STAGES; "other" is the remainder) and the peak RSS of the
+process, also net of what it held before the first run.
+
+With --baseline, the wall time and peak RSS of every pair are checked
+against a report saved earlier with --save-baseline; the regressions are
+listed in the report and the exit status is 1 if any metric is more than
+--tolerance worse.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'media', 'temp_files')
+DEFAULT_PDF_PAIRS = [
+    'long_test1.pdf:long_test2.pdf',
+    'tag1.pdf:tag2.pdf',
+    'tag1.pdf:tag3.pdf',
+    'Hello.pdf:Hi_.pdf',
+    'Hello_world.pdf:Hi_world.pdf',
+    'hello_a.pdf:hi_a.pdf',
+    'Midterm 1911 (ILP+Dynamical Systems) - VIE.pdf:MidtermCO2011_vi_2020_076x_MT18_with_keys.pdf',
+]
+# Renders of a page of each PDF pair, the second rotated, scaled and shifted like a rescan
+DEFAULT_IMAGE_PAIRS = [
+    'long_test_scan1.jpg:long_test_scan2.jpg',
+    'tag_scan1.jpg:tag_scan2.jpg',
+]
+# Metrics compared against the baseline; higher is worse for all of them
+REGRESSION_METRICS = ('wall_seconds', 'peak_rss_mb')
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+def run_pair(kind, pair, repeat):
+    """Compares one pair repeat times in this process and returns its measurements."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pdf_compare.settings')
+    from django.conf import settings
+    from compare.timing import STAGES, collect_stage_times
+    from compare.viewsImage import run_image_comparison
+    from compare.viewsPdf import run_pdf_comparison
+
+    name1, name2 = pair.split(':')
+    path1, path2 = os.path.join(CORPUS_DIR, name1), os.path.join(CORPUS_DIR, name2)
+    rss_before = peak_rss_mb()
+    best = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as output_dir:
+            # The image pipeline writes debug images under MEDIA_ROOT
+            settings.MEDIA_ROOT = output_dir
+            with collect_stage_times() as stage_times:
+                start = time.perf_counter()
+                if kind == 'pdf':
+                    result = run_pdf_comparison(
+                        path1, path2, os.path.join(output_dir, 'images'), os.path.join(output_dir, 'output.pdf')
+                    )
+                else:
+                    result = run_image_comparison(path1, path2, output_dir)
+                wall_seconds = time.perf_counter() - start
+        if best is None or wall_seconds < best[0]:
+            best = (wall_seconds, dict(stage_times), result)
+
+    wall_seconds, stage_times, result = best
+    stages = {name: round(stage_times[name][0], 4) for name in STAGES if name in stage_times}
+    stages["other"] = round(max(0.0, wall_seconds - sum(stages.values())), 4)
+    pages = len(result["pages"])
+    return {
+        "pair": pair,
+        "pages": pages,
+        "regions": result["summary"]["regions"],
+        "wall_seconds": round(wall_seconds, 4),
+        "pages_per_sec": round(pages / wall_seconds, 3),
+        "stages": stages,
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_growth_mb": peak_rss_mb() - rss_before,
+    }
+
+def run_suite(pdf_pairs, image_pairs, repeat):
+    report = {
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "repeat": repeat,
+        "pdf": [],
+        "image": [],
+    }
+    for kind, pairs in (('pdf', pdf_pairs), ('image', image_pairs)):
+        for pair in pairs:
+            # A fresh process per pair, so its peak RSS is its own
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                try:
+                    report[kind].append(executor.submit(run_pair, kind, pair, repeat).result())
+                except Exception as e:
+                    # e.g. images the pipeline cannot align
+                    report[kind].append({"pair": pair, "error": str(e)})
+
+    for kind in ('pdf', 'image'):
+        entries = [entry for entry in report[kind] if "error" not in entry]
+        pages = sum(entry["pages"] for entry in entries)
+        wall_seconds = sum(entry["wall_seconds"] for entry in entries)
+        report[f"{kind}_totals"] = {
+            "pages": pages,
+            "wall_seconds": round(wall_seconds, 4),
+            "pages_per_sec": round(pages / wall_seconds, 3) if wall_seconds else 0.0,
+        }
+    return report
+
+def find_regressions(report, baseline, tolerance):
+    """Returns the metrics of pairs in both reports that are more than tolerance worse than the baseline."""
+    regressions = []
+    for kind in ('pdf', 'image'):
+        baseline_entries = {entry["pair"]: entry for entry in baseline.get(kind, [])}
+        for entry in report[kind]:
+            reference = baseline_entries.get(entry["pair"])
+            if reference is None or "error" in reference:
+                continue
+            if "error" in entry:
+                regressions.append({"kind": kind, "pair": entry["pair"], "error": entry["error"]})
+                continue
+            for metric in REGRESSION_METRICS:
+                if entry[metric] > reference[metric] * (1 + tolerance):
+                    regressions.append({
+                        "kind": kind,
+                        "pair": entry["pair"],
+                        "metric": metric,
+                        "baseline": reference[metric],
+                        "value": entry[metric],
+                        "change": round(entry[metric] / reference[metric] - 1, 3) if reference[metric] else None,
+                    })
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pdf', nargs='*', default=DEFAULT_PDF_PAIRS, help="first.pdf:second.pdf from media/temp_files")
+    parser.add_argument('--image', nargs='*', default=DEFAULT_IMAGE_PAIRS, help="first.jpg:second.jpg from media/temp_files")
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', help="also write the report to this file")
+    parser.add_argument('--save-baseline', help="write the report to this file as the new baseline")
+    parser.add_argument('--baseline', help="report to check for regressions against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown or growth, as a fraction")
+    args = parser.parse_args()
+
+    report = run_suite(args.pdf, args.image, args.repeat)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["tolerance"] = args.tolerance
+        report["regressions"] = find_regressions(report, baseline, args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                f.write(text + '\n')
+    if report.get("regressions"):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Project, File, Comparison, Session
+from .models import Project, File, Comparison, Session, ComparisonJob
 
 
 @admin.register(Project)
@@ -23,3 +23,8 @@ class ComparisonAdmin(admin.ModelAdmin):
 class SessionAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'token', 'expires_at', 'created_at')
     search_fields = ('user__username', 'token')
+
+@admin.register(ComparisonJob)
+class ComparisonJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'job_type', 'status', 'pages_done', 'pages_total', 'created_at', 'finished_at')
+    list_filter = ('job_type', 'status')
@@ -0,0 +1,200 @@
+import threading
+
+import cv2
+import numpy as np
+from django.conf import settings
+from scipy.spatial import cKDTree
+
+from .timing import stage
+
+# FLANN index type for binary (ORB) descriptors
+FLANN_INDEX_LSH = 6
+
+MATCHERS = ('bruteforce', 'flann')
+
+# Keypoints of the reference page considered per keypoint in windowed matching
+WINDOW_CANDIDATES = 8
+
+
+class AlignmentEngine:
+    """
+    Estimates the homography that maps a page image onto its reference page.
+
+    The ORB detector and the descriptor matcher are created once and reused for
+    every page; use get_alignment_engine() to get the instance owned by the
+    current thread or process.
+
+    matcher is "bruteforce" (exact cross-checked Hamming matching, quadratic in
+    keypoint count) or "flann" (approximate LSH matching with a ratio test).
+    At most max_matches of the best matches are handed to RANSAC.
+
+    align() first estimates the transform on copies downscaled to coarse_size
+    pixels on the long side; pages whose transform moves no corner by more
+    than identity_tolerance full-resolution pixels are not warped at all.
+    Otherwise full-resolution keypoints are only matched within refine_window
+    pixels of where the coarse transform puts them.
+    """
+
+    def __init__(self, matcher='flann', max_matches=2000, ratio=0.8,
+                 coarse_size=1200, identity_tolerance=1.0, refine_window=24):
+        if matcher not in MATCHERS:
+            raise ValueError(f"Unknown matcher: {matcher}")
+
+        self.matcher_name = matcher
+        self.max_matches = max_matches
+        self.ratio = ratio
+        self.coarse_size = coarse_size
+        self.identity_tolerance = identity_tolerance
+        self.refine_window = refine_window
+        self.orb = cv2.ORB_create(
+            nfeatures=10000, scaleFactor=1.1, nlevels=32,
+            edgeThreshold=31, firstLevel=0, WTA_K=2,
+            patchSize=31, fastThreshold=1
+        )
+        if matcher == 'flann':
+            self.matcher = cv2.FlannBasedMatcher(
+                dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1),
+                dict(checks=50),
+            )
+        else:
+            self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+
+    def detect(self, gray):
+        """Returns the keypoint coordinates (N x 2 float32) and descriptors."""
+        with stage('detect'):
+            keypoints, descriptors = self.orb.detectAndCompute(gray, None)
+        return cv2.KeyPoint_convert(keypoints), descriptors
+
+    def match(self, descriptors1, descriptors2):
+        """
+        Matches descriptors1 against descriptors2 and returns the query and
+        train index arrays of the kept matches, best first.
+        """
+        if descriptors1 is None or descriptors2 is None:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+        with stage('match'):
+            if self.matcher_name == 'flann':
+                matches = [
+                    pair[0] for pair in self.matcher.knnMatch(descriptors1, descriptors2, k=2)
+                    if len(pair) == 2 and pair[0].distance < self.ratio * pair[1].distance
+                ]
+            else:
+                matches = self.matcher.match(descriptors1, descriptors2)
+
+        if not matches:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+        table = np.array([(m.queryIdx, m.trainIdx, m.distance) for m in matches], dtype=np.float64)
+        order = np.argsort(table[:, 2], kind='stable')[:self.max_matches]
+        return table[order, 0].astype(np.intp), table[order, 1].astype(np.intp)
+
+    def match_near(self, points1, descriptors1, points2, descriptors2, H):
+        """
+        Matches every keypoint of the second page against the keypoints of
+        the first within refine_window pixels of where H maps it, with the
+        ratio test, and returns the index arrays like match().
+        """
+        empty = np.empty(0, dtype=np.intp)
+        if descriptors1 is None or descriptors2 is None or len(points1) < 2:
+            return empty, empty
+
+        with stage('match'):
+            predicted = cv2.perspectiveTransform(points2.reshape(-1, 1, 2), H).reshape(-1, 2)
+            _, candidates = cKDTree(points1).query(
+                predicted, k=min(WINDOW_CANDIDATES, len(points1)), distance_upper_bound=self.refine_window
+            )
+            # Missing neighbours are reported as len(points1)
+            found = candidates < len(points1)
+            candidates = np.where(found, candidates, 0)
+            distances = np.unpackbits(descriptors2[:, None, :] ^ descriptors1[candidates], axis=2).sum(axis=2)
+            distances = np.where(found, distances, np.iinfo(distances.dtype).max)
+
+            order = np.argsort(distances, axis=1, kind='stable')
+            best = np.take_along_axis(distances, order[:, :1], axis=1)[:, 0]
+            second = np.take_along_axis(distances, order[:, 1:2], axis=1)[:, 0]
+            train_idx = np.flatnonzero(found.any(axis=1) & (best < self.ratio * second))
+            query_idx = candidates[train_idx, order[train_idx, 0]]
+            keep = np.argsort(best[train_idx], kind='stable')[:self.max_matches]
+        return query_idx[keep].astype(np.intp), train_idx[keep].astype(np.intp)
+
+    def estimate_homography(self, gray1, gray2, H_guess=None):
+        """
+        Returns the homography mapping gray2 onto gray1, or None when not
+        enough matches were found. With H_guess, an approximate homography,
+        keypoints are matched with match_near(), falling back to matching
+        them all when that finds fewer than four matches.
+        """
+        points1, descriptors1 = self.detect(gray1)
+        points2, descriptors2 = self.detect(gray2)
+        query_idx = train_idx = ()
+        if H_guess is not None:
+            query_idx, train_idx = self.match_near(points1, descriptors1, points2, descriptors2, H_guess)
+        if len(query_idx) < 4:
+            query_idx, train_idx = self.match(descriptors1, descriptors2)
+        if len(query_idx) < 4:
+            return None
+
+        src_pts = points1[query_idx].reshape(-1, 1, 2)
+        dst_pts = points2[train_idx].reshape(-1, 1, 2)
+        with stage('match'):
+            H, _ = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC)
+        return H
+
+    def is_identity(self, H, shape):
+        """True when H moves no corner of a shape-sized page by more than identity_tolerance."""
+        height, width = shape[:2]
+        corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]]).reshape(-1, 1, 2)
+        displacement = np.linalg.norm(cv2.perspectiveTransform(corners, H) - corners, axis=2)
+        return float(displacement.max()) <= self.identity_tolerance
+
+    def align(self, gray1, gray2):
+        """
+        Estimates the transform mapping gray2 onto gray1 coarse-to-fine.
+
+        Returns (H, path). path is "identity" when the pages are already
+        aligned (H is None and no warp is needed) or "refined" when the
+        transform was estimated at full resolution; H is None with "refined"
+        when no transform could be estimated at all.
+
+        Keypoints found on the downscaled pages are too imprecise for a warp,
+        but are plenty to tell that the pages are not displaced, and to say
+        where each full-resolution keypoint should be matched.
+        """
+        scale = min(1.0, self.coarse_size / max(gray1.shape[:2]))
+        H_guess = None
+        if scale < 1.0:
+            with stage('detect'):
+                coarse1 = cv2.resize(gray1, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                coarse2 = cv2.resize(gray2, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            H_coarse = self.estimate_homography(coarse1, coarse2)
+            if H_coarse is not None:
+                # Conjugate by the scaling so H applies to full-resolution pixels
+                S = np.diag([scale, scale, 1.0])
+                H_guess = np.linalg.inv(S) @ H_coarse @ S
+                if self.is_identity(H_guess, gray1.shape):
+                    return None, "identity"
+
+        H = self.estimate_homography(gray1, gray2, H_guess)
+        if H is not None and self.is_identity(H, gray1.shape):
+            return None, "identity"
+        return H, "refined"
+
+
+_local = threading.local()
+
+def get_alignment_engine():
+    """
+    Returns the AlignmentEngine of the current thread, built from the
+    PDF_ALIGNMENT_* settings.
+    """
+    engine = getattr(_local, 'engine', None)
+    if engine is None:
+        engine = AlignmentEngine(
+            matcher=settings.PDF_ALIGNMENT_MATCHER,
+            max_matches=settings.PDF_ALIGNMENT_MAX_MATCHES,
+            coarse_size=settings.PDF_ALIGNMENT_COARSE_SIZE,
+            identity_tolerance=settings.PDF_ALIGNMENT_IDENTITY_TOLERANCE,
+        )
+        _local.engine = engine
+    return engine
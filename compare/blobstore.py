@@ -0,0 +1,113 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+
+CHUNK_SIZE = 1024 * 1024
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def file_sha256(path):
+    """Hashes a file in chunks and returns its hex SHA-256."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class BlobStore:
+    """
+    Content-addressed file store.
+
+    Blobs are keyed by the SHA-256 of their content and stored at
+    <root>/<d[0:2]>/<d[2:4]>/<d>, so identical content is stored once.
+    Blobs are written to a temporary file first and renamed into place, so
+    readers never see a partial blob.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        if not _DIGEST_RE.match(digest or ''):
+            raise ValueError(f"Invalid blob digest: {digest!r}")
+        return os.path.join(self.root, digest[0:2], digest[2:4], digest)
+
+    def size(self, digest):
+        return os.path.getsize(self.path(digest))
+
+    def _temp_file(self):
+        temp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=temp_dir, delete=False)
+
+    def _commit(self, temp_path, digest):
+        """Moves a fully written temporary file into place as blob digest."""
+        path = self.path(digest)
+        if os.path.exists(path):
+            # Already stored: deduplicate
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        return digest
+
+    def put_chunks(self, chunks):
+        """Stores an iterable of byte chunks and returns (digest, size)."""
+        sha256 = hashlib.sha256()
+        size = 0
+        with self._temp_file() as temp:
+            try:
+                for chunk in chunks:
+                    sha256.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                temp.close()
+                os.remove(temp.name)
+                raise
+        return self._commit(temp.name, sha256.hexdigest()), size
+
+    def put_bytes(self, data):
+        """Stores data and returns its digest."""
+        return self.put_chunks([data])[0]
+
+    def put_file(self, path, digest=None):
+        """
+        Moves the file at path into the store and returns (digest, size).
+        When digest is given it must be the SHA-256 of the file; otherwise the
+        file is hashed in chunks.
+        """
+        size = os.path.getsize(path)
+        if digest is None:
+            digest = file_sha256(path)
+
+        blob_path = self.path(digest)
+        if os.path.exists(blob_path):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            try:
+                os.replace(path, blob_path)
+            except OSError:
+                # Different filesystem: copy through a temp file in the store
+                with open(path, 'rb') as f:
+                    self.put_chunks(iter(lambda: f.read(CHUNK_SIZE), b''))
+                os.remove(path)
+        return digest, size
+
+    def open(self, digest):
+        """Opens a blob for streamed binary reading."""
+        return open(self.path(digest), 'rb')
+
+    def read(self, digest):
+        with self.open(digest) as f:
+            return f.read()
+
+
+def get_blob_store():
+    return BlobStore(settings.BLOB_STORE_ROOT)
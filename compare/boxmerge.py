@@ -0,0 +1,99 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# Boxes covering more grid cells than this are tested against every box
+# instead of being put in the grid
+MAX_BOX_CELLS = 64
+
+
+def _intersecting(i, j, left, top, right, bottom):
+    return (left[i] <= right[j]) & (left[j] <= right[i]) & (top[i] <= bottom[j]) & (top[j] <= bottom[i])
+
+def _candidate_pairs(left, top, right, bottom):
+    """
+    Returns index arrays of box pairs that share a cell of a uniform grid
+    sized to the median box, plus every box paired with each large one.
+    """
+    cell_width = max(1.0, float(np.median(right - left)))
+    cell_height = max(1.0, float(np.median(bottom - top)))
+    first_column, first_row = np.floor(left / cell_width), np.floor(top / cell_height)
+    columns = (np.floor(right / cell_width) - first_column + 1).astype(np.int64)
+    rows = (np.floor(bottom / cell_height) - first_row + 1).astype(np.int64)
+    cells = columns * rows
+
+    # One (cell, box) entry per cell covered by every small box
+    small = np.flatnonzero(cells <= MAX_BOX_CELLS)
+    counts = cells[small]
+    box = np.repeat(small, counts)
+    offset = np.arange(len(box)) - np.repeat(np.cumsum(counts) - counts, counts)
+    column = first_column[box] + offset % columns[box]
+    row = first_row[box] + offset // columns[box]
+    order = np.lexsort((box, row, column))
+    box, column, row = box[order], column[order], row[order]
+
+    # Entries of one cell are consecutive: pair every entry with the ones
+    # 1, 2, ... places after it until no cell holds that many boxes
+    pairs_i, pairs_j = [], []
+    distance = 1
+    while distance < len(box):
+        same_cell = (column[distance:] == column[:-distance]) & (row[distance:] == row[:-distance])
+        if not same_cell.any():
+            break
+        pairs_i.append(box[:-distance][same_cell])
+        pairs_j.append(box[distance:][same_cell])
+        distance += 1
+
+    # Few boxes are large; pair each with all boxes
+    for i in np.flatnonzero(cells > MAX_BOX_CELLS):
+        pairs_i.append(np.full(len(left), i))
+        pairs_j.append(np.arange(len(left)))
+
+    if not pairs_i:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+def _merge_pass(boxes, margin):
+    """Groups boxes that are transitively near each other and returns the bounding box of every group."""
+    x, y, w, h = boxes.T.astype(np.float64)
+    # Boxes grown by half the margin of their own size on each side; two
+    # boxes are near when the grown ones intersect
+    left, top = x - margin * w / 2, y - margin * h / 2
+    right, bottom = x + w + margin * w / 2, y + h + margin * h / 2
+
+    i, j = _candidate_pairs(left, top, right, bottom)
+    near = _intersecting(i, j, left, top, right, bottom)
+    graph = coo_matrix((np.ones(int(near.sum()), dtype=np.int8), (i[near], j[near])), shape=(len(boxes),) * 2)
+    count, labels = connected_components(graph, directed=False)
+
+    x1 = np.full(count, np.iinfo(np.int64).max)
+    y1 = np.full(count, np.iinfo(np.int64).max)
+    x2 = np.full(count, np.iinfo(np.int64).min)
+    y2 = np.full(count, np.iinfo(np.int64).min)
+    np.minimum.at(x1, labels, boxes[:, 0])
+    np.minimum.at(y1, labels, boxes[:, 1])
+    np.maximum.at(x2, labels, boxes[:, 0] + boxes[:, 2])
+    np.maximum.at(y2, labels, boxes[:, 1] + boxes[:, 3])
+    return np.stack([x1, y1, x2 - x1, y2 - y1], axis=1)
+
+def merge_boxes(boxes, margin=0.3):
+    """
+    Merges (x, y, w, h) boxes that overlap or are near each other into their
+    bounding boxes, transitively, and returns them sorted by x and y. Two
+    boxes are near when the gap between them on each axis is at most margin
+    times their mean size on that axis. Merging repeats until no two of the
+    returned boxes are near.
+
+    Candidate pairs come from a uniform grid sized to the median box, so
+    dense inputs of similar boxes merge in O(n log n).
+    """
+    if not len(boxes):
+        return []
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    while len(boxes) > 1:
+        merged = _merge_pass(boxes, margin)
+        if len(merged) == len(boxes):
+            break
+        boxes = merged
+    boxes = boxes[np.lexsort(boxes.T[::-1])]
+    return [tuple(box) for box in boxes.tolist()]
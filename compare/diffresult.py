@@ -0,0 +1,121 @@
+import json
+
+import cv2
+import numpy as np
+
+# Region classification: "removed" content is only in the first input,
+# "added" content only in the second
+REGION_KINDS = ('added', 'removed')
+
+# Page keys kept when a client submits a diff result for storage
+PAGE_FIELDS = ('page', 'page2', 'status', 'mode', 'width', 'height', 'regions', 'changes', 'error')
+
+
+def mask_regions(mask, image1, image2):
+    """
+    Splits a binary difference mask into 8-connected regions and classifies
+    them. Returns (labels, regions): the label image of
+    cv2.connectedComponentsWithStats and, for labels 1..n in order,
+    ((x0, y0, x1, y1), kind) tuples. kind is "removed" when the differing
+    pixels of the region are darker in image1 than in image2 and "added"
+    otherwise.
+    """
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if count <= 1:
+        return labels, []
+
+    # Per-label sums of image1 - image2 over the differing pixels only
+    pixels = np.flatnonzero(mask)
+    channels = image1.shape[2] if image1.ndim == 3 else 1
+    delta = (image1.reshape(-1, channels)[pixels].sum(axis=1, dtype=np.int32)
+             - image2.reshape(-1, channels)[pixels].sum(axis=1, dtype=np.int32))
+    removed = np.bincount(labels.ravel()[pixels], weights=delta, minlength=count) < 0
+
+    x0 = stats[1:, cv2.CC_STAT_LEFT]
+    y0 = stats[1:, cv2.CC_STAT_TOP]
+    boxes = np.stack([x0, y0, x0 + stats[1:, cv2.CC_STAT_WIDTH], y0 + stats[1:, cv2.CC_STAT_HEIGHT]], axis=1)
+    regions = [
+        (tuple(box), "removed" if is_removed else "added")
+        for box, is_removed in zip(boxes.tolist(), removed[1:].tolist())
+    ]
+    return labels, regions
+
+def region_area(bbox):
+    x0, y0, x1, y1 = bbox
+    return max(0, x1 - x0) * max(0, y1 - y0)
+
+def page_stats(regions, width, height):
+    """
+    Returns the region counts and bounding box areas per kind for one page,
+    and the fraction of the page they cover.
+    """
+    stats = {"regions": len(regions)}
+    for kind in REGION_KINDS:
+        areas = [region_area(region["bbox"]) for region in regions if region["kind"] == kind]
+        stats[kind] = len(areas)
+        stats[f"{kind}_area"] = round(sum(areas), 2)
+    page_area = (width or 0) * (height or 0)
+    changed_area = stats["added_area"] + stats["removed_area"]
+    stats["changed_fraction"] = round(min(1.0, changed_area / page_area), 6) if page_area else 0.0
+    return stats
+
+def summarize_pages(pages):
+    """
+    Sets "regions" and "stats" on every page result and returns the summary
+    across pages.
+    """
+    summary = {"pages": len(pages), "pages_changed": 0, "pages_inserted": 0, "pages_deleted": 0, "pages_skipped": 0}
+    totals = dict.fromkeys(("regions", "added", "removed", "added_area", "removed_area"), 0)
+    for page in pages:
+        page["regions"] = page.get("regions") or []
+        page["stats"] = page_stats(page["regions"], page.get("width"), page.get("height"))
+        if page.get("status") in ("changed", "inserted", "deleted", "skipped"):
+            summary[f"pages_{page['status']}"] += 1
+        for key in totals:
+            totals[key] += page["stats"][key]
+    totals["added_area"] = round(totals["added_area"], 2)
+    totals["removed_area"] = round(totals["removed_area"], 2)
+    summary.update(totals)
+    return summary
+
+def _validate_region(region):
+    if not isinstance(region, dict) or region.get("kind") not in REGION_KINDS:
+        raise ValueError("Each region needs a kind of 'added' or 'removed'.")
+    bbox = region.get("bbox")
+    if (not isinstance(bbox, list) or len(bbox) != 4
+            or not all(isinstance(value, (int, float)) for value in bbox)):
+        raise ValueError("Each region needs a bbox of four numbers.")
+    return {"bbox": bbox, "kind": region["kind"]}
+
+def normalize_diff_result(data):
+    """
+    Validates a structured diff result submitted by a client (a JSON string
+    or dict with a "pages" list, as returned by the comparison endpoints) and
+    returns the form stored on a Comparison: the known page fields with
+    recomputed stats, and the summary. Raises ValueError when it is malformed.
+    """
+    if isinstance(data, (str, bytes)):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            raise ValueError("diff_result must be valid JSON.")
+    if not isinstance(data, dict) or not isinstance(data.get("pages"), list):
+        raise ValueError("diff_result must be an object with a pages list.")
+
+    pages = []
+    for page in data["pages"]:
+        if not isinstance(page, dict):
+            raise ValueError("Each page must be an object.")
+        # Inserted pages only have a page number in the second document
+        numbers = [page.get(key) for key in ("page", "page2")]
+        if (not any(isinstance(number, int) for number in numbers)
+                or not all(number is None or isinstance(number, int) for number in numbers)):
+            raise ValueError("Each page needs an integer page or page2 number.")
+        page = {key: page[key] for key in PAGE_FIELDS if key in page}
+        for key in ("width", "height"):
+            if not isinstance(page.get(key, 0), (int, float)):
+                raise ValueError(f"Page {key} must be a number.")
+        page["regions"] = [_validate_region(region) for region in page.get("regions") or []]
+        pages.append(page)
+
+    return {"summary": summarize_pages(pages), "pages": pages}
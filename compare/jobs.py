@@ -0,0 +1,156 @@
+import os
+import shutil
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ComparisonJob
+from .blobstore import file_sha256
+from .uploads import IngestedUpload, ingest_upload
+from .workspaces import reap_in_background
+from . import viewsImage
+from . import viewsPdf
+
+
+def job_input_dir(job_id):
+    return os.path.join(settings.COMPARISON_JOBS_DIR, str(job_id))
+
+def job_output_dir(job_id, attempt):
+    """
+    The workspace of one attempt at a job, created when the comparison runs;
+    published into the result cache when enabled.
+    """
+    return os.path.join(settings.COMPARE_WORKSPACE_DIR, f"job-{job_id}-{attempt}")
+
+def enqueue_job(job_type, file1, file2, options=None):
+    """
+    Stores the two uploaded files and queues a comparison job for them.
+    """
+    job = ComparisonJob(job_type=job_type, options=options or {})
+    input_dir = job_input_dir(job.id)
+    try:
+        for index, upload in enumerate((file1, file2), start=1):
+            ingested = ingest_upload(upload, directory=input_dir)
+            setattr(job, f"file{index}_path", ingested.path)
+            # Kept for the result cache key
+            job.options[f"file{index}_sha256"] = ingested.sha256
+        job.save()
+    except BaseException:
+        shutil.rmtree(input_dir, ignore_errors=True)
+        raise
+    return job
+
+def stale_jobs(now):
+    """
+    Running jobs whose worker has not reported for COMPARISON_JOB_LEASE
+    seconds, as a filter; jobs without a heartbeat count from their start.
+    """
+    cutoff = now - timedelta(seconds=settings.COMPARISON_JOB_LEASE)
+    return Q(status=ComparisonJob.STATUS_RUNNING) & (
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+
+def claim_next_job():
+    """
+    Marks the oldest queued job as running and returns it, or None when the
+    queue is empty. Stale running jobs (see stale_jobs()) are claimed again,
+    or failed once they have been run COMPARISON_JOB_MAX_ATTEMPTS times. The
+    conditional update makes claiming safe when several workers poll the
+    same table.
+    """
+    now = timezone.now()
+    abandoned = ComparisonJob.objects.filter(
+        stale_jobs(now), attempts__gte=settings.COMPARISON_JOB_MAX_ATTEMPTS
+    ).values_list('id', flat=True)
+    for job_id in abandoned:
+        failed = ComparisonJob.objects.filter(stale_jobs(now), id=job_id).update(
+            status=ComparisonJob.STATUS_FAILED, finished_at=now,
+            error=f"The job's worker stopped responding {settings.COMPARISON_JOB_MAX_ATTEMPTS} times.",
+        )
+        if failed:
+            shutil.rmtree(job_input_dir(job_id), ignore_errors=True)
+
+    claimable = Q(status=ComparisonJob.STATUS_QUEUED) | (
+        stale_jobs(now) & Q(attempts__lt=settings.COMPARISON_JOB_MAX_ATTEMPTS)
+    )
+    candidates = (
+        ComparisonJob.objects.filter(claimable)
+        .order_by('created_at')
+        .values_list('id', flat=True)[:10]
+    )
+    for job_id in candidates:
+        claimed = ComparisonJob.objects.filter(claimable, id=job_id).update(
+            status=ComparisonJob.STATUS_RUNNING, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1
+        )
+        if claimed:
+            return ComparisonJob.objects.get(id=job_id)
+    return None
+
+def run_job(job):
+    """
+    Executes a claimed job and records its result or error. Progress reports
+    also refresh the job's heartbeat.
+
+    A slow attempt may be claimed again while it still runs, so every
+    attempt works in its own workspace and only updates the job, and removes
+    its inputs, as long as no later attempt has claimed it.
+    """
+    current_attempt = ComparisonJob.objects.filter(id=job.id, attempts=job.attempts)
+
+    def progress(pages_done, pages_total):
+        current_attempt.update(pages_done=pages_done, pages_total=pages_total, heartbeat_at=timezone.now())
+
+    reap_in_background()
+    output_dir = job_output_dir(job.id, job.attempts)
+    upload1 = IngestedUpload(job.file1_path, job.options.get('file1_sha256') or file_sha256(job.file1_path), None, None)
+    upload2 = IngestedUpload(job.file2_path, job.options.get('file2_sha256') or file_sha256(job.file2_path), None, None)
+    try:
+        if job.job_type == 'pdf':
+            result = viewsPdf.run_cached_pdf_comparison(
+                upload1,
+                upload2,
+                output_dir,
+                workers=job.options.get('workers', 1),
+                progress=progress,
+                mode=job.options.get('mode', 'raster'),
+                output=job.options.get('output', 'raster'),
+            )
+        elif job.job_type == 'image':
+            progress(0, 1)
+            result = viewsImage.run_cached_image_comparison(upload1, upload2, output_dir=output_dir)
+            progress(1, 1)
+        else:
+            raise ValueError(f"Unknown job type: {job.job_type}")
+    except Exception as e:
+        traceback.print_exc()
+        recorded = current_attempt.update(
+            status=ComparisonJob.STATUS_FAILED, error=str(e), finished_at=timezone.now()
+        )
+    else:
+        recorded = current_attempt.update(
+            status=ComparisonJob.STATUS_DONE, result=result, finished_at=timezone.now()
+        )
+    if recorded:
+        shutil.rmtree(job_input_dir(job.id), ignore_errors=True)
+    else:
+        print(f"{job} was claimed again while it ran; discarding attempt {job.attempts}")
+
+def run_worker(poll_interval=None, burst=False):
+    """
+    Processes queued jobs until interrupted. With burst=True the worker exits
+    as soon as the queue is empty.
+    """
+    poll_interval = poll_interval or settings.COMPARISON_WORKER_POLL_INTERVAL
+    while True:
+        job = claim_next_job()
+        if job is None:
+            if burst:
+                return
+            time.sleep(poll_interval)
+            continue
+        print(f"Running {job}")
+        run_job(job)
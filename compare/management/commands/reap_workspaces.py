@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from compare.workspaces import reap_workspaces
+
+
+class Command(BaseCommand):
+    help = "Removes expired comparison workspaces and the least recently used ones over the disk budget."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ttl', type=int, default=None,
+            help="Seconds a workspace may stay unused (COMPARE_WORKSPACE_TTL by default).",
+        )
+        parser.add_argument(
+            '--max-bytes', type=int, default=None,
+            help="Total size workspaces may take (COMPARE_WORKSPACE_MAX_BYTES by default).",
+        )
+
+    def handle(self, *args, **options):
+        removed, freed = reap_workspaces(ttl=options['ttl'], max_bytes=options['max_bytes'])
+        self.stdout.write(f"Removed {removed} workspaces, {freed} bytes.")
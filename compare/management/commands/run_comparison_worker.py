@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from compare.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = "Runs queued PDF and image comparison jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval', type=float, default=None,
+            help="Seconds to wait between polls when the queue is empty.",
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help="Exit once the queue is empty instead of waiting for new jobs.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Comparison worker started.")
+        try:
+            run_worker(poll_interval=options['poll_interval'], burst=options['burst'])
+        except KeyboardInterrupt:
+            self.stdout.write("Comparison worker stopped.")
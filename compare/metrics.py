@@ -0,0 +1,144 @@
+import bisect
+import threading
+from datetime import timedelta
+
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+
+from .models import ComparisonJob
+from .resultcache import get_result_cache
+from .timing import STAGES
+
+# Upper bounds, in seconds, of the histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram:
+    """
+    A Prometheus histogram kept in process memory. Each gunicorn worker has
+    its own, so scrape every process or run one; job_seconds() is loaded
+    from the database instead.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts (non-cumulative, plus +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def set_series(self, labelvalues, cumulative_counts, total):
+        """Replaces a series with cumulative bucket counts (plus +Inf) and sum computed elsewhere."""
+        counts = [count - previous for count, previous in zip(cumulative_counts, [0] + cumulative_counts[:-1])]
+        with self._lock:
+            self._series[labelvalues] = [counts, total]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labelvalues, list(counts), total) for labelvalues, (counts, total) in self._series.items())
+        for labelvalues, counts, total in series:
+            labels = [f'{name}="{value}"' for name, value in zip(self.labelnames, labelvalues)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                bucket_labels = ','.join(labels + [f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = f"{{{','.join(labels)}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+COMPARISON_SECONDS = Histogram(
+    'compare_comparison_seconds', "Wall time of requests that ran a comparison pipeline.", ('source',)
+)
+STAGE_SECONDS = Histogram(
+    'compare_stage_seconds', "Time spent in each pipeline stage per comparison.", ('stage',)
+)
+PAGE_SECONDS = Histogram(
+    'compare_page_seconds', "Time spent comparing one PDF page pair, summed over its stages."
+)
+PAGE_STAGE_SECONDS = Histogram(
+    'compare_page_stage_seconds', "Time spent in each pipeline stage per compared PDF page pair.", ('stage',)
+)
+
+
+def observe_comparison(source, seconds, stage_times):
+    """Records a request (source) that took seconds, with its collect_stage_times() dict."""
+    COMPARISON_SECONDS.observe(seconds, source)
+    for name, (stage_seconds, _) in stage_times.items():
+        STAGE_SECONDS.observe(stage_seconds, name)
+
+def observe_page(stage_times):
+    """Records the collect_stage_times() dict of one compared page pair."""
+    if not stage_times:
+        return
+    PAGE_SECONDS.observe(sum(seconds for seconds, _ in stage_times.values()))
+    for name, (seconds, _) in stage_times.items():
+        PAGE_STAGE_SECONDS.observe(seconds, name)
+
+def server_timing(stage_times, total_seconds):
+    """Formats stage times and the total, in milliseconds, as a Server-Timing header value."""
+    entries = [f"{name};dur={stage_times[name][0] * 1000:.1f}" for name in STAGES if name in stage_times]
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ', '.join(entries)
+
+def job_seconds():
+    """
+    Returns the compare_job_seconds histogram of the finished jobs in the
+    database, from claim to finish, so it covers every job worker, none of
+    which serves /metrics.
+    """
+    histogram = Histogram(
+        'compare_job_seconds', "Wall time of finished comparison jobs, from all workers.", ('job_type', 'status')
+    )
+    duration = ExpressionWrapper(F('finished_at') - F('started_at'), output_field=DurationField())
+    rows = (
+        ComparisonJob.objects.filter(started_at__isnull=False, finished_at__isnull=False)
+        .annotate(duration=duration)
+        .values('job_type', 'status')
+        .annotate(
+            total=Sum('duration'),
+            count=Count('id'),
+            **{
+                f'le_{index}': Count('id', filter=Q(duration__lte=timedelta(seconds=bound)))
+                for index, bound in enumerate(histogram.buckets)
+            },
+        )
+    )
+    for row in rows:
+        cumulative_counts = [row[f'le_{index}'] for index in range(len(histogram.buckets))] + [row['count']]
+        total = row['total'].total_seconds() if row['total'] else 0.0
+        histogram.set_series((row['job_type'], row['status']), cumulative_counts, total)
+    return histogram
+
+def render_metrics():
+    """
+    Returns the metrics of this process, and the job metrics kept in the
+    database, in the Prometheus text exposition format.
+    """
+    lines = []
+    for histogram in (COMPARISON_SECONDS, STAGE_SECONDS, PAGE_SECONDS, PAGE_STAGE_SECONDS, job_seconds()):
+        lines.extend(histogram.render())
+
+    stats = get_result_cache().stats()
+    for name, kind, documentation, value in (
+        ('compare_result_cache_hits_total', 'counter', "Result cache hits.", stats["hits"]),
+        ('compare_result_cache_misses_total', 'counter', "Result cache misses.", stats["misses"]),
+        ('compare_result_cache_entries', 'gauge', "Complete entries in the result cache.", stats["entries"]),
+        ('compare_result_cache_bytes', 'gauge', "Size of the result cache on disk.", stats["bytes"]),
+        ('compare_result_cache_max_bytes', 'gauge', "Result cache size limit.", stats["max_bytes"]),
+    ):
+        lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", f"{name} {value}"])
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,26 @@
+import time
+
+from .metrics import observe_comparison, server_timing
+from .timing import collect_stage_times
+
+
+class ServerTimingMiddleware:
+    """
+    Times the pipeline stages run while handling each request. For requests
+    that ran any, the stage times are added to the response as a
+    Server-Timing header and recorded in the metrics served at /metrics.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with collect_stage_times() as stage_times:
+            response = self.get_response(request)
+        if stage_times:
+            total_seconds = time.perf_counter() - start
+            response['Server-Timing'] = server_timing(stage_times, total_seconds)
+            match = request.resolver_match
+            observe_comparison(match.url_name if match else request.path, total_seconds, stage_times)
+        return response
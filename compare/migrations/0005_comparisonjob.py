@@ -0,0 +1,32 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:12
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compare', '0004_remove_comparison_highlighted_differences_url_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComparisonJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('job_type', models.CharField(choices=[('image', 'Image'), ('pdf', 'PDF')], max_length=10)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('options', models.JSONField(blank=True, default=dict)),
+                ('file1_path', models.CharField(max_length=1024)),
+                ('file2_path', models.CharField(max_length=1024)),
+                ('pages_done', models.PositiveIntegerField(default=0)),
+                ('pages_total', models.PositiveIntegerField(default=0)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
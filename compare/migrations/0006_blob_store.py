@@ -0,0 +1,75 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:41
+
+from django.db import migrations, models
+
+from compare.blobstore import get_blob_store
+
+
+def move_blobs_to_store(apps, schema_editor):
+    File = apps.get_model('compare', 'File')
+    Comparison = apps.get_model('compare', 'Comparison')
+    store = get_blob_store()
+
+    files = File.objects.filter(file_data__isnull=False).only('id', 'file_data')
+    for file in files.iterator(chunk_size=50):
+        data = bytes(file.file_data)
+        File.objects.filter(id=file.id).update(content_hash=store.put_bytes(data), size=len(data))
+
+    comparisons = Comparison.objects.filter(highlighted_differences_file__isnull=False).only(
+        'id', 'highlighted_differences_file'
+    )
+    for comparison in comparisons.iterator(chunk_size=50):
+        Comparison.objects.filter(id=comparison.id).update(
+            highlighted_differences_hash=store.put_bytes(bytes(comparison.highlighted_differences_file))
+        )
+
+
+def load_blobs_from_store(apps, schema_editor):
+    File = apps.get_model('compare', 'File')
+    Comparison = apps.get_model('compare', 'Comparison')
+    store = get_blob_store()
+
+    for file in File.objects.filter(content_hash__isnull=False).only('id', 'content_hash').iterator():
+        File.objects.filter(id=file.id).update(file_data=store.read(file.content_hash))
+
+    comparisons = Comparison.objects.filter(highlighted_differences_hash__isnull=False).only(
+        'id', 'highlighted_differences_hash'
+    )
+    for comparison in comparisons.iterator():
+        Comparison.objects.filter(id=comparison.id).update(
+            highlighted_differences_file=store.read(comparison.highlighted_differences_hash)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compare', '0005_comparisonjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comparison',
+            name='highlighted_differences_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(move_blobs_to_store, load_blobs_from_store),
+        migrations.RemoveField(
+            model_name='comparison',
+            name='highlighted_differences_file',
+        ),
+        migrations.RemoveField(
+            model_name='file',
+            name='file_data',
+        ),
+    ]
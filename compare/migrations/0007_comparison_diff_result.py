@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compare', '0006_blob_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comparison',
+            name='diff_result',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compare', '0007_comparison_diff_result'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comparisonjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comparisonjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
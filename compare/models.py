@@ -1,6 +1,10 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 
+from .blobstore import get_blob_store
+
 class Project(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
@@ -20,7 +24,8 @@ class File(models.Model):
 
     name = models.CharField(max_length=255)
     type = models.CharField(max_length=10, choices=FILE_TYPES)
-    file_data = models.BinaryField(null=True)
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)  # SHA-256 of the blob
+    size = models.PositiveBigIntegerField(blank=True, null=True)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='files')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -28,6 +33,10 @@ class File(models.Model):
     def __str__(self):
         return self.name
 
+    def open_content(self):
+        """Opens the file content in the blob store for streamed reading."""
+        return get_blob_store().open(self.content_hash)
+
 class Comparison(models.Model):
     COMPARISON_TYPES = [
         ('image', 'Image'),
@@ -40,7 +49,8 @@ class Comparison(models.Model):
     file2 = models.ForeignKey(File, on_delete=models.CASCADE, related_name='comparison_file2')
     comparison_type = models.CharField(max_length=10, choices=COMPARISON_TYPES)
     result_url = models.TextField(blank=True, null=True)
-    highlighted_differences_file = models.BinaryField(blank=True, null=True)  # Store the file directly
+    highlighted_differences_hash = models.CharField(max_length=64, blank=True, null=True)  # Blob store key
+    diff_result = models.JSONField(blank=True, null=True)  # Summary and per-page regions, see diffresult.py
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -54,3 +64,40 @@ class Session(models.Model):
 
     def __str__(self):
         return f"Session for {self.user.username}"
+
+class ComparisonJob(models.Model):
+    JOB_TYPES = [
+        ('image', 'Image'),
+        ('pdf', 'PDF'),
+    ]
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUSES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    job_type = models.CharField(max_length=10, choices=JOB_TYPES)
+    status = models.CharField(max_length=10, choices=STATUSES, default=STATUS_QUEUED, db_index=True)
+    options = models.JSONField(default=dict, blank=True)
+    file1_path = models.CharField(max_length=1024)
+    file2_path = models.CharField(max_length=1024)
+    pages_done = models.PositiveIntegerField(default=0)
+    pages_total = models.PositiveIntegerField(default=0)
+    result = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # Refreshed by the worker as the job progresses; see jobs.claim_next_job
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"ComparisonJob {self.id} ({self.job_type}, {self.status})"
@@ -0,0 +1,103 @@
+import hashlib
+from collections import namedtuple
+
+import cv2
+import fitz
+import numpy as np
+
+from .timing import stage
+
+# Thumbnail scale used to fingerprint and match pages
+FINGERPRINT_ZOOM = 0.5
+# Side, in pixels, of the thumbnail compared between pages
+SIGNATURE_SIZE = 32
+
+# digest: equal for pages that render identically; thumbnail: small
+# grayscale rendering used to score how similar two pages are
+PageSignature = namedtuple('PageSignature', ['digest', 'thumbnail'])
+
+
+def page_signature(page, zoom=FINGERPRINT_ZOOM):
+    """Renders a page once as a grayscale thumbnail and returns its PageSignature."""
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+    digest = hashlib.blake2b(pix.samples, digest_size=16).hexdigest()
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    thumbnail = cv2.resize(gray, (SIGNATURE_SIZE, SIGNATURE_SIZE), interpolation=cv2.INTER_AREA)
+    return PageSignature(digest, thumbnail.astype(np.float32).ravel() / 255)
+
+def document_signatures(pdf_document):
+    return [page_signature(page) for page in pdf_document]
+
+def distance_matrix(signatures1, signatures2):
+    """
+    Returns the root mean square thumbnail difference (0 to 1) of every page
+    pair, 0 for pages with equal digests.
+    """
+    if not signatures1 or not signatures2:
+        return np.zeros((len(signatures1), len(signatures2)), dtype=np.float32)
+    thumbnails1 = np.stack([signature.thumbnail for signature in signatures1])
+    thumbnails2 = np.stack([signature.thumbnail for signature in signatures2])
+    # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, for all pairs at once
+    squared = (
+        (thumbnails1 ** 2).sum(axis=1)[:, None]
+        + (thumbnails2 ** 2).sum(axis=1)[None, :]
+        - 2 * thumbnails1 @ thumbnails2.T
+    )
+    distances = np.sqrt(np.maximum(squared, 0) / thumbnails1.shape[1])
+    digests1 = np.array([signature.digest for signature in signatures1])
+    digests2 = np.array([signature.digest for signature in signatures2])
+    distances[digests1[:, None] == digests2[None, :]] = 0
+    return distances
+
+def align_pages(signatures1, signatures2, gap_cost):
+    """
+    Aligns two page sequences with an edit-distance dynamic program and
+    returns (page_number1, page_number2) pairs in document order; unmatched
+    pages have None on the other side. Leaving a page unmatched costs
+    gap_cost and matching two pages costs their distance, capped at
+    2 * gap_cost: a pair of pages, however different, is only reported as
+    a deletion and an insertion when that lets other pages match better.
+    Ties go to matching.
+    """
+    distances = np.minimum(distance_matrix(signatures1, signatures2), 2 * gap_cost)
+    rows, columns = distances.shape
+    cost = np.zeros((rows + 1, columns + 1), dtype=np.float64)
+    cost[:, 0] = np.arange(rows + 1) * gap_cost
+    cost[0, :] = np.arange(columns + 1) * gap_cost
+    offsets = np.arange(columns + 1) * gap_cost
+    for i in range(1, rows + 1):
+        # Best of matching and deleting, then insertions along the row:
+        # cost[i, j] = min over k <= j of best[k] + (j - k) * gap_cost
+        best = np.empty(columns + 1)
+        best[0] = cost[i, 0]
+        best[1:] = np.minimum(cost[i - 1, :-1] + distances[i - 1], cost[i - 1, 1:] + gap_cost)
+        cost[i] = np.minimum.accumulate(best - offsets) + offsets
+
+    pairs = []
+    i, j = rows, columns
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and np.isclose(cost[i, j], cost[i - 1, j - 1] + distances[i - 1, j - 1]):
+            pairs.append((i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif i > 0 and np.isclose(cost[i, j], cost[i - 1, j] + gap_cost):
+            pairs.append((i - 1, None))
+            i -= 1
+        else:
+            pairs.append((None, j - 1))
+            j -= 1
+    pairs.reverse()
+    return pairs
+
+def match_pages(pdf1, pdf2, gap_cost):
+    """
+    Aligns the pages of two open documents and returns
+    (page_number1, page_number2, identical) triples in document order, with
+    None for a page missing on one side. identical is True for matched pages
+    that render identically.
+    """
+    with stage('pagematch'):
+        signatures1, signatures2 = document_signatures(pdf1), document_signatures(pdf2)
+        return [
+            (i, j, i is not None and j is not None and signatures1[i].digest == signatures2[j].digest)
+            for i, j in align_pages(signatures1, signatures2, gap_cost)
+        ]
@@ -0,0 +1,232 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .workspaces import create_workspace, workspace_in_use
+
+RESULT_FILE = 'result.json'
+# Seconds the entry count and size reported by stats() may be out of date
+STATS_MAX_AGE = 60
+
+
+def media_url(path):
+    """Returns the public URL of a path under MEDIA_ROOT."""
+    return f"{settings.MEDIA_URL}{os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')}"
+
+def relocate_urls(value, old_url, new_url):
+    """Returns a result payload with the URLs of files under old_url pointing under new_url."""
+    if isinstance(value, dict):
+        return {key: relocate_urls(item, old_url, new_url) for key, item in value.items()}
+    if isinstance(value, list):
+        return [relocate_urls(item, old_url, new_url) for item in value]
+    if isinstance(value, str) and value.startswith(old_url + '/'):
+        return new_url + value[len(old_url):]
+    return value
+
+
+class ResultCache:
+    """
+    Memoizes comparison results on local disk.
+
+    Each entry is a directory under root named after the SHA-256 of its key
+    (input file hashes, comparison type and pipeline parameters). It holds
+    the artifacts written by the comparison and result.json with the
+    response payload. Comparisons run in a workspace of their own that is
+    renamed into place with result.json already in it, so entries are
+    never written to once they exist. The
+    modification time of result.json is bumped on every hit and entries
+    are evicted least recently used first once the cache grows past
+    max_bytes. max_bytes=0 disables caching.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # (time.monotonic(), entries, bytes) of the last walk of the cache
+        self._usage = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(file1_hash, file2_hash, comparison_type, params):
+        payload = json.dumps(
+            {"file1": file1_hash, "file2": file2_hash, "type": comparison_type, "params": params},
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        """Returns the cached result for key, or None."""
+        result_path = os.path.join(self.entry_dir(key), RESULT_FILE)
+        try:
+            with open(result_path) as f:
+                result = json.load(f)
+            os.utime(result_path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return result
+
+    def publish(self, key, output_dir, result):
+        """
+        Moves output_dir, holding the artifacts of result, into the entry for
+        key with one rename and returns result with its URLs pointing into
+        the entry. When another computation published key first, output_dir
+        is discarded and the published result is returned instead.
+        """
+        entry_dir = self.entry_dir(key)
+        result = relocate_urls(result, media_url(output_dir), media_url(entry_dir))
+        # Written before the rename, so the entry is complete once it appears
+        with open(os.path.join(output_dir, RESULT_FILE), 'w') as f:
+            json.dump(result, f)
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        try:
+            try:
+                os.rename(output_dir, entry_dir)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # Workspaces on another file system: copy next to the entry first
+                staging_dir = f"{entry_dir}.{uuid.uuid4().hex}"
+                shutil.copytree(output_dir, staging_dir)
+                shutil.rmtree(output_dir, ignore_errors=True)
+                output_dir = staging_dir
+                os.rename(output_dir, entry_dir)
+        except OSError:
+            published = self.get(key)
+            if published is None:
+                # The entry directory is a leftover without a result; keep ours where it is
+                os.remove(os.path.join(output_dir, RESULT_FILE))
+                return relocate_urls(result, media_url(entry_dir), media_url(output_dir))
+            shutil.rmtree(output_dir, ignore_errors=True)
+            return published
+        self.evict()
+        return result
+
+    def get_or_compute(self, key, compute, output_dir=None):
+        """
+        Returns (result, cached). On a miss, compute(output_dir) runs the
+        comparison, writing its artifacts to output_dir (a new workspace by
+        default) that nothing else writes to and that is marked in use, and
+        the directory is published into the cache. Concurrent misses on one key each compute on their
+        own and the first to publish wins; a failed computation only removes
+        its own directory.
+        """
+        if self.enabled:
+            result = self.get(key)
+            with self._lock:
+                if result is not None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if result is not None:
+                return result, True
+
+        output_dir = output_dir or create_workspace()
+        os.makedirs(output_dir, exist_ok=True)
+        with workspace_in_use(output_dir):
+            try:
+                result = compute(output_dir)
+            except BaseException:
+                shutil.rmtree(output_dir, ignore_errors=True)
+                raise
+            if not self.enabled:
+                return result, False
+            return self.publish(key, output_dir, result), False
+
+    def entries(self):
+        """Returns (last used, size in bytes, path) for every complete entry."""
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    last_used = os.stat(os.path.join(entry.path, RESULT_FILE)).st_mtime
+                except FileNotFoundError:
+                    # Still being written
+                    continue
+                size = sum(
+                    os.path.getsize(os.path.join(dirpath, name))
+                    for dirpath, _, names in os.walk(entry.path) for name in names
+                )
+                entries.append((last_used, size, entry.path))
+        return entries
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_bytes."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                # Shard still holds other entries
+                pass
+            total, count = total - size, count - 1
+        with self._lock:
+            self._usage = (time.monotonic(), count, total)
+
+    def stats(self):
+        """
+        Returns the hit and miss counts of this process and the entry count
+        and size of the cache, as of the last eviction or of a walk at most
+        STATS_MAX_AGE seconds ago, so frequent scrapes do not walk the cache.
+        """
+        with self._lock:
+            usage = self._usage
+        if usage is None or time.monotonic() - usage[0] > STATS_MAX_AGE:
+            entries = self.entries()
+            usage = (time.monotonic(), len(entries), sum(size for _, size, _ in entries))
+        with self._lock:
+            self._usage = usage
+            hits, misses = self.hits, self.misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "entries": usage[1],
+            "bytes": usage[2],
+            "max_bytes": self.max_bytes,
+        }
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    """Returns the process-wide ResultCache configured by the RESULT_CACHE_* settings."""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(settings.RESULT_CACHE_DIR, settings.RESULT_CACHE_MAX_BYTES)
+        return _result_cache
+
+@receiver(setting_changed)
+def reset_result_cache(setting, **kwargs):
+    """Rebuilds the process-wide ResultCache when its settings change, e.g. under override_settings."""
+    global _result_cache
+    if setting in ('RESULT_CACHE_DIR', 'RESULT_CACHE_MAX_BYTES'):
+        with _result_cache_lock:
+            _result_cache = None
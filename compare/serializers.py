@@ -20,8 +20,8 @@ class FileSerializer(serializers.ModelSerializer):
     project_name = serializers.ReadOnlyField(source='project.name')
     class Meta:
         model = File
-        fields = ['id', 'name', 'type', 'url', 'project','project_name', 'created_at', 'updated_at']
-        read_only_fields = ['created_at', 'updated_at', 'project_name']
+        fields = ['id', 'name', 'type', 'content_hash', 'size', 'project','project_name', 'created_at', 'updated_at']
+        read_only_fields = ['content_hash', 'size', 'created_at', 'updated_at', 'project_name']
 
 class ComparisonSerializer(serializers.ModelSerializer):
     file1 = FileSerializer()
@@ -39,10 +39,29 @@ class ComparisonSerializer(serializers.ModelSerializer):
             'file1', 'file1_name', 'file1_id',
             'file2', 'file2_name', 'file2_id',
             'comparison_type', 
-            'result_url', 'highlighted_differences_file',
+            'result_url', 'highlighted_differences_hash',
             'created_at'
         ]
-        read_only_fields = ['created_at', 'project_name', 'file1_name', 'file2_name', 'file1_id', 'file2_id']
+        read_only_fields = ['created_at', 'project_name', 'file1_name', 'file2_name', 'file1_id', 'file2_id', 'highlighted_differences_hash']
+
+class ComparisonListSerializer(serializers.ModelSerializer):
+    """Flat representation for list views: no nested files or stored outputs."""
+    project_name = serializers.ReadOnlyField(source='project.name')
+    file1_name = serializers.ReadOnlyField(source='file1.name')
+    file2_name = serializers.ReadOnlyField(source='file2.name')
+    file1_type = serializers.ReadOnlyField(source='file1.type')
+    file2_type = serializers.ReadOnlyField(source='file2.type')
+
+    class Meta:
+        model = Comparison
+        fields = [
+            'id', 'project', 'project_name',
+            'file1_id', 'file1_name', 'file1_type',
+            'file2_id', 'file2_name', 'file2_type',
+            'comparison_type',
+            'created_at'
+        ]
+        read_only_fields = fields
 
 
 class SessionSerializer(serializers.ModelSerializer):
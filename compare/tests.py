@@ -1,3 +1,962 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+import cv2
+import fitz
+import numpy as np
+from rest_framework.test import APIClient
+
+from .alignment import AlignmentEngine
+from .blobstore import BlobStore, get_blob_store
+from .boxmerge import merge_boxes
+from .diffresult import mask_regions, region_area
+from .jobs import claim_next_job, enqueue_job, run_job
+from .metrics import render_metrics
+from .middleware import ServerTimingMiddleware
+from .models import Comparison, ComparisonJob, File, Project
+from .pagematch import PageSignature, align_pages, match_pages
+from .resultcache import ResultCache, get_result_cache
+from .timing import collect_stage_times, stage
+from .uploads import IngestedUpload, UploadTooLarge, discard_upload, ingest_upload
+from .viewsImage import process_and_compare, run_image_batch
+from .viewsPdf import (
+    ANNOTATION_COLORS, COMPARE_BYTES_PER_PIXEL, GRAY_COMPARE_BYTES_PER_PIXEL, compare_page_pair, render_page, render_scale_for,
+    run_pdf_comparison,
+)
+from .workspaces import reap_workspaces, workspace_in_use
+
+CORPUS_DIR = os.path.join(settings.BASE_DIR, 'media', 'temp_files')
+
+
+class ComparisonListQueryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reviewer', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_comparisons(self, count):
+        project = Project.objects.create(name='Contracts', user=self.user)
+        for index in range(count):
+            file1 = File.objects.create(name=f'a{index}.pdf', type='pdf', project=project, content_hash='0' * 64)
+            file2 = File.objects.create(name=f'b{index}.pdf', type='pdf', project=project, content_hash='1' * 64)
+            Comparison.objects.create(
+                project=project, file1=file1, file2=file2, comparison_type='pdf', result_url='x' * 1000,
+            )
+
+    def test_comparison_list_query_count_is_fixed_per_page(self):
+        self.create_comparisons(30)
+
+        # One COUNT for the paginator and one SELECT joining project and files
+        for per_page in (5, 30):
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/comparisons/', {'per_page': per_page})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), per_page)
+
+    def test_comparison_list_uses_flat_representation(self):
+        self.create_comparisons(1)
+
+        row = self.client.get('/api/comparisons/').data['results'][0]
+
+        self.assertEqual(row['file1_name'], 'a0.pdf')
+        self.assertEqual(row['file2_type'], 'pdf')
+        for field in ('file1', 'file2', 'result_url', 'highlighted_differences_hash'):
+            self.assertNotIn(field, row)
+
+    def test_comparison_detail_nests_files(self):
+        self.create_comparisons(1)
+        comparison = Comparison.objects.get()
+
+        response = self.client.get(f'/api/comparisons/{comparison.id}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['file1']['name'], 'a0.pdf')
+        self.assertEqual(response.data['file1']['project_name'], 'Contracts')
+
+    def test_file_list_query_count_is_fixed_per_page(self):
+        self.create_comparisons(15)
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/files/', {'per_page': 30})
+        self.assertEqual(len(response.data['results']), 30)
+
+
+class ServeFileTests(TestCase):
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(BLOB_STORE_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = User.objects.create_user(username='reviewer', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        project = Project.objects.create(name='Contracts', user=user)
+        digest = get_blob_store().put_bytes(self.content)
+        self.file = File.objects.create(
+            name='a.pdf', type='pdf', project=project, content_hash=digest, size=len(self.content)
+        )
+        self.url = f'/api/files/{self.file.id}/content/'
+        self.etag = f'"{digest}"'
+
+    def test_range_returns_the_requested_bytes(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+        suffix = self.client.get(self.url, HTTP_RANGE='bytes=-24')
+        self.assertEqual(b''.join(suffix.streaming_content), self.content[-24:])
+
+    def test_unsatisfiable_range_is_416(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_if_range_with_another_etag_returns_the_whole_file(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_matching_etag_is_304_with_weak_comparison(self):
+        for if_none_match in (self.etag, f'W/{self.etag}', f'"other", W/{self.etag}', '*'):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=if_none_match)
+            self.assertEqual(response.status_code, 304, if_none_match)
+            self.assertEqual(response['ETag'], self.etag)
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+
+class BlobStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = BlobStore(directory.name)
+
+    def blob_files(self):
+        return [
+            name for dirpath, _, names in os.walk(self.store.root)
+            if not dirpath.startswith(os.path.join(self.store.root, 'tmp')) for name in names
+        ]
+
+    def test_same_content_is_stored_once(self):
+        content = os.urandom(3000)
+        digest1, size1 = self.store.put_chunks([content[:1000], content[1000:]])
+        digest2, size2 = self.store.put_chunks([content])
+
+        self.assertEqual(digest1, hashlib.sha256(content).hexdigest())
+        self.assertEqual((digest2, size1, size2), (digest1, 3000, 3000))
+        self.assertEqual(self.blob_files(), [digest1])
+        self.assertEqual(os.listdir(os.path.join(self.store.root, 'tmp')), [])
+        self.assertEqual(self.store.read(digest1), content)
+
+
+class BlobMigrationTests(TransactionTestCase):
+    before = [('compare', '0005_comparisonjob')]
+    after = [('compare', '0006_blob_store')]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(BLOB_STORE_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(self.migrate, MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_file_bytes_move_to_the_store_and_back(self):
+        apps = self.migrate(self.before)
+        user = apps.get_model('auth', 'User').objects.create(username='reviewer')
+        project = apps.get_model('compare', 'Project').objects.create(name='Contracts', user=user)
+        File = apps.get_model('compare', 'File')
+        file1 = File.objects.create(name='a.pdf', type='pdf', project=project, file_data=b'first')
+        file2 = File.objects.create(name='b.pdf', type='pdf', project=project, file_data=b'second')
+        comparison = apps.get_model('compare', 'Comparison').objects.create(
+            project=project, file1=file1, file2=file2, comparison_type='pdf',
+            highlighted_differences_file=b'highlighted',
+        )
+
+        apps = self.migrate(self.after)
+        store = get_blob_store()
+        file = apps.get_model('compare', 'File').objects.get(id=file1.id)
+        self.assertEqual(file.content_hash, hashlib.sha256(b'first').hexdigest())
+        self.assertEqual(file.size, 5)
+        self.assertEqual(store.read(file.content_hash), b'first')
+        migrated = apps.get_model('compare', 'Comparison').objects.get(id=comparison.id)
+        self.assertEqual(store.read(migrated.highlighted_differences_hash), b'highlighted')
+
+        apps = self.migrate(self.before)
+        self.assertEqual(bytes(apps.get_model('compare', 'File').objects.get(id=file2.id).file_data), b'second')
+        restored = apps.get_model('compare', 'Comparison').objects.get(id=comparison.id)
+        self.assertEqual(bytes(restored.highlighted_differences_file), b'highlighted')
+
+
+class ResultCacheStatsTests(TestCase):
+    def test_result_cache_stats_are_for_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='reviewer', password='secret'))
+        self.assertEqual(client.get('/api/result-cache/').status_code, 403)
+        client.force_authenticate(User.objects.create_user(username='admin', password='secret', is_staff=True))
+        self.assertEqual(client.get('/api/result-cache/').status_code, 200)
+
+
+class UploadLimitTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(
+            COMPARE_MAX_UPLOAD_SIZE=100_000,
+            COMPARISON_JOBS_DIR=os.path.join(self.directory, 'jobs'),
+            COMPARE_UPLOAD_TEMP_DIR=os.path.join(self.directory, 'uploads'),
+            FILE_UPLOAD_TEMP_DIR=self.directory,
+            # Spool every upload to a temporary file, as large ones are
+            FILE_UPLOAD_MAX_MEMORY_SIZE=0,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_job(self, size1, size2=10):
+        return self.client.post('/api/jobs/', {
+            'type': 'image',
+            'file1': SimpleUploadedFile('a.png', b'a' * size1),
+            'file2': SimpleUploadedFile('b.png', b'b' * size2),
+        })
+
+    def test_oversized_upload_is_413_without_leaving_files(self):
+        response = self.create_job(100_001)
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('file1', response.json()["error"])
+        self.assertFalse(ComparisonJob.objects.exists())
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_upload_at_the_limit_is_accepted(self):
+        response = self.create_job(100_000)
+        self.assertEqual(response.status_code, 202)
+        job = ComparisonJob.objects.get()
+        self.assertEqual(os.path.getsize(job.file1_path), 100_000)
+
+    def test_ingest_hashes_the_streamed_chunks(self):
+        content = os.urandom(300_000)
+        upload = SimpleUploadedFile('scan.png', content)
+        ingested = ingest_upload(upload, directory=self.directory, max_size=len(content))
+        self.addCleanup(discard_upload, ingested)
+
+        self.assertEqual(ingested.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(ingested.size, len(content))
+        with open(ingested.path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_ingest_stops_once_an_unsized_upload_exceeds_the_limit(self):
+        upload = SimpleUploadedFile('scan.png', b'x' * 200_000)
+        upload.size = None
+        with self.assertRaises(UploadTooLarge):
+            ingest_upload(upload, directory=self.directory, max_size=100_000)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class ComparisonDiffResultTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reviewer', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.project = Project.objects.create(name='Contracts', user=self.user)
+
+    def diff_result(self, page_count):
+        return {
+            "pages": [
+                {
+                    "page": number,
+                    "status": "changed" if number % 2 else "unchanged",
+                    "width": 100,
+                    "height": 200,
+                    "regions": [{"bbox": [10, 10, 20, 30], "kind": "added"}] if number % 2 else [],
+                }
+                for number in range(1, page_count + 1)
+            ]
+        }
+
+    def create_comparison(self, diff_result):
+        return self.client.post('/api/comparisons/create_files_and_comparison/', {
+            'project': self.project.id,
+            'file1_name': 'a.pdf', 'file1_type': 'pdf', 'file1_data': SimpleUploadedFile('a.pdf', b'%PDF-a'),
+            'file2_name': 'b.pdf', 'file2_type': 'pdf', 'file2_data': SimpleUploadedFile('b.pdf', b'%PDF-b'),
+            'comparison_type': 'pdf',
+            'diff_result': json.dumps(diff_result),
+        }, format='multipart')
+
+    def test_regions_are_stored_with_stats_and_paginated(self):
+        with tempfile.TemporaryDirectory() as blob_root, self.settings(BLOB_STORE_ROOT=blob_root):
+            self.assertEqual(self.create_comparison(self.diff_result(25)).status_code, 201)
+        comparison = Comparison.objects.get()
+
+        response = self.client.get(f'/api/comparisons/{comparison.id}/regions/', {'per_page': 10, 'page': 3})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual([page['page'] for page in response.data['results']], [21, 22, 23, 24, 25])
+        self.assertEqual(response.data['results'][0]['stats']['added_area'], 200)
+        self.assertEqual(response.data['results'][0]['stats']['changed_fraction'], 0.01)
+        self.assertEqual(response.data['summary']['pages_changed'], 13)
+        self.assertEqual(response.data['summary']['added'], 13)
+
+        changed = self.client.get(f'/api/comparisons/{comparison.id}/regions/', {'changed': 'true'})
+        self.assertEqual(changed.data['count'], 13)
+
+    def test_malformed_diff_result_is_rejected(self):
+        diff_result = self.diff_result(1)
+        diff_result["pages"][0]["regions"][0]["kind"] = "moved"
+
+        response = self.create_comparison(diff_result)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Comparison.objects.exists())
+
+
+class MaskRegionsTests(SimpleTestCase):
+    def test_components_get_their_bbox_area_and_kind(self):
+        image1 = np.full((60, 80, 3), 255, dtype=np.uint8)
+        image2 = image1.copy()
+        # Only in the first image
+        image1[5:10, 10:20] = 0
+        # Only in the second image, two pixels touching at a corner
+        image2[40, 40] = image2[41, 41] = 0
+        # Darker in the second image, though both have ink there
+        image1[20:30, 60:64] = 128
+        image2[20:30, 60:64] = 0
+        mask = np.where(cv2.absdiff(image1, image2).max(axis=2) > 0, 255, 0).astype(np.uint8)
+
+        labels, regions = mask_regions(mask, image1, image2)
+
+        self.assertEqual(regions, [
+            ((10, 5, 20, 10), "removed"),
+            ((60, 20, 64, 30), "added"),
+            ((40, 40, 42, 42), "added"),
+        ])
+        self.assertEqual([region_area(bbox) for bbox, _ in regions], [50, 40, 4])
+        # Differing pixels per component
+        self.assertEqual([int((labels == label).sum()) for label in (1, 2, 3)], [50, 40, 2])
+        self.assertEqual(int((labels > 0).sum()), cv2.countNonZero(mask))
+
+    def test_empty_mask_has_no_regions(self):
+        image = np.full((10, 10), 255, dtype=np.uint8)
+        _, regions = mask_regions(np.zeros((10, 10), dtype=np.uint8), image, image)
+        self.assertEqual(regions, [])
+
+
+class ComparisonJobTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            MEDIA_ROOT=directory.name,
+            COMPARISON_JOBS_DIR=os.path.join(directory.name, 'jobs'),
+            COMPARE_WORKSPACE_DIR=os.path.join(directory.name, 'workspaces'),
+            RESULT_CACHE_DIR=os.path.join(directory.name, 'result_cache'),
+            COMPARISON_JOB_LEASE=60,
+            COMPARISON_JOB_MAX_ATTEMPTS=2,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def enqueue(self, name1='Hello_world.pdf', name2='Hi_world.pdf'):
+        uploads = []
+        for name in (name1, name2):
+            with open(os.path.join(CORPUS_DIR, name), 'rb') as f:
+                uploads.append(SimpleUploadedFile(name, f.read()))
+        return enqueue_job('pdf', *uploads)
+
+    def make_stale(self, job):
+        ComparisonJob.objects.filter(id=job.id).update(heartbeat_at=timezone.now() - timedelta(seconds=120))
+
+    def test_enqueue_stores_the_inputs_and_queues_the_job(self):
+        job = self.enqueue()
+        self.assertEqual(job.status, ComparisonJob.STATUS_QUEUED)
+        self.assertTrue(os.path.isfile(job.file1_path))
+        self.assertTrue(os.path.isfile(job.file2_path))
+        self.assertEqual(len(job.options['file1_sha256']), 64)
+
+    def test_claim_takes_the_oldest_queued_job_once(self):
+        first, second = self.enqueue(), self.enqueue()
+        claimed = claim_next_job()
+        self.assertEqual(claimed.id, first.id)
+        self.assertEqual(claimed.status, ComparisonJob.STATUS_RUNNING)
+        self.assertEqual(claimed.attempts, 1)
+        self.assertIsNotNone(claimed.heartbeat_at)
+        self.assertEqual(claim_next_job().id, second.id)
+        self.assertIsNone(claim_next_job())
+
+    def test_stale_running_jobs_are_claimed_again_then_failed(self):
+        job = self.enqueue()
+        claim_next_job()
+        self.assertIsNone(claim_next_job())
+
+        self.make_stale(job)
+        reclaimed = claim_next_job()
+        self.assertEqual(reclaimed.id, job.id)
+        self.assertEqual(reclaimed.attempts, 2)
+
+        self.make_stale(job)
+        self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ComparisonJob.STATUS_FAILED)
+        self.assertFalse(os.path.exists(os.path.dirname(job.file1_path)))
+
+    def test_run_records_progress_and_result(self):
+        job = self.enqueue()
+        run_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ComparisonJob.STATUS_DONE)
+        self.assertEqual((job.pages_done, job.pages_total), (1, 1))
+        self.assertEqual(job.result["pages"][0]["status"], "changed")
+        self.assertIn("highlighted_pdf_url", job.result)
+        self.assertFalse(os.path.exists(os.path.dirname(job.file1_path)))
+        # Job workers serve no /metrics; their durations are read back from the database
+        self.assertIn('compare_job_seconds_count{job_type="pdf",status="done"} 1', render_metrics())
+
+    def test_superseded_attempt_leaves_the_job_to_the_new_one(self):
+        job = self.enqueue()
+        first = claim_next_job()
+        self.make_stale(job)
+        second = claim_next_job()
+
+        run_job(first)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ComparisonJob.STATUS_RUNNING)
+        self.assertIsNone(job.result)
+        self.assertTrue(os.path.isfile(job.file1_path))
+
+        run_job(second)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ComparisonJob.STATUS_DONE)
+        self.assertFalse(os.path.exists(os.path.dirname(job.file1_path)))
+
+
+class PageAlignmentTests(SimpleTestCase):
+    def signatures(self, layouts):
+        # One distinct thumbnail per layout letter
+        thumbnails = {letter: np.full(16, index / 10, dtype=np.float32) for index, letter in enumerate('abcdefgh')}
+        return [PageSignature(letter, thumbnails[letter]) for letter in layouts]
+
+    def test_inserted_and_deleted_pages_are_not_paired(self):
+        pairs = align_pages(self.signatures('abcdef'), self.signatures('abhcdf'), gap_cost=0.03)
+
+        self.assertEqual(pairs, [(0, 0), (1, 1), (None, 2), (2, 3), (3, 4), (4, None), (5, 5)])
+
+    def test_similar_pages_are_paired_in_order(self):
+        signatures2 = self.signatures('abc')
+        signatures2[1] = PageSignature('edited', signatures2[1].thumbnail + 0.01)
+
+        self.assertEqual(align_pages(self.signatures('abc'), signatures2, gap_cost=0.03), [(0, 0), (1, 1), (2, 2)])
+        self.assertEqual(align_pages(self.signatures('ab'), [], gap_cost=0.03), [(0, None), (1, None)])
+
+    def test_heavily_edited_pages_stay_paired_without_a_better_alignment(self):
+        self.assertEqual(align_pages(self.signatures('aba'), self.signatures('aha'), gap_cost=0.03), [(0, 0), (1, 1), (2, 2)])
+
+    def test_bundled_template_pages_are_paired(self):
+        # The second version drops the title line; the thumbnails are 0.109 apart
+        with fitz.open(os.path.join(CORPUS_DIR, 'Hello_world.pdf')) as pdf1, \
+                fitz.open(os.path.join(CORPUS_DIR, 'Hi_world.pdf')) as pdf2:
+            self.assertEqual(match_pages(pdf1, pdf2, gap_cost=0.03), [(0, 0, False)])
+
+
+class AlignmentTests(SimpleTestCase):
+    def test_full_resolution_matching_is_seeded_by_the_coarse_transform(self):
+        with fitz.open(os.path.join(CORPUS_DIR, 'long_test1.pdf')) as document:
+            gray1 = np.array(render_page(document[0], zoom=3, grayscale=True))
+        height, width = gray1.shape
+        M = cv2.getRotationMatrix2D((width / 2, height / 2), 1.5, 0.97)
+        gray2 = cv2.warpAffine(gray1, M, (width, height), borderValue=255)
+
+        engine = AlignmentEngine()
+        with mock.patch.object(engine, 'match', wraps=engine.match) as match:
+            H, path = engine.align(gray1, gray2)
+        # Only the coarse pass matches all keypoints
+        self.assertEqual(match.call_count, 1)
+        self.assertEqual(path, "refined")
+        expected = np.linalg.inv(np.vstack([M, [0, 0, 1]]))
+        corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]]).reshape(-1, 1, 2)
+        error = np.abs(cv2.perspectiveTransform(corners, H) - cv2.perspectiveTransform(corners, expected))
+        self.assertLess(error.max(), 2)
+
+
+class RenderScaleTests(SimpleTestCase):
+    def setUp(self):
+        self.document = fitz.open()
+        self.page = self.document.new_page(width=600, height=800)
+
+    def tearDown(self):
+        self.document.close()
+
+    @override_settings(PDF_RENDER_ZOOM=3, PDF_MIN_RENDER_ZOOM=1, PDF_RENDER_PIXEL_BUDGET=76_800_000,
+                       PDF_GRAYSCALE_PIPELINE=False)
+    def test_zoom_is_lowered_to_share_the_pixel_budget_between_pages(self):
+        self.assertEqual(render_scale_for(self.page, 10, memory_limit=10 ** 10), (3.0, False))
+        self.assertEqual(render_scale_for(self.page, 40, memory_limit=10 ** 10), (2.0, False))
+        self.assertEqual(render_scale_for(self.page, 1000, memory_limit=10 ** 10), (1.0, False))
+
+    @override_settings(PDF_RENDER_ZOOM=3, PDF_MIN_RENDER_ZOOM=1, PDF_RENDER_PIXEL_BUDGET=10 ** 10,
+                       PDF_GRAYSCALE_PIPELINE=False)
+    def test_memory_limit_falls_back_to_grayscale_then_lower_zoom(self):
+        pixels = 600 * 800 * 9
+        self.assertEqual(render_scale_for(self.page, 1, memory_limit=pixels * COMPARE_BYTES_PER_PIXEL), (3.0, False))
+        self.assertEqual(render_scale_for(self.page, 1, memory_limit=pixels * GRAY_COMPARE_BYTES_PER_PIXEL), (3.0, True))
+        self.assertEqual(render_scale_for(self.page, 1, memory_limit=pixels * GRAY_COMPARE_BYTES_PER_PIXEL // 4), (1.5, True))
+
+    @override_settings(PDF_RENDER_ZOOM=3, PDF_MIN_RENDER_ZOOM=1, PDF_RENDER_PIXEL_BUDGET=10 ** 10,
+                       PDF_GRAYSCALE_PIPELINE=True)
+    def test_grayscale_pipeline_always_renders_grayscale(self):
+        self.assertEqual(render_scale_for(self.page, 1, memory_limit=10 ** 10), (3.0, True))
+
+    @override_settings(PDF_RENDER_ZOOM=3, PDF_MIN_RENDER_ZOOM=1, PDF_RENDER_PIXEL_BUDGET=10 ** 10,
+                       PDF_GRAYSCALE_PIPELINE=False, PDF_COMPARE_MEMORY_LIMIT=600 * 800 * 9 * COMPARE_BYTES_PER_PIXEL)
+    def test_workers_share_of_the_memory_limit_does_not_change_the_scale(self):
+        self.page.insert_text((40, 60), "Invoice 42", fontsize=18)
+        whole = compare_page_pair(self.document, self.document, 0, 0, tempfile.gettempdir(), output='vector')
+        shared = compare_page_pair(
+            self.document, self.document, 0, 0, tempfile.gettempdir(), output='vector',
+            memory_limit=settings.PDF_COMPARE_MEMORY_LIMIT // 16,
+        )
+        self.assertEqual((whole["zoom"], whole["grayscale"]), (3.0, False))
+        self.assertEqual((shared["zoom"], shared["grayscale"]), (3.0, False))
+        self.assertNotIn("tiles", whole)
+        self.assertGreater(shared["tiles"], 1)
+
+    def test_render_page_shares_the_pixmap_samples(self):
+        image = render_page(self.page, zoom=1, grayscale=True)
+        self.assertEqual(image.shape, (800, 600))
+        image[0, 0] = 7
+        self.assertEqual(image.pixmap.pixel(0, 0), (7,))
+
+
+class TiledComparisonTests(SimpleTestCase):
+    # Seams every 512 / 3 points at the default zoom of 3
+    tile_size = 512
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.pdf1 = fitz.open()
+        page = self.pdf1.new_page(width=400, height=400)
+        for index in range(9):
+            text = f"Line {index}: quarterly invoice {index * 37 + 11} due"
+            page.insert_text((30, 40 + 28 * index), text, fontsize=16)
+        # The same page shifted, so it has to be aligned, with a box across a vertical and a horizontal seam
+        self.pdf2 = fitz.open()
+        page = self.pdf2.new_page(width=400, height=400)
+        page.show_pdf_page(fitz.Rect(3, 2, 403, 402), self.pdf1, 0)
+        page.draw_rect(fitz.Rect(150, 300, 200, 350), color=(0, 0, 0), fill=(0, 0, 0))
+
+    def tearDown(self):
+        self.pdf1.close()
+        self.pdf2.close()
+
+    def compare(self, memory_limit=None):
+        with override_settings(PDF_TILE_SIZE=self.tile_size, PDF_RENDER_ZOOM=3, PDF_GRAYSCALE_PIPELINE=False):
+            return compare_page_pair(self.pdf1, self.pdf2, 0, 0, self.directory, 'vector', memory_limit)
+
+    def test_tiled_regions_match_the_whole_page(self):
+        whole = self.compare()
+        tiled = self.compare(memory_limit=self.tile_size * self.tile_size * 32)
+        self.assertNotIn("tiles", whole)
+        self.assertGreater(tiled["tiles"], 1)
+        self.assertNotEqual(tiled["alignment"], "identity")
+
+        added = [
+            region for region in tiled["regions"]
+            if region["bbox"][0] < 170 < region["bbox"][2] and region["bbox"][1] < 341 < region["bbox"][3]
+        ]
+        self.assertEqual(len(added), 1)
+        self.assertEqual(added[0]["kind"], "added")
+        # In the first page's frame, where the shift moves it up and left
+        np.testing.assert_allclose(added[0]["bbox"], [147, 298, 197, 348], atol=1.5)
+
+        # One region per change: none is reported twice, split along a seam
+        self.assertEqual(len(tiled["regions"]), len(whole["regions"]))
+        for region in whole["regions"]:
+            self.assertTrue(any(
+                other["kind"] == region["kind"] and np.allclose(other["bbox"], region["bbox"], atol=1)
+                for other in tiled["regions"]
+            ), region)
+
+
+class PdfComparisonTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write_pdf(self, name, lines, width=400, height=300, top=60):
+        """Writes a one-page PDF of (text, color) lines and returns its path."""
+        path = os.path.join(self.directory, name)
+        with fitz.open() as document:
+            page = document.new_page(width=width, height=height)
+            for index, (text, color) in enumerate(lines):
+                page.insert_text((40, top + 30 * index), text, fontsize=18, color=color)
+            document.save(path)
+        return path
+
+    def compare(self, path1, path2, **options):
+        with override_settings(MEDIA_ROOT=self.directory):
+            return run_pdf_comparison(
+                path1, path2, os.path.join(self.directory, 'pages'), os.path.join(self.directory, 'output.pdf'),
+                **options
+            )
+
+    def test_color_only_changes_are_found_by_default(self):
+        path1 = self.write_pdf('red.pdf', [("Invoice 42", (0, 0, 0)), ("TOTAL DUE 100.00", (1, 0, 0))])
+        path2 = self.write_pdf('green.pdf', [("Invoice 42", (0, 0, 0)), ("TOTAL DUE 100.00", (0, 1, 0))])
+
+        self.assertEqual(self.compare(path1, path2)["pages"][0]["status"], "changed")
+        # The grayscale pipeline trades these changes for memory
+        with override_settings(PDF_GRAYSCALE_PIPELINE=True):
+            self.assertEqual(self.compare(path1, path2)["pages"][0]["status"], "unchanged")
+
+    def test_identical_pages_are_skipped_but_a_one_pixel_change_is_not(self):
+        lines = [("Invoice 42", (0, 0, 0)), ("TOTAL DUE 100.00", (0, 0, 0))]
+        path1 = self.write_pdf('draft.pdf', lines)
+        path2 = self.write_pdf('copy.pdf', lines)
+        path3 = self.write_pdf('dotted.pdf', lines)
+        with fitz.open(path3) as document:
+            # One pixel at the default zoom of 3
+            document[0].draw_rect(fitz.Rect(200, 200, 200 + 1 / 3, 200 + 1 / 3), color=None, fill=(0, 0, 0))
+            document.saveIncr()
+
+        response = self.compare(path1, path2)
+        self.assertEqual(response["pages"][0]["status"], "skipped")
+        self.assertEqual((response["pages_skipped"], response["summary"]["pages_skipped"]), (1, 1))
+
+        response = self.compare(path1, path3)
+        self.assertEqual(response["pages"][0]["status"], "changed")
+        self.assertEqual(response["summary"]["pages_skipped"], 0)
+
+    def test_vector_output_of_raster_mode_annotates_the_changed_pages(self):
+        pages1 = [f"Section {number}: terms of payment" for number in range(1, 4)]
+        pages2 = [pages1[0], pages1[1].replace("payment", "delivery"), pages1[2]]
+        paths = []
+        for name, pages in (('draft.pdf', pages1), ('final.pdf', pages2)):
+            paths.append(os.path.join(self.directory, name))
+            with fitz.open() as document:
+                for text in pages:
+                    document.new_page(width=400, height=300).insert_text((40, 60), text, fontsize=18)
+                document.save(paths[-1])
+
+        response = self.compare(*paths, output='vector')
+        changed = [page for page in response["pages"] if page["regions"]]
+        self.assertEqual([page["page"] for page in changed], [2])
+
+        with fitz.open(os.path.join(self.directory, 'output.pdf')) as document:
+            self.assertEqual(len(document), len(changed))
+            for page, result in zip(document, changed):
+                rects = sorted(
+                    ([round(value, 1) for value in item[1]], drawing["color"])
+                    for drawing in page.get_drawings() for item in drawing["items"] if item[0] == "re"
+                )
+                expected = sorted(
+                    ([round(value, 1) for value in region["bbox"]], ANNOTATION_COLORS[region["kind"]])
+                    for region in result["regions"]
+                )
+                self.assertEqual(rects, expected)
+
+    def test_text_mode_draws_added_words_on_the_first_page(self):
+        path1 = self.write_pdf('draft.pdf', [("Invoice 42", (0, 0, 0)), ("TOTAL DUE 100.00", (0, 0, 0))])
+        path2 = self.write_pdf('paid.pdf', [
+            ("Invoice 42", (0, 0, 0)), ("TOTAL DUE 100.00", (0, 0, 0)), ("Paid in full", (0, 0, 0))
+        ])
+
+        self.compare(path1, path2, mode='text', output='vector')
+        with fitz.open(os.path.join(self.directory, 'output.pdf')) as document:
+            added = [drawing["rect"] for drawing in document[0].get_drawings() if drawing["color"] == (0, 1, 0)]
+        # Marked after "100.00" on the second line, not where the words sit on the second page
+        self.assertEqual(len(added), 1)
+        self.assertLess(added[0].y1, 100)
+
+    def test_text_mode_regions_are_on_the_first_page_whatever_the_page_sizes(self):
+        lines = [("Invoice 42", (0, 0, 0)), ("TOTAL DUE 100.00", (0, 0, 0))]
+        path1 = self.write_pdf('letter.pdf', lines)
+        path2 = self.write_pdf('tall.pdf', lines + [("Paid in full", (0, 0, 0))], width=600, height=800, top=500)
+
+        page = self.compare(path1, path2, mode='text')["pages"][0]
+        self.assertEqual([region["kind"] for region in page["regions"]], ["added"])
+        for region in page["regions"]:
+            x0, y0, x1, y1 = region["bbox"]
+            self.assertTrue(0 <= x0 <= x1 <= 400 and 0 <= y0 <= y1 <= 300, region)
+        self.assertLess(page["stats"]["changed_fraction"], 0.01)
+        # The added words keep their own boxes on the second page
+        self.assertGreater(page["changes"][0]["new"][0]["bbox"][1], 500)
+
+    def test_text_mode_raster_output_reports_and_draws_changes(self):
+        path1 = self.write_pdf('draft.pdf', [("Invoice 42", (0, 0, 0)), ("TOTAL DUE 100.00", (0, 0, 0))])
+        path2 = self.write_pdf('final.pdf', [("Invoice 42", (0, 0, 0)), ("TOTAL DUE 120.00", (0, 0, 0))])
+
+        response = self.compare(path1, path2, mode='text')
+        self.assertEqual(response["pages"][0]["status"], "changed")
+        self.assertNotIn("message", response)
+        self.assertIn("highlighted_pdf_url", response)
+        with fitz.open(os.path.join(self.directory, 'output.pdf')) as document:
+            self.assertEqual(len(document), 1)
+
+    def test_worker_pool_matches_sequential_comparison(self):
+        path1, path2 = os.path.join(CORPUS_DIR, 'long_test1.pdf'), os.path.join(CORPUS_DIR, 'long_test2.pdf')
+        responses, images = [], []
+        for workers in (1, 2):
+            directory = os.path.join(self.directory, f'workers-{workers}')
+            with override_settings(MEDIA_ROOT=self.directory):
+                responses.append(run_pdf_comparison(
+                    path1, path2, os.path.join(directory, 'pages'), os.path.join(directory, 'output.pdf'),
+                    workers=workers,
+                ))
+            images.append({
+                name: open(os.path.join(directory, 'pages', name), 'rb').read()
+                for name in os.listdir(os.path.join(directory, 'pages'))
+            })
+
+        sequential, pooled = responses
+        self.assertEqual(pooled["pages"], sequential["pages"])
+        self.assertEqual(pooled["summary"], sequential["summary"])
+        self.assertTrue(images[0])
+        self.assertEqual(images[1], images[0])
+
+
+class StageTimingTests(SimpleTestCase):
+    # /metrics reads the job durations from the database
+    databases = {'default'}
+
+    def test_nested_stages_are_timed_exclusively(self):
+        with collect_stage_times() as stage_times:
+            with stage('output'):
+                time.sleep(0.02)
+                with stage('render'):
+                    time.sleep(0.05)
+        self.assertEqual(stage_times['render'][1], 1)
+        self.assertGreaterEqual(stage_times['render'][0], 0.05)
+        self.assertGreaterEqual(stage_times['output'][0], 0.02)
+        self.assertLess(stage_times['output'][0], 0.05)
+
+    def test_stages_outside_a_collector_are_not_recorded(self):
+        with stage('render'):
+            pass
+        with collect_stage_times() as stage_times:
+            pass
+        self.assertEqual(stage_times, {})
+
+    def test_server_timing_header_and_metrics(self):
+        def view(request):
+            with stage('render'):
+                pass
+            return HttpResponse()
+
+        response = ServerTimingMiddleware(view)(RequestFactory().get('/api/compare-pdfs/'))
+        self.assertRegex(response['Server-Timing'], r'^render;dur=[\d.]+, total;dur=[\d.]+$')
+        with override_settings(COMPARE_METRICS_TOKEN='scrape'):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer other').status_code, 403)
+            metrics = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape')
+        self.assertEqual(metrics.status_code, 200)
+        self.assertIn('compare_stage_seconds_bucket{stage="render",le="+Inf"}', metrics.content.decode())
+        self.assertIn('compare_result_cache_hits_total', metrics.content.decode())
+        # Closed without a token configured
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+
+class BoxMergeTests(SimpleTestCase):
+    def test_boxes_are_merged_transitively_regardless_of_order(self):
+        # The tall box overlaps the last one in x order but not its neighbour
+        boxes = [(0, 0, 10, 100), (5, 200, 10, 10), (8, 90, 10, 10), (500, 500, 10, 10), (12, 0, 10, 10)]
+        self.assertEqual(merge_boxes(boxes), [(0, 0, 22, 100), (5, 200, 10, 10), (500, 500, 10, 10)])
+
+    def test_merged_boxes_are_merged_again(self):
+        # Only the union of the first two is tall enough to reach the third
+        self.assertEqual(merge_boxes([(0, 0, 10, 10), (0, 11, 10, 10), (0, 25, 10, 10)]), [(0, 0, 10, 35)])
+
+
+class ImageComparisonTests(SimpleTestCase):
+    def make_images(self):
+        """Returns a page of text and a shifted copy with an added red rectangle."""
+        rng = np.random.default_rng(0)
+        image = np.full((600, 800, 3), 255, dtype=np.uint8)
+        cv2.rectangle(image, (20, 20), (780, 580), (0, 0, 0), 3)
+        for i in range(60):
+            x, y = rng.integers(40, 700), rng.integers(60, 560)
+            cv2.putText(image, f"Item {i}", (int(x), int(y)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
+        shifted = cv2.warpAffine(image, np.float32([[1, 0, 12], [0, 1, 8]]), (800, 600), borderValue=(255, 255, 255))
+        cv2.rectangle(shifted, (400, 300), (460, 340), (0, 0, 255), -1)
+        return image, shifted
+
+    def test_differences_are_found_after_aligning_the_second_image(self):
+        image, shifted = self.make_images()
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            path1, path2 = os.path.join(media_root, 'a.png'), os.path.join(media_root, 'b.png')
+            cv2.imwrite(path1, image)
+            cv2.imwrite(path2, shifted)
+            _, page = process_and_compare(path1, path2, media_root)
+
+        # Only the added rectangle differs; regions are in the cropped frame
+        self.assertEqual(len(page["regions"]), 1)
+        self.assertEqual(page["regions"][0]["kind"], "added")
+
+    def test_batch_compares_every_candidate_to_the_reference(self):
+        image, shifted = self.make_images()
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, RESULT_CACHE_MAX_BYTES=0,
+                                  COMPARE_WORKSPACE_DIR=os.path.join(media_root, 'workspaces')):
+            uploads = []
+            for index, (name, content) in enumerate([('reference.png', image), ('same.png', image),
+                                                     ('shifted.png', shifted), ('blank.png', image * 0 + 255)]):
+                path = os.path.join(media_root, name)
+                cv2.imwrite(path, content)
+                uploads.append(IngestedUpload(path, str(index), None, name))
+
+            with collect_stage_times() as stage_times:
+                result = run_image_batch(uploads[0], uploads[1:], workers=2)
+
+        self.assertEqual(result["summary"], {"candidates": 3, "changed": 1, "failed": 1})
+        same, changed, blank = result["candidates"]
+        self.assertEqual((same["name"], same["summary"]["regions"]), ("same.png", 0))
+        self.assertEqual(changed["summary"]["regions"], 1)
+        self.assertIn("error", blank)
+        # Stage times from the worker threads reach the caller
+        self.assertIn('detect', stage_times)
+
+
+class WorkspaceTests(SimpleTestCase):
+    def test_reaper_enforces_ttl_and_budget_least_recently_used_first(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(COMPARE_WORKSPACE_DIR=root):
+            now = time.time()
+            ages = {'expired': 7200, 'old': 1800, 'recent': 900, 'running': 60}
+            for name, age in ages.items():
+                workspace = os.path.join(root, name)
+                os.makedirs(workspace)
+                with open(os.path.join(workspace, 'output.png'), 'wb') as f:
+                    f.write(b'x' * 100)
+                for path in (os.path.join(workspace, 'output.png'), workspace):
+                    os.utime(path, (now - age, now - age))
+
+            removed, freed = reap_workspaces(ttl=3600, max_bytes=150, grace=300, now=now)
+
+            # Over budget, only the workspace in use within the grace period is kept
+            self.assertEqual((removed, freed), (3, 300))
+            self.assertEqual(os.listdir(root), ['running'])
+
+    def test_workspaces_in_use_are_kept_however_old(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(COMPARE_WORKSPACE_DIR=root):
+            workspace = os.path.join(root, 'vector-output')
+            os.makedirs(workspace)
+            old = time.time() - 7200
+            os.utime(workspace, (old, old))
+
+            with workspace_in_use(workspace):
+                self.assertEqual(reap_workspaces(ttl=3600, max_bytes=0, grace=300), (0, 0))
+                self.assertTrue(os.path.isdir(workspace))
+            self.assertEqual(os.listdir(root), ['vector-output'])
+            self.assertEqual(reap_workspaces(ttl=3600, max_bytes=0, grace=300)[0], 1)
+            self.assertEqual(os.listdir(root), [])
+
+
+class ResultCacheTests(SimpleTestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, COMPARE_WORKSPACE_DIR=os.path.join(self.media_root, 'workspaces')
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.cache = ResultCache(os.path.join(self.media_root, 'result_cache'), max_bytes=10_000)
+
+    def compute(self, content=b'x'):
+        def compute(output_dir):
+            path = os.path.join(output_dir, 'output.png')
+            with open(path, 'wb') as f:
+                f.write(content)
+            return {"url": f"/media/{os.path.relpath(path, self.media_root)}"}
+        return compute
+
+    def test_miss_publishes_the_output_and_hit_returns_it(self):
+        result, cached = self.cache.get_or_compute('a' * 64, self.compute())
+        self.assertFalse(cached)
+        self.assertEqual(result["url"], f"/media/result_cache/aa/{'a' * 64}/output.png")
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, result["url"][len('/media/'):])))
+        # The workspace it was computed in was moved into the entry
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'workspaces')), [])
+
+        self.assertEqual(self.cache.get_or_compute('a' * 64, self.failing_compute), (result, True))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_stats_are_kept_by_eviction_instead_of_walking_the_cache(self):
+        self.cache.get_or_compute('a' * 64, self.compute())
+        with mock.patch.object(self.cache, 'entries', side_effect=AssertionError("walked the cache")):
+            stats = self.cache.stats()
+        entry_dir = self.cache.entry_dir('a' * 64)
+        size = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+        self.assertEqual((stats["entries"], stats["bytes"]), (1, size))
+
+    def test_max_bytes_of_zero_bypasses_the_cache(self):
+        root = os.path.join(self.media_root, 'result_cache')
+        with override_settings(RESULT_CACHE_DIR=root, RESULT_CACHE_MAX_BYTES=0):
+            cache = get_result_cache()
+            self.assertEqual(cache.root, root)
+            self.assertFalse(cache.get_or_compute('a' * 64, self.compute())[1])
+            self.assertFalse(cache.get_or_compute('a' * 64, self.compute())[1])
+        self.assertFalse(os.path.exists(root))
+        self.assertEqual(get_result_cache().root, settings.RESULT_CACHE_DIR)
+
+    def failing_compute(self, output_dir):
+        with open(os.path.join(output_dir, 'partial.png'), 'wb') as f:
+            f.write(b'x')
+        raise ValueError("failed")
+
+    def test_failed_computation_leaves_the_published_entry_alone(self):
+        result, _ = self.cache.get_or_compute('a' * 64, self.compute())
+        # A concurrent miss that started before the entry was published
+        self.cache.get = lambda key: None
+        with self.assertRaises(ValueError):
+            self.cache.get_or_compute('a' * 64, self.failing_compute)
+        del self.cache.get
+
+        self.assertEqual(self.cache.get('a' * 64), result)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, result["url"][len('/media/'):])))
+
+    def test_concurrent_misses_return_the_first_published_result(self):
+        first, _ = self.cache.get_or_compute('a' * 64, self.compute(b'first'))
+        # A concurrent miss finishing after the first one published
+        second_dir = os.path.join(self.media_root, 'workspaces', 'second')
+        os.makedirs(second_dir)
+        second = self.cache.publish('a' * 64, second_dir, self.compute(b'second')(second_dir))
+
+        self.assertEqual(second, first)
+        self.assertFalse(os.path.exists(second_dir))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for index, key in enumerate(('a' * 64, 'b' * 64, 'c' * 64)):
+            self.cache.get_or_compute(key, self.compute(b'x' * 4000))
+            os.utime(os.path.join(self.cache.entry_dir(key), 'result.json'), (index, index))
+        self.assertEqual(len(self.cache.entries()), 2)
+
+        # Publishing 'c' went over max_bytes; 'a' was the least recently used
+        self.assertIsNone(self.cache.get('a' * 64))
+        self.assertIsNotNone(self.cache.get('b' * 64))
+        self.assertIsNotNone(self.cache.get('c' * 64))
 
-# Create your tests here.
@@ -0,0 +1,55 @@
+import difflib
+
+# difflib opcode -> change type reported to clients
+CHANGE_TYPES = {
+    'insert': 'inserted',
+    'delete': 'deleted',
+    'replace': 'changed',
+}
+
+def extract_words(page):
+    """
+    Returns the words of a PyMuPDF page in reading order as
+    {"text", "bbox"} dicts, with bbox in PDF points (x0, y0, x1, y1).
+    """
+    return [
+        {"text": word[4], "bbox": [round(coord, 2) for coord in word[:4]]}
+        for word in page.get_text("words", sort=True)
+    ]
+
+def insertion_anchor(words1, index):
+    """
+    Returns a narrow box (x0, y0, x1, y1) on the first page marking where
+    words were inserted before words1[index], or None on a page without words.
+    """
+    if index > 0:
+        _, y0, x1, y1 = words1[index - 1]["bbox"]
+        return [x1, y0, x1 + 2, y1]
+    if words1:
+        x0, y0, _, y1 = words1[0]["bbox"]
+        return [x0 - 2, y0, x0, y1]
+    return None
+
+def diff_words(words1, words2):
+    """
+    Runs a sequence diff over two word lists and returns the inserted,
+    deleted and changed runs. "old" holds the words from the first document
+    and "new" the words from the second; runs with new words also have an
+    "anchor", the insertion_anchor() after the old words on the first page.
+    """
+    matcher = difflib.SequenceMatcher(
+        None, [word["text"] for word in words1], [word["text"] for word in words2], autojunk=False
+    )
+    changes = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        change = {
+            "type": CHANGE_TYPES[tag],
+            "old": words1[i1:i2],
+            "new": words2[j1:j2],
+        }
+        if j2 > j1:
+            change["anchor"] = insertion_anchor(words1, i2)
+        changes.append(change)
+    return changes
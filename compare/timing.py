@@ -0,0 +1,64 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Pipeline stages timed with stage(), in pipeline order
+STAGES = ('pagematch', 'render', 'detect', 'match', 'warp', 'diff', 'output')
+
+_local = threading.local()
+
+
+def _state():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+        _local.collectors = []
+    return _local
+
+def record(name, seconds, count=1):
+    """Adds seconds spent in stage name to every collector active in this thread."""
+    for collector in _state().collectors:
+        total, calls = collector.get(name, (0.0, 0))
+        collector[name] = (total + seconds, calls + count)
+
+def record_all(stage_times):
+    """Adds the stage times of a collect_stage_times() dict, e.g. from a worker process."""
+    for name, (seconds, count) in stage_times.items():
+        record(name, seconds, count)
+
+@contextmanager
+def stage(name):
+    """
+    Times the enclosed block as pipeline stage name. Times are exclusive:
+    while a nested stage runs, the enclosing one is paused.
+    """
+    state = _state()
+    if not state.collectors:
+        yield
+        return
+    now = time.perf_counter()
+    if state.stack:
+        parent = state.stack[-1]
+        record(parent[0], now - parent[1], count=0)
+    state.stack.append([name, now])
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        _, start = state.stack.pop()
+        record(name, now - start)
+        if state.stack:
+            state.stack[-1][1] = now
+
+@contextmanager
+def collect_stage_times():
+    """
+    Collects the stages timed in this thread while the block runs, into the
+    yielded dict of name -> (seconds, calls).
+    """
+    state = _state()
+    collector = {}
+    state.collectors.append(collector)
+    try:
+        yield collector
+    finally:
+        state.collectors.remove(collector)
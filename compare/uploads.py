@@ -0,0 +1,101 @@
+import hashlib
+import os
+import tempfile
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+
+# An upload written to disk: its path, SHA-256, size in bytes and original name
+IngestedUpload = namedtuple('IngestedUpload', ['path', 'sha256', 'size', 'name'])
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimitHandler(FileUploadHandler):
+    """
+    Drops uploaded files larger than COMPARE_MAX_UPLOAD_SIZE while the request
+    body is parsed, before the memory and temporary-file handlers after it
+    buffer them. The skipped field names are recorded on
+    request.oversized_uploads so views can report them.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.COMPARE_MAX_UPLOAD_SIZE:
+            oversized = getattr(self.request, 'oversized_uploads', [])
+            oversized.append(self.field_name)
+            self.request.oversized_uploads = oversized
+            raise SkipFile()
+        return raw_data
+
+    def file_complete(self, file_size):
+        # Let the next handler build the uploaded file
+        return None
+
+
+def check_upload_sizes(request):
+    """
+    Raises UploadTooLarge when the request had files dropped by
+    UploadSizeLimitHandler. Accepts Django and DRF requests; call it after
+    the request files have been accessed.
+    """
+    request = getattr(request, '_request', request)
+    oversized = getattr(request, 'oversized_uploads', None)
+    if oversized:
+        raise UploadTooLarge(
+            f"{', '.join(oversized)} exceeds the {settings.COMPARE_MAX_UPLOAD_SIZE} byte upload limit."
+        )
+
+def ingest_upload(upload, directory=None, max_size=None):
+    """
+    Streams an uploaded file in chunks to a unique path in directory
+    (COMPARE_UPLOAD_TEMP_DIR by default), hashing it on the way, and returns
+    an IngestedUpload. The caller owns the written file.
+
+    Raises UploadTooLarge, without writing anything, when the upload is
+    larger than max_size (COMPARE_MAX_UPLOAD_SIZE by default).
+    """
+    max_size = settings.COMPARE_MAX_UPLOAD_SIZE if max_size is None else max_size
+    if upload.size is not None and upload.size > max_size:
+        raise UploadTooLarge(f"{upload.name} exceeds the {max_size} byte upload limit.")
+
+    directory = directory or settings.COMPARE_UPLOAD_TEMP_DIR
+    os.makedirs(directory, exist_ok=True)
+
+    # Keep the extension for format sniffing, never the uploaded name itself
+    extension = os.path.splitext(upload.name or '')[1].lower()[:16]
+    fd, path = tempfile.mkstemp(suffix=extension, dir=directory)
+
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in upload.chunks():
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(f"{upload.name} exceeds the {max_size} byte upload limit.")
+                sha256.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    return IngestedUpload(path, sha256.hexdigest(), size, upload.name)
+
+def discard_upload(ingested):
+    """Removes the file of an IngestedUpload, if it is still there."""
+    if ingested is None:
+        return
+    try:
+        os.remove(ingested.path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error removing file {ingested.path}: {e}")
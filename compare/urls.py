@@ -1,6 +1,7 @@
 from django.urls import path, include
 from . import viewsImage
 from . import viewsPdf
+from . import viewsJobs
 from .views import CustomTokenObtainPairView
 from .views import RegisterView
 from . import views 
@@ -18,12 +19,17 @@ router.register(r'sessions', SessionViewSet, basename='session')
 
 urlpatterns = [
     path('compare-images/', viewsImage.compare_images, name='compare_images'),
+    path('compare-images/batch/', viewsImage.compare_images_batch, name='compare_images_batch'),
     path('compare-pdfs/', viewsPdf.compare_pdfs, name='compare_pdfs'),
+    path('jobs/', viewsJobs.create_job, name='create_job'),
+    path('jobs/<uuid:job_id>/', viewsJobs.job_status, name='job_status'),
+    path('jobs/<uuid:job_id>/result/', viewsJobs.job_result, name='job_result'),
     path("token/", CustomTokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("register/", RegisterView.as_view(), name="register"),
     path('', include(router.urls)),
     path('files/<int:file_id>/content/', views.serve_file, name='serve-file'),
+    path('result-cache/', views.result_cache_stats, name='result-cache-stats'),
     path('users/me/', views.UserProfileView.as_view(), name='user-profile'),
     path('users/change-password/', views.ChangePasswordView.as_view(), name='change-password'),
 ]
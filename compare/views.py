@@ -6,25 +6,47 @@ from rest_framework import status
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.response import Response
 from django.contrib.auth.models import User
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 
 from rest_framework import viewsets, permissions
 from .models import Project, File, Comparison, Session
-from .serializers import UserSerializer, ProjectSerializer, FileSerializer, ComparisonSerializer, SessionSerializer
+from .serializers import (
+    UserSerializer, ProjectSerializer, FileSerializer, ComparisonSerializer, ComparisonListSerializer,
+    SessionSerializer,
+)
 from rest_framework.permissions import IsAuthenticated
 
 from .pagination import CustomPageNumberPagination
+from .blobstore import get_blob_store
+from .diffresult import normalize_diff_result
+from .metrics import render_metrics
+from .resultcache import get_result_cache
+from .uploads import UploadTooLarge, check_upload_sizes, discard_upload, ingest_upload
 
 from rest_framework.filters import SearchFilter
 from django_filters.rest_framework import DjangoFilterBackend
 
 # views.py
-from django.http import HttpResponse
-import base64
-from rest_framework.decorators import api_view
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import content_disposition_header, parse_etags
+import hmac
+import mimetypes
+from django.conf import settings
+from rest_framework.decorators import api_view, permission_classes
 
 from django.contrib.auth import update_session_auth_hash
 
+def store_upload(upload):
+    """
+    Streams an upload to disk and moves it into the blob store.
+    Returns (content hash, size).
+    """
+    ingested = ingest_upload(upload)
+    try:
+        return get_blob_store().put_file(ingested.path, ingested.sha256)
+    finally:
+        discard_upload(ingested)
+
 class UserProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -53,32 +75,126 @@ class ChangePasswordView(APIView):
         update_session_auth_hash(request, user)  # Keep user logged in
         return Response({'message': 'Password updated successfully'})
 
+# Content types served for each File.type; images are guessed from the name
+FILE_CONTENT_TYPES = {
+    'pdf': 'application/pdf',
+    'text': 'text/plain; charset=utf-8',
+}
+
+RANGE_CHUNK_SIZE = 64 * 1024
+
+def parse_byte_range(header, size):
+    """
+    Parses a single "bytes=start-end" Range header against a file of size
+    bytes and returns the inclusive (start, end) pair. Returns None when the
+    header is malformed or asks for several ranges, in which case the whole
+    file is served. Raises ValueError when the range is unsatisfiable.
+    """
+    units, _, ranges = header.partition('=')
+    if units.strip() != 'bytes' or ',' in ranges:
+        return None
+    start, sep, end = ranges.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if start:
+            start, end = int(start), int(end) if end else size - 1
+        elif end:
+            # Suffix range: the last N bytes
+            start, end = max(size - int(end), 0), size - 1
+        else:
+            return None
+    except ValueError:
+        return None
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+def iter_file_range(f, start, length):
+    with f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(RANGE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
 @api_view(['GET'])
 def serve_file(request, file_id):
     try:
         file = File.objects.get(id=file_id)
-        if file.type == 'image':
-            # Convert binary to base64 for images
-            base64_data = base64.b64encode(file.file_data).decode('utf-8')
-            return Response({
-                'data': f'data:image/jpeg;base64,{base64_data}',
-                'type': 'image'
-            })
-        elif file.type == 'text':
-            # Decode text data
-            text_content = file.file_data.decode('utf-8')
-            return Response({
-                'data': text_content,
-                'type': 'text'
-            })
-        elif file.type == 'pdf':
-            # Serve PDF as binary
-            response = HttpResponse(file.file_data, content_type='application/pdf')
-            response['Content-Disposition'] = f'inline; filename="{file.name}"'
-            return response
-            
     except File.DoesNotExist:
         return Response({'error': 'File not found'}, status=404)
+    if not file.content_hash:
+        return Response({'error': 'File has no content'}, status=404)
+
+    # The content hash is a strong validator for the file bytes
+    etag = f'"{file.content_hash}"'
+    # If-None-Match uses the weak comparison, so W/ tags match too
+    if_none_match = [tag.removeprefix('W/') for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))]
+    if etag in if_none_match or '*' in if_none_match:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    store = get_blob_store()
+    size = file.size if file.size is not None else store.size(file.content_hash)
+    content_type = FILE_CONTENT_TYPES.get(file.type)
+    if content_type is None:
+        content_type = mimetypes.guess_type(file.name)[0] or 'image/jpeg'
+
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and (not if_range or if_range == etag):
+        try:
+            byte_range = parse_byte_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            iter_file_range(file.open_content(), start, length), status=206, content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(length)
+    else:
+        # Streamed by the server's file wrapper (sendfile where available)
+        response = FileResponse(file.open_content(), content_type=content_type)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    response['Content-Disposition'] = content_disposition_header(False, file.name)
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def result_cache_stats(request):
+    """Hit/miss counters and size of this process's comparison result cache, for staff users."""
+    return Response(get_result_cache().stats())
+
+
+def metrics(request):
+    """
+    Pipeline timings and result cache counters of this process, in the
+    Prometheus text format. Scrapers authenticate with
+    "Authorization: Bearer <COMPARE_METRICS_TOKEN>"; without a token
+    configured the endpoint is closed.
+    """
+    token = settings.COMPARE_METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+        return HttpResponse(status=403)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 class CustomTokenObtainPairView(TokenObtainPairView):
@@ -135,7 +251,11 @@ class FileViewSet(viewsets.ModelViewSet):
     pagination_class = CustomPageNumberPagination
 
     def get_queryset(self):
-        return File.objects.filter(project__user=self.request.user).order_by('-created_at')
+        return (
+            File.objects.filter(project__user=self.request.user)
+            .select_related('project')
+            .order_by('-created_at')
+        )
 
 class SessionViewSet(viewsets.ModelViewSet):
     queryset = Session.objects.all()
@@ -156,20 +276,86 @@ class ComparisonViewSet(viewsets.ModelViewSet):
     filterset_fields = ['comparison_type', 'project']
 
     def get_queryset(self):
-        return Comparison.objects.filter(project__user=self.request.user).order_by('-created_at')
+        queryset = Comparison.objects.filter(project__user=self.request.user).order_by('-created_at')
+        if self.action == 'list':
+            # Only the columns ComparisonListSerializer reads, in a single query
+            return queryset.select_related('project', 'file1', 'file2').only(
+                'id', 'comparison_type', 'created_at',
+                'project__id', 'project__name',
+                'file1__id', 'file1__name', 'file1__type',
+                'file2__id', 'file2__name', 'file2__type',
+            )
+        queryset = queryset.select_related('project', 'file1__project', 'file2__project')
+        if self.action != 'regions':
+            # Only served paginated by the regions action
+            queryset = queryset.defer('diff_result')
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ComparisonListSerializer
+        return ComparisonSerializer
+
+    # Content types of the stored highlighted output per comparison type
+    HIGHLIGHTED_CONTENT_TYPES = {
+        'pdf': 'application/pdf',
+        'image': 'image/png',
+        'text': 'text/plain',
+    }
+
+    @action(detail=True, methods=["get"])
+    def highlighted_differences(self, request, pk=None):
+        comparison = self.get_object()
+        if not comparison.highlighted_differences_hash:
+            return Response({"error": "No highlighted differences stored."}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(
+            get_blob_store().open(comparison.highlighted_differences_hash),
+            content_type=self.HIGHLIGHTED_CONTENT_TYPES.get(comparison.comparison_type, 'application/octet-stream'),
+        )
+
+    @action(detail=True, methods=["get"])
+    def regions(self, request, pk=None):
+        """
+        Returns the stored diff result: its summary and a page of the per-page
+        region lists. ?changed=true only lists pages with differences.
+        """
+        comparison = self.get_object()
+        if not comparison.diff_result:
+            return Response({"error": "No diff result stored."}, status=status.HTTP_404_NOT_FOUND)
+
+        pages = comparison.diff_result["pages"]
+        if request.query_params.get('changed') in ('1', 'true'):
+            pages = [page for page in pages if page["regions"]]
+
+        response = self.get_paginated_response(self.paginate_queryset(pages))
+        response.data["summary"] = comparison.diff_result["summary"]
+        return response
 
     @action(detail=False, methods=["post"], permission_classes=[IsAuthenticated])
     def create_files_and_comparison(self, request):
         try:
             # project_id = request.data.get('project')
             project = Project.objects.get(id=request.data["project"], user=request.user)
-            print(request.data["file1_data"])
+            try:
+                check_upload_sizes(request)
+            except UploadTooLarge as e:
+                return Response({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+            diff_result = request.data.get("diff_result", None)
+            if diff_result:
+                try:
+                    diff_result = normalize_diff_result(diff_result)
+                except ValueError as e:
+                    return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
             # Save file1
             try:
+                content_hash, size = store_upload(request.data["file1_data"])
                 file1 = File.objects.create(
                     name=request.data["file1_name"],
                     type=request.data["file1_type"],
-                    file_data=request.data["file1_data"].read(),  # Read binary data
+                    content_hash=content_hash,
+                    size=size,
                     project=project,
                 )
                 print(f"File1 created with ID: {file1.id}")
@@ -179,10 +365,12 @@ class ComparisonViewSet(viewsets.ModelViewSet):
             
             # Save file2
             try:
+                content_hash, size = store_upload(request.data["file2_data"])
                 file2 = File.objects.create(
                     name=request.data["file2_name"],
                     type=request.data["file2_type"],
-                    file_data=request.data["file2_data"].read(),  # Read binary data
+                    content_hash=content_hash,
+                    size=size,
                     project=project,
                 )
                 print(f"File2 created with ID: {file2.id}")
@@ -196,9 +384,10 @@ class ComparisonViewSet(viewsets.ModelViewSet):
                 # if result_data:
                 #     result_data = result_data.read()
 
+                highlighted_differences_hash = None
                 highlighted_differences_data = request.data.get("highlighted_differences_data", None)
                 if highlighted_differences_data:
-                    highlighted_differences_data = highlighted_differences_data.read()
+                    highlighted_differences_hash, _ = store_upload(highlighted_differences_data)
 
                 comparison = Comparison.objects.create(
                     project=project,
@@ -206,7 +395,8 @@ class ComparisonViewSet(viewsets.ModelViewSet):
                     file2=file2,
                     comparison_type=request.data["comparison_type"],
                     result_url=result_data,
-                    highlighted_differences_file=highlighted_differences_data,
+                    highlighted_differences_hash=highlighted_differences_hash,
+                    diff_result=diff_result or None,
                 )
                 print(f"Comparison created with ID: {comparison.id}")
             except Exception as e:
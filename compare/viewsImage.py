@@ -1,11 +1,21 @@
 import cv2
 import numpy as np
 import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from skimage.metrics import structural_similarity as ssim
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 
+from .boxmerge import merge_boxes
+from .diffresult import mask_regions, summarize_pages
+from .resultcache import ResultCache, get_result_cache, media_url
+from .timing import collect_stage_times, record_all, stage
+from .uploads import UploadTooLarge, check_upload_sizes, discard_upload, ingest_upload
+from .workspaces import create_workspace
+
 
 @csrf_exempt
 def compare_images(request):
@@ -13,37 +23,179 @@ def compare_images(request):
         file1 = request.FILES.get('file1')
         file2 = request.FILES.get('file2')
 
+        try:
+            check_upload_sizes(request)
+        except UploadTooLarge as e:
+            return JsonResponse({"error": str(e)}, status=413)
+
         if not file1 or not file2:
             return JsonResponse({"error": "Both files are required."}, status=400)
 
+        upload1 = upload2 = None
         try:
-            # Save files temporarily
-            temp_dir = 'temp_files'
-            os.makedirs(temp_dir, exist_ok=True)
-            file1_path = os.path.join(temp_dir, file1.name)
-            file2_path = os.path.join(temp_dir, file2.name)
-
-            with open(file1_path, 'wb') as f1, open(file2_path, 'wb') as f2:
-                f1.write(file1.read())
-                f2.write(file2.read())
+            # Stream files to disk
+            upload1 = ingest_upload(file1)
+            upload2 = ingest_upload(file2)
 
             # Process and compare images
-            result_image_path = process_and_compare(file1_path, file2_path)
-            
-            # Clean up temporary input images
-            os.remove(file1_path)
-            os.remove(file2_path)
+            response_data = run_cached_image_comparison(upload1, upload2)
 
             # Return highlighted image URL
-            return JsonResponse({
-                "highlighted_differences_url": f"{settings.MEDIA_URL}{result_image_path}"
-            })
+            return JsonResponse(response_data)
 
+        except UploadTooLarge as e:
+            return JsonResponse({"error": str(e)}, status=413)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
+        finally:
+            # Clean up temporary input images
+            discard_upload(upload1)
+            discard_upload(upload2)
 
     return JsonResponse({"error": "Invalid HTTP method."}, status=405)
 
+@csrf_exempt
+def compare_images_batch(request):
+    """
+    Compares one reference image (the "reference" field) against every
+    image uploaded in the "candidates" field. The reference is cropped and
+    its features detected once; candidates are compared in parallel.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid HTTP method."}, status=405)
+
+    reference_file = request.FILES.get('reference')
+    candidate_files = request.FILES.getlist('candidates')
+
+    try:
+        check_upload_sizes(request)
+    except UploadTooLarge as e:
+        return JsonResponse({"error": str(e)}, status=413)
+
+    if not reference_file or not candidate_files:
+        return JsonResponse({"error": "A reference and at least one candidate are required."}, status=400)
+    if len(candidate_files) > settings.IMAGE_BATCH_MAX_CANDIDATES:
+        return JsonResponse(
+            {"error": f"At most {settings.IMAGE_BATCH_MAX_CANDIDATES} candidates can be compared at once."},
+            status=400,
+        )
+
+    uploads = []
+    try:
+        # Stream files to disk
+        for upload in [reference_file] + candidate_files:
+            uploads.append(ingest_upload(upload))
+        return JsonResponse(run_image_batch(uploads[0], uploads[1:]))
+    except UploadTooLarge as e:
+        return JsonResponse({"error": str(e)}, status=413)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+    finally:
+        # Clean up temporary input images
+        for upload in uploads:
+            discard_upload(upload)
+
+def run_image_comparison(file1_path, file2_path, output_dir=None):
+    """
+    Runs the image comparison and returns the response payload.
+    """
+    result_image_path, page = process_and_compare(file1_path, file2_path, output_dir=output_dir)
+    # Structured result: a single page with regions in pixels of the highlighted image
+    pages = [page]
+    return {
+        "highlighted_differences_url": media_url(result_image_path),
+        "summary": summarize_pages(pages),
+        "pages": pages,
+    }
+
+# Bump whenever a pipeline change alters comparison output, so cached results are not reused
+PIPELINE_VERSION = 4
+
+def pipeline_params():
+    """Parameters that determine the output of an image comparison, for the result cache key."""
+    return {
+        "version": PIPELINE_VERSION,
+        "detector": image_detector_name(),
+        "alignment_size": settings.IMAGE_ALIGNMENT_SIZE,
+    }
+
+def run_cached_image_comparison(upload1, upload2, output_dir=None):
+    """
+    Runs run_image_comparison() for two IngestedUploads through the result
+    cache, writing the highlighted image to output_dir (a new workspace by
+    default) on a miss, which is then published into the cache.
+    """
+    key = ResultCache.make_key(upload1.sha256, upload2.sha256, 'image', pipeline_params())
+    response_data, cached = get_result_cache().get_or_compute(
+        key, lambda comparison_dir: run_image_comparison(upload1.path, upload2.path, output_dir=comparison_dir),
+        output_dir,
+    )
+    return dict(response_data, cached=cached)
+
+def run_image_batch(reference_upload, candidate_uploads, output_dir=None, workers=None):
+    """
+    Compares the IngestedUpload candidate_uploads to reference_upload on up
+    to workers threads (IMAGE_BATCH_WORKERS by default) and returns the
+    response payload, with one result or error per candidate, in order.
+
+    Each candidate is resized to the reference crop, so regions are in
+    pixels of the reference. Every candidate is compared in a workspace of
+    its own (output_dir/<index> if given) and goes through the result
+    cache; the reference is only prepared once a candidate misses it.
+    """
+    workers = workers or settings.IMAGE_BATCH_WORKERS
+    params = pipeline_params()
+
+    reference = []
+    reference_lock = threading.Lock()
+
+    def get_reference():
+        with reference_lock:
+            if not reference:
+                reference.append(prepare_reference(crop_main_object(read_image(reference_upload.path))))
+            return reference[0]
+
+    def compare(candidate_dir, upload):
+        result_image_path = os.path.join(candidate_dir, "highlighted_differences.png")
+        pages = [compare_to_reference(get_reference(), read_image(upload.path), result_image_path)]
+        return {
+            "highlighted_differences_url": media_url(result_image_path),
+            "summary": summarize_pages(pages),
+            "pages": pages,
+        }
+
+    def compare_candidate(index, upload):
+        # Stage times are per thread; hand them back to the request's thread
+        with collect_stage_times() as stage_times:
+            key = ResultCache.make_key(reference_upload.sha256, upload.sha256, 'image_reference', params)
+            try:
+                result, cached = get_result_cache().get_or_compute(
+                    key, lambda candidate_dir: compare(candidate_dir, upload),
+                    os.path.join(output_dir, str(index)) if output_dir else None,
+                )
+                result = dict(result, cached=cached)
+            except Exception as e:
+                result = {"error": str(e)}
+        return dict(result, name=upload.name), stage_times
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(candidate_uploads)))) as executor:
+        futures = [executor.submit(compare_candidate, index, upload) for index, upload in enumerate(candidate_uploads)]
+        candidates = []
+        for future in futures:
+            result, stage_times = future.result()
+            record_all(stage_times)
+            candidates.append(result)
+
+    return {
+        "reference": reference_upload.name,
+        "summary": {
+            "candidates": len(candidates),
+            "changed": sum(1 for result in candidates if result.get("summary", {}).get("pages_changed")),
+            "failed": sum(1 for result in candidates if "error" in result),
+        },
+        "candidates": candidates,
+    }
+
 def get_bounding_boxes(image):
     # Convert to grayscale
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
@@ -52,13 +204,9 @@ def get_bounding_boxes(image):
     thresh = cv2.adaptiveThreshold(
         gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 21, 15
     )
-    
-    # Perform morphological operations to connect components
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 1))  # Adjust kernel size as needed
-    dilated = cv2.dilate(thresh, kernel, iterations=4)
 
     # Find contours
-    contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
     # Merge nearby contours into a single bounding box
     bounding_boxes = []
@@ -73,118 +221,180 @@ def get_bounding_boxes(image):
 
 def merge_overlapping_boxes(boxes, overlap_threshold=0.3):
     """
-    Merges overlapping or close bounding boxes.
+    Merges overlapping or close bounding boxes, transitively; see merge_boxes().
     """
-    if not boxes:
-        return []
-    
-    # Sort boxes by x-coordinates
-    boxes = sorted(boxes, key=lambda b: b[0])
-    
-    merged_boxes = []
-    current_box = boxes[0]
-    
-    for next_box in boxes[1:]:
-        x1, y1, w1, h1 = current_box
-        x2, y2, w2, h2 = next_box
-        
-        # Calculate the overlap
-        if (x2 < x1 + w1 + overlap_threshold * w1) and (y2 < y1 + h1 + overlap_threshold * h1):
-            # Merge boxes
-            x = min(x1, x2)
-            y = min(y1, y2)
-            w = max(x1 + w1, x2 + w2) - x
-            h = max(y1 + h1, y2 + h2) - y
-            current_box = (x, y, w, h)
-        else:
-            # Save the current box and move to the next
-            merged_boxes.append(current_box)
-            current_box = next_box
-    
-    # Add the last box
-    merged_boxes.append(current_box)
-    return merged_boxes
-
-def process_and_compare(img1_path, img2_path):
-    # Load the two images
-    img1 = cv2.imread(img1_path)
-    img2 = cv2.imread(img2_path)
-
-    if img1 is None or img2 is None:
+    return merge_boxes(boxes, margin=overlap_threshold)
+
+# Feature detector per IMAGE_ALIGNMENT_SPEED, from fastest to most accurate
+IMAGE_DETECTORS = {
+    "fast": "orb",
+    "balanced": "akaze",
+    "accurate": "sift",
+}
+
+# Keypoint coordinates in the downscaled copy features were detected on,
+# their descriptors, and the scale of that copy
+ImageFeatures = namedtuple('ImageFeatures', ['points', 'descriptors', 'scale'])
+
+def image_detector_name():
+    if settings.IMAGE_ALIGNMENT_SPEED not in IMAGE_DETECTORS:
+        raise ValueError(f"Unknown IMAGE_ALIGNMENT_SPEED: {settings.IMAGE_ALIGNMENT_SPEED}")
+    return IMAGE_DETECTORS[settings.IMAGE_ALIGNMENT_SPEED]
+
+def create_detector(name):
+    """Returns the OpenCV detector called name and the norm its descriptors are matched with."""
+    if name == "sift":
+        return cv2.SIFT_create(), cv2.NORM_L2
+    if name == "akaze":
+        return cv2.AKAZE_create(), cv2.NORM_HAMMING
+    return cv2.ORB_create(nfeatures=5000), cv2.NORM_HAMMING
+
+def detect_image_features(image, detector_name):
+    """
+    Detects features of a BGR image on a grayscale copy downscaled to at
+    most IMAGE_ALIGNMENT_SIZE pixels on the long side.
+    """
+    with stage('detect'):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        scale = min(1.0, settings.IMAGE_ALIGNMENT_SIZE / max(gray.shape[:2]))
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        detector, _ = create_detector(detector_name)
+        keypoints, descriptors = detector.detectAndCompute(gray, None)
+    return ImageFeatures(cv2.KeyPoint_convert(keypoints).reshape(-1, 2), descriptors, scale)
+
+def image_homography(features1, features2, detector_name):
+    """
+    Matches two ImageFeatures with a ratio test and returns the homography
+    mapping full-resolution pixels of the second image onto the first, or
+    None when fewer than 4 matches are left.
+    """
+    if features1.descriptors is None or features2.descriptors is None:
+        return None
+    with stage('match'):
+        _, norm = create_detector(detector_name)
+        matches = cv2.BFMatcher(norm).knnMatch(features1.descriptors, features2.descriptors, k=2)
+        good_matches = [pair[0] for pair in matches if len(pair) == 2 and pair[0].distance < 0.75 * pair[1].distance]
+        if len(good_matches) < 4:
+            return None
+
+        src_pts = features1.points[[m.queryIdx for m in good_matches]].reshape(-1, 1, 2)
+        dst_pts = features2.points[[m.trainIdx for m in good_matches]].reshape(-1, 1, 2)
+        H, _ = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC, 5.0)
+    if H is None:
+        return None
+    # Conjugate by the downscaling so H applies to full-resolution pixels
+    return np.diag([1 / features1.scale, 1 / features1.scale, 1]) @ H @ np.diag([features2.scale, features2.scale, 1])
+
+# The cropped reference image of a comparison, with its features
+ImageReference = namedtuple('ImageReference', ['crop', 'features', 'detector_name'])
+
+def read_image(path):
+    with stage('render'):
+        image = cv2.imread(path)
+    if image is None:
         raise ValueError("One or both images are invalid or corrupted.")
+    return image
 
-    # Step 1: Identify Objects and Bounding Boxes
-    bounding_boxes1 = get_bounding_boxes(img1)
-    bounding_boxes2 = get_bounding_boxes(img2)
+def crop_main_object(image):
+    """Crops image to its largest bounding box, assumed to be the main object."""
+    with stage('detect'):
+        bounding_boxes = get_bounding_boxes(image)
 
-    # Ensure at least one bounding box exists in both images
-    if not bounding_boxes1 or not bounding_boxes2:
+    # Ensure at least one bounding box exists
+    if not bounding_boxes:
         raise ValueError("No significant objects detected in one or both images.")
 
-    # Use the largest bounding box (assume main object)
-    x1, y1, w1, h1 = max(bounding_boxes1, key=lambda b: b[2] * b[3])
-    x2, y2, w2, h2 = max(bounding_boxes2, key=lambda b: b[2] * b[3])
-
-    # Step 2: Resize Images to Fit Identified Objects
-    padding = 0
-    crop1 = img1[max(0, y1-padding):y1+h1+padding, max(0, x1-padding):x1+w1+padding]
-    crop2 = img2[max(0, y2-padding):y2+h2+padding, max(0, x2-padding):x2+w2+padding]
+    x, y, w, h = max(bounding_boxes, key=lambda b: b[2] * b[3])
+    return image[y:y+h, x:x+w]
 
-    height, width = min(crop1.shape[0], crop2.shape[0]), min(crop1.shape[1], crop2.shape[1])
-    crop1_resized = cv2.resize(crop1, (width, height))
-    crop2_resized = cv2.resize(crop2, (width, height))
-
-    # Step 3: Convert Images to a Feature Representation Using SIFT
-    sift = cv2.SIFT_create()
-    keypoints1, descriptors1 = sift.detectAndCompute(crop1_resized, None)
-    keypoints2, descriptors2 = sift.detectAndCompute(crop2_resized, None)
-
-    # Step 4: Use Homography to Align Images
-    matcher = cv2.BFMatcher()
-    matches = matcher.knnMatch(descriptors1, descriptors2, k=2)
-
-    # Apply ratio test
-    good_matches = []
-    for m, n in matches:
-        if m.distance < 0.75 * n.distance:
-            good_matches.append(m)
+def prepare_reference(crop):
+    """
+    Detects the features of a cropped BGR reference image once, for
+    comparing any number of images to it.
+    """
+    detector_name = image_detector_name()
+    return ImageReference(crop, detect_image_features(crop, detector_name), detector_name)
 
-    if len(good_matches) < 4:
+def compare_to_reference(reference, image, result_image_path, crop=None, debug_dir=None):
+    """
+    Aligns a BGR image onto an ImageReference, writes the differences
+    highlighted on the aligned image to result_image_path and returns the
+    page result, in pixels of the reference crop. crop is the image already
+    cropped by crop_main_object().
+    """
+    height, width = reference.crop.shape[:2]
+    if crop is None:
+        crop = crop_main_object(image)
+    with stage('render'):
+        crop2_resized = cv2.resize(crop, (width, height))
+    if debug_dir:
+        with stage('output'):
+            os.makedirs(debug_dir, exist_ok=True)
+            cv2.imwrite(os.path.join(debug_dir, 'crop1_resized.jpg'), reference.crop)
+            cv2.imwrite(os.path.join(debug_dir, 'crop2_resized.jpg'), crop2_resized)
+
+    # Align on features of downscaled copies
+    features2 = detect_image_features(crop2_resized, reference.detector_name)
+    H = image_homography(reference.features, features2, reference.detector_name)
+    if H is None:
         raise ValueError("Two images are very different.")
 
-    src_pts = np.float32([keypoints1[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-    dst_pts = np.float32([keypoints2[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-
-    H, _ = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-
-    # Warp the second image to align with the first
-    crop2_aligned = cv2.warpPerspective(crop2_resized, H, (width, height))
-
-    # Step 5: Compare Images
-    crop1_gray = cv2.cvtColor(crop1_resized, cv2.COLOR_BGR2GRAY)
-    crop2_gray = cv2.cvtColor(crop2_aligned, cv2.COLOR_BGR2GRAY)
-
-    # Create a directory to save the images (if it doesn't exist)
-    debug_dir = os.path.join(settings.MEDIA_ROOT, 'debug_images')  # Adjust path as needed
-    os.makedirs(debug_dir, exist_ok=True)
-    cv2.imwrite(os.path.join(debug_dir, 'crop1_resized.jpg'), crop1_resized)
-    cv2.imwrite(os.path.join(debug_dir, 'crop2_resized.jpg'), crop2_resized) 
-
-    # Compute the absolute difference between the two images
-    # diff = cv2.absdiff(crop1_gray, crop2_gray)
-    diff = cv2.absdiff(crop1_resized, crop2_resized)
-
-    # Threshold the difference image to create a binary mask for significant differences
-    _, diff_mask = cv2.threshold(diff, 100, 255, cv2.THRESH_BINARY)
-
-    # Highlight differences in magenta on the first image
-    highlighted = crop2_resized.copy()
-    magenta = np.zeros_like(highlighted)
-    magenta[:, :] = (255, 0, 255)  # Magenta color (BGR format)
-    highlighted[diff_mask != 0] = magenta[diff_mask != 0]
-
-    # Step 6: Save the Result Image
-    result_image_path = os.path.join(settings.MEDIA_ROOT, "highlighted_differences.png")
-    cv2.imwrite(result_image_path, highlighted)
+    # Warp the second image onto the first at full resolution; pixels it does
+    # not cover are left out of the diff
+    with stage('warp'):
+        crop2_aligned = cv2.warpPerspective(crop2_resized, H, (width, height))
+        covered = cv2.warpPerspective(
+            np.full((height, width), 255, dtype=np.uint8), H, (width, height), flags=cv2.INTER_NEAREST
+        )
+
+    with stage('diff'):
+        # Compute the absolute difference between the two images
+        diff = cv2.absdiff(reference.crop, crop2_aligned)
+
+        # Threshold the difference image to create a binary mask for significant differences
+        _, diff_mask = cv2.threshold(diff, 100, 255, cv2.THRESH_BINARY)
+        changed = np.any(diff_mask != 0, axis=2) & (covered != 0)
+
+        # Highlight differences in magenta on the aligned second image
+        highlighted = crop2_aligned.copy()
+        highlighted[changed] = (255, 0, 255)  # Magenta color (BGR format)
+
+        _, regions = mask_regions(changed.astype(np.uint8) * 255, reference.crop, crop2_aligned)
+
+    with stage('output'):
+        cv2.imwrite(result_image_path, highlighted)
+
+    return {
+        "page": 1,
+        "status": "changed" if regions else "unchanged",
+        "width": width,
+        "height": height,
+        "regions": [{"bbox": list(bbox), "kind": kind} for bbox, kind in regions],
+    }
+
+def process_and_compare(img1_path, img2_path, output_dir=None):
+    # Step 1: Crop both images to their main object
+    img1 = read_image(img1_path)
+    img2 = read_image(img2_path)
+    crop1 = crop_main_object(img1)
+    crop2 = crop_main_object(img2)
+
+    # Step 2: Resize both crops to the smaller of the two and detect the
+    # features of the first
+    height, width = min(crop1.shape[0], crop2.shape[0]), min(crop1.shape[1], crop2.shape[1])
+    with stage('render'):
+        crop1_resized = cv2.resize(crop1, (width, height))
+    reference = prepare_reference(crop1_resized)
+
+    # Step 3: Align, compare and save the result image
+    output_dir = output_dir or create_workspace()
+    os.makedirs(output_dir, exist_ok=True)
+    result_image_path = os.path.join(output_dir, "highlighted_differences.png")
+    page = compare_to_reference(
+        reference, img2, result_image_path, crop=crop2,
+        debug_dir=os.path.join(output_dir, 'debug_images') if settings.DEBUG else None,
+    )
 
-    return "highlighted_differences.png"
+    # Path of the highlighted image, under MEDIA_ROOT, and the page result
+    return result_image_path, page
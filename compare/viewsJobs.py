@@ -0,0 +1,91 @@
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
+
+from .jobs import enqueue_job
+from .models import ComparisonJob
+from .uploads import UploadTooLarge, check_upload_sizes
+from .viewsPdf import COMPARISON_MODES, OUTPUT_FORMATS, parse_worker_count
+
+
+def serialize_job(job):
+    return {
+        "job_id": str(job.id),
+        "type": job.job_type,
+        "status": job.status,
+        "progress": {
+            "pages_done": job.pages_done,
+            "pages_total": job.pages_total,
+        },
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "status_url": reverse('job_status', args=[job.id]),
+        "result_url": reverse('job_result', args=[job.id]),
+    }
+
+@csrf_exempt
+def create_job(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid HTTP method."}, status=405)
+
+    job_type = request.POST.get('type')
+    file1 = request.FILES.get('file1')
+    file2 = request.FILES.get('file2')
+
+    try:
+        check_upload_sizes(request)
+    except UploadTooLarge as e:
+        return JsonResponse({"error": str(e)}, status=413)
+
+    if job_type not in dict(ComparisonJob.JOB_TYPES):
+        return JsonResponse({"error": "type must be 'pdf' or 'image'."}, status=400)
+    if not file1 or not file2:
+        return JsonResponse({"error": "Both files are required."}, status=400)
+
+    options = {}
+    if job_type == 'pdf':
+        try:
+            options['workers'] = parse_worker_count(request.POST.get('workers'))
+        except ValueError:
+            return JsonResponse({"error": "workers must be an integer."}, status=400)
+
+        options['mode'] = request.POST.get('mode', 'raster')
+        if options['mode'] not in COMPARISON_MODES:
+            return JsonResponse({"error": "mode must be 'raster' or 'text'."}, status=400)
+
+        options['output'] = request.POST.get('output', 'raster')
+        if options['output'] not in OUTPUT_FORMATS:
+            return JsonResponse({"error": "output must be 'raster' or 'vector'."}, status=400)
+
+    try:
+        job = enqueue_job(job_type, file1, file2, options)
+    except UploadTooLarge as e:
+        return JsonResponse({"error": str(e)}, status=413)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+    return JsonResponse(serialize_job(job), status=202)
+
+@require_GET
+def job_status(request, job_id):
+    try:
+        job = ComparisonJob.objects.defer('result').get(id=job_id)
+    except ComparisonJob.DoesNotExist:
+        return JsonResponse({"error": "Job not found."}, status=404)
+    return JsonResponse(serialize_job(job))
+
+@require_GET
+def job_result(request, job_id):
+    try:
+        job = ComparisonJob.objects.get(id=job_id)
+    except ComparisonJob.DoesNotExist:
+        return JsonResponse({"error": "Job not found."}, status=404)
+
+    if job.status == ComparisonJob.STATUS_FAILED:
+        return JsonResponse({"error": job.error, "status": job.status}, status=500)
+    if job.status != ComparisonJob.STATUS_DONE:
+        return JsonResponse({"error": "Job has not finished yet.", "status": job.status}, status=409)
+    return JsonResponse(job.result)
@@ -2,146 +2,830 @@ import cv2
 import numpy as np
 import fitz
 import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 
-def pdf_to_image(pdf_path, page_number, zoom=3):
-    pdf_document = fitz.open(pdf_path)
-    if page_number >= len(pdf_document):
-        return None
-    page = pdf_document[page_number]
-    mat = fitz.Matrix(zoom, zoom)
-    pix = page.get_pixmap(matrix=mat)
-    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
-    if pix.n == 1:
-        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-    return img
-
-def visualize_differences(image1, image2_aligned):
-    diff = cv2.absdiff(image1, image2_aligned)
-    diff_gray = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
-    _, diff_thresh = cv2.threshold(diff_gray, 150, 255, cv2.THRESH_BINARY)
-    contours, _ = cv2.findContours(diff_thresh, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
-    highlighted_img = image1.copy()
-    for contour in contours:
-        x, y, w, h = cv2.boundingRect(contour)
-        region1 = image1[y:y+h, x:x+w]
-        region2 = image2_aligned[y:y+h, x:x+w]
-        mean1 = np.mean(region1)
-        mean2 = np.mean(region2)
-        color = (255, 0, 0) if mean1 < mean2 else (0, 255, 0)
-        cv2.drawContours(highlighted_img, [contour], -1, color, 2)
+from .alignment import get_alignment_engine
+from .diffresult import mask_regions, region_area, summarize_pages
+from .pagematch import match_pages
+from .resultcache import ResultCache, get_result_cache, media_url
+from .textdiff import extract_words, diff_words
+from .metrics import observe_page
+from .timing import collect_stage_times, record_all, stage
+from .uploads import UploadTooLarge, check_upload_sizes, discard_upload, ingest_upload
+
+class PixmapArray(np.ndarray):
+    """A NumPy array over the samples of the fitz.Pixmap it keeps alive as .pixmap."""
+
+def pixmap_array(pix):
+    """
+    Wraps the samples of pix as a writable (height, width, n) array, or
+    (height, width) for grayscale, without copying them.
+    """
+    shape = (pix.height, pix.width) if pix.n == 1 else (pix.height, pix.width, pix.n)
+    image = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(shape).view(PixmapArray)
+    # The buffer belongs to pix and is freed with it
+    image.pixmap = pix
+    return image
+
+def render_page(page, zoom=3, grayscale=False):
+    """Renders a page as an RGB array, or a 2D grayscale one, sharing the pixmap's memory."""
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+    with stage('render'):
+        return pixmap_array(page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace))
+
+def image_pixmap(image):
+    """Returns a fitz.Pixmap of an RGB or grayscale array, its own pixmap when it has one."""
+    pixmap = getattr(image, 'pixmap', None)
+    if pixmap is not None:
+        return pixmap
+    colorspace = fitz.csGRAY if image.ndim == 2 else fitz.csRGB
+    pixmap = fitz.Pixmap(colorspace, fitz.IRect(0, 0, image.shape[1], image.shape[0]), False)
+    pixmap_array(pixmap)[...] = image
+    return pixmap
+
+def copy_image(image):
+    """Copies an array, into a new pixmap when it has one so the copy saves without another."""
+    pixmap = getattr(image, 'pixmap', None)
+    return image.copy() if pixmap is None else pixmap_array(fitz.Pixmap(pixmap, 0))
+
+def save_page_image(image, path):
+    """Writes an RGB or grayscale page array as a PNG."""
+    with stage('output'):
+        image_pixmap(image).save(path)
+
+# Highlight colors per region kind, as drawn on the rendered (RGB) page
+REGION_COLORS = {
+    "removed": (255, 0, 0),
+    "added": (0, 255, 0),
+}
+
+def visualize_differences(image1, diff_mask, labels, regions):
+    """
+    Outlines the regions of a mask_regions() result for diff_mask on an
+    RGB copy of image1, in the color of their kind.
+    """
+    highlighted_img = copy_image(image1) if image1.ndim == 3 else cv2.cvtColor(image1, cv2.COLOR_GRAY2RGB)
+    return draw_regions(highlighted_img, diff_mask, labels, regions)
+
+def draw_regions(highlighted_img, diff_mask, labels, regions):
+    """Outlines the regions like visualize_differences(), in place on an RGB image, and returns it."""
+    contours, _ = cv2.findContours(diff_mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return highlighted_img
+
+    # Every contour point lies on its region, so its first point gives the label
+    first_points = np.array([contour[0, 0] for contour in contours])
+    removed = np.array([False] + [kind == "removed" for _, kind in regions])
+    contour_removed = removed[labels[first_points[:, 1], first_points[:, 0]]]
+    for kind, selected in (("removed", contour_removed), ("added", ~contour_removed)):
+        kind_contours = [contour for contour, is_selected in zip(contours, selected) if is_selected]
+        cv2.drawContours(highlighted_img, kind_contours, -1, REGION_COLORS[kind], 2)
     return highlighted_img
 
+# Stroke colors of the vector highlights, matching REGION_COLORS
+ANNOTATION_COLORS = {
+    "removed": (1, 0, 0),
+    "added": (0, 1, 0),
+}
+
+def annotate_page(page, regions):
+    """Draws regions, in displayed page coordinates, as vector rectangles onto page."""
+    shape = page.new_shape()
+    for kind, color in ANNOTATION_COLORS.items():
+        rects = [fitz.Rect(region["bbox"]) * page.derotation_matrix
+                 for region in regions if region["kind"] == kind]
+        if not rects:
+            continue
+        for rect in rects:
+            shape.draw_rect(rect)
+        shape.finish(color=color, width=1)
+    shape.commit()
+
+def annotate_pdf(file1_path, file2_path, page_results, output_pdf_path):
+    """
+    Writes the pages of page_results with differences to output_pdf_path,
+    in order, with their "regions" drawn as vector rectangles on the
+    original pages: pages of the first document, and inserted pages (no
+    "page") of the second. Returns False, without writing, when no page has
+    differences.
+    """
+    with fitz.open(file1_path) as pdf1, fitz.open(file2_path) as pdf2, fitz.open() as output_document:
+        for result in page_results:
+            if not result.get("regions"):
+                continue
+            if result["page"] is None:
+                source, page_number = pdf2, result["page2"] - 1
+            else:
+                source, page_number = pdf1, result["page"] - 1
+            annotate_page(source[page_number], result["regions"])
+            output_document.insert_pdf(source, from_page=page_number, to_page=page_number)
+
+        if not len(output_document):
+            return False
+        output_document.save(output_pdf_path, garbage=3, deflate=True)
+    return True
+
 def images_to_pdf(image_list, output_pdf_path):
     pdf_document = fitz.open()
     for img_path in image_list:
-        img = fitz.open(img_path)
-        pdf_bytes = img.convert_to_pdf()
-        img_pdf = fitz.open("pdf", pdf_bytes)
-        pdf_document.insert_pdf(img_pdf)
+        with fitz.open(img_path) as img:
+            pdf_bytes = img.convert_to_pdf()
+        with fitz.open("pdf", pdf_bytes) as img_pdf:
+            pdf_document.insert_pdf(img_pdf)
     pdf_document.save(output_pdf_path)
     pdf_document.close()
 
-@csrf_exempt
-def compare_pdfs(request):
-    if request.method != "POST":
-        return JsonResponse({"error": "Invalid HTTP method."}, status=405)
+def diff_aligned(image1, image2_aligned, highlight=True, canvas=None):
+    """
+    Diffs two aligned images, both RGB or both grayscale, and returns
+    (highlighted image1 (RGB) or None, regions), with regions as
+    ((x0, y0, x1, y1), kind) in pixels. The highlighted image is None when
+    there are no differences or highlight is False.
 
-    file1 = request.FILES.get('file1')
-    file2 = request.FILES.get('file2')
+    The regions are outlined on a copy of image1, or, if canvas is given,
+    in place on the RGB image canvas() returns; it is only called when there
+    are differences, so grayscale comparisons can render color just for the
+    highlight.
+    """
+    with stage('diff'):
+        diff = cv2.absdiff(image1, image2_aligned)
+        diff_gray = diff if diff.ndim == 2 else cv2.cvtColor(diff, cv2.COLOR_RGB2GRAY)
+        _, diff_thresh = cv2.threshold(diff_gray, 150, 255, cv2.THRESH_BINARY)
 
-    if not file1 or not file2:
-        return JsonResponse({"error": "Both files are required."}, status=400)
+        if cv2.countNonZero(diff_thresh) == 0:
+            return None, []
+
+        labels, regions = mask_regions(diff_thresh, image1, image2_aligned)
+    if not highlight:
+        return None, regions
+    with stage('output'):
+        if canvas is None:
+            return visualize_differences(image1, diff_thresh, labels, regions), regions
+        return draw_regions(canvas(), diff_thresh, labels, regions), regions
 
+def compare_page(image1, image2, highlight=True, canvas=None):
+    """
+    Aligns image2 onto image1 and returns (highlighted page (RGB), page
+    metadata). metadata["regions"] lists the differing regions as
+    ((x0, y0, x1, y1), kind) in pixels; the highlighted page is None when
+    there are no differences or highlight is False. canvas is passed on to
+    diff_aligned().
+    """
+    gray1 = image1 if image1.ndim == 2 else cv2.cvtColor(image1, cv2.COLOR_RGB2GRAY)
+    gray2 = image2 if image2.ndim == 2 else cv2.cvtColor(image2, cv2.COLOR_RGB2GRAY)
+
+    H, alignment = get_alignment_engine().align(gray1, gray2)
+    if alignment == "identity":
+        image2_aligned = image2
+    elif H is None:
+        raise ValueError("Not enough feature matches to align the page.")
+    else:
+        height, width = image1.shape[:2]
+        with stage('warp'):
+            # Areas the second page does not cover are blank paper, not differences
+            image2_aligned = cv2.warpPerspective(image2, H, (width, height), borderValue=(255, 255, 255))
+
+    highlighted_image, regions = diff_aligned(image1, image2_aligned, highlight, canvas)
+    return highlighted_image, {"alignment": alignment, "regions": regions}
+
+def add_page_regions(result, regions, zoom):
+    """Records pixel regions of a page rendered at zoom on its result, in PDF points."""
+    if not regions:
+        print(f"Page {result['page']} has no differences.")
+        return
+    result.update(status="changed", regions=[
+        {"bbox": [round(value / zoom, 2) for value in bbox], "kind": kind}
+        for bbox, kind in regions
+    ])
+
+def compare_and_save_page(page_number, image1, image2, output_dir, zoom=3, output='raster', canvas=None):
+    """
+    Compares one page pair rendered at zoom and returns the page result.
+    "regions" lists the differing regions with bounding boxes in PDF points.
+    With the raster output the highlighted page (drawn on canvas(), see
+    diff_aligned()) is also written to output_dir and "image_path" is set.
+    """
+    result = {"page": page_number + 1, "status": "unchanged", "image_path": None}
     try:
-        # Save uploaded files temporarily
-        temp_dir = os.path.join(settings.MEDIA_ROOT, 'temp_files')
-        os.makedirs(temp_dir, exist_ok=True)
-        file1_path = os.path.join(temp_dir, file1.name)
-        file2_path = os.path.join(temp_dir, file2.name)
+        highlighted_image, metadata = compare_page(image1, image2, highlight=(output == 'raster'), canvas=canvas)
+    except Exception as e:
+        print(f"Error processing page {page_number + 1}: {e}")
+        result.update(status="error", error=str(e))
+        return result
 
-        with open(file1_path, 'wb') as f:
-            f.write(file1.read())
-        with open(file2_path, 'wb') as f:
-            f.write(file2.read())
+    add_page_regions(result, metadata.pop("regions"), zoom)
+    result.update(metadata)
+    if highlighted_image is not None:
+        output_image_path = os.path.join(output_dir, f"highlighted_page_{page_number + 1}.png")
+        save_page_image(highlighted_image, output_image_path)
+        result["image_path"] = output_image_path
+    return result
 
-        # Generate the output path
-        output_pdf_path = os.path.join(settings.MEDIA_ROOT, 'Highlighted_Output.pdf')
+# Estimated bytes held per page pixel while a page pair is compared whole:
+# both renders and their grays, the warped copy, the diff and masks, the
+# labels and the highlighted copy
+COMPARE_BYTES_PER_PIXEL = 24
+# Same for grayscale renders, plus the color render of the first page that
+# differences are highlighted on
+GRAY_COMPARE_BYTES_PER_PIXEL = 16
+# Same per tile pixel for tiled comparison, where the second page's clip is
+# rendered with a margin for the alignment transform
+TILE_BYTES_PER_PIXEL = 32
+MIN_TILE_SIZE = 256
 
-        # Compare PDFs
-        pdf1 = fitz.open(file1_path)
-        pdf2 = fitz.open(file2_path)
+def render_scale_for(page, pages_total, memory_limit):
+    """
+    Picks how a page pair is rendered and returns (zoom, grayscale).
 
-        output_images = []
+    zoom starts at PDF_RENDER_ZOOM and is lowered so that the pages_total
+    pages compared by a request stay within PDF_RENDER_PIXEL_BUDGET, which
+    bounds its latency. Pages are compared in grayscale with
+    PDF_GRAYSCALE_PIPELINE, otherwise only if the pair would need more than
+    memory_limit bytes in color. If grayscale is still too much, the zoom
+    is lowered to fit. zoom never goes below PDF_MIN_RENDER_ZOOM; pairs that do not
+    fit even then are tiled by compare_page_pair().
+    """
+    area = page.rect.width * page.rect.height
+    budget_zoom = np.sqrt(settings.PDF_RENDER_PIXEL_BUDGET / max(1, pages_total) / area)
+    zoom = max(settings.PDF_MIN_RENDER_ZOOM, min(settings.PDF_RENDER_ZOOM, budget_zoom))
+    if not settings.PDF_GRAYSCALE_PIPELINE and area * zoom * zoom * COMPARE_BYTES_PER_PIXEL <= memory_limit:
+        return round_zoom(zoom), False
+    memory_zoom = np.sqrt(memory_limit / GRAY_COMPARE_BYTES_PER_PIXEL / area)
+    return round_zoom(max(settings.PDF_MIN_RENDER_ZOOM, min(zoom, memory_zoom))), True
 
-        for page_number in range(min(len(pdf1), len(pdf2))):
-            try:
-                image1 = pdf_to_image(file1_path, page_number)
-                image2 = pdf_to_image(file2_path, page_number)
+def round_zoom(zoom):
+    """Rounds a zoom down to two decimals, so results are stable across runs."""
+    return float(np.floor(zoom * 100) / 100)
 
-                if image1 is None or image2 is None:
-                    continue
+def tile_size_for(page, zoom, memory_limit, grayscale=False):
+    """
+    Returns None when a page pair rendered at zoom can be compared whole
+    within memory_limit bytes, otherwise the tile size, in pixels, to
+    compare it with: PDF_TILE_SIZE, halved until a tile fits. Raises
+    MemoryError when not even a MIN_TILE_SIZE tile fits.
+    """
+    pixels = int(np.ceil(page.rect.width * zoom)) * int(np.ceil(page.rect.height * zoom))
+    bytes_per_pixel = GRAY_COMPARE_BYTES_PER_PIXEL if grayscale else COMPARE_BYTES_PER_PIXEL
+    if pixels * bytes_per_pixel <= memory_limit:
+        return None
+    tile_size = settings.PDF_TILE_SIZE
+    while tile_size * tile_size * TILE_BYTES_PER_PIXEL > memory_limit:
+        tile_size //= 2
+        if tile_size < MIN_TILE_SIZE:
+            raise MemoryError(f"Page {page.number + 1} cannot be compared within {memory_limit} bytes.")
+    return tile_size
+
+def render_clip(page, zoom, x0, y0, x1, y1, grayscale=False):
+    """
+    Renders the pixels [x0, x1) x [y0, y1) of the page rendered at zoom,
+    as render_page() would, padding with white outside the page.
+    """
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+    with stage('render'):
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=fitz.Rect(x0, y0, x1, y1) / zoom, colorspace=colorspace)
+    image = pixmap_array(pix)
+    # Clip rendering rounds outwards to whole pixels; keep exactly the requested ones
+    image = image[max(0, y0 - pix.y):max(0, y1 - pix.y), max(0, x0 - pix.x):max(0, x1 - pix.x)]
+    top, left = max(0, pix.y - y0), max(0, pix.x - x0)
+    bottom, right = (y1 - y0) - top - image.shape[0], (x1 - x0) - left - image.shape[1]
+    if top or left or bottom or right:
+        image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(255, 255, 255))
+    return image
+
+def translation(x, y):
+    return np.array([[1, 0, x], [0, 1, y], [0, 0, 1]], dtype=np.float64)
 
-                gray1 = cv2.cvtColor(image1, cv2.COLOR_BGR2GRAY)
-                gray2 = cv2.cvtColor(image2, cv2.COLOR_BGR2GRAY)
+def stitch_tile_regions(regions, tile_size):
+    """
+    Joins the ((x0, y0, x1, y1), kind) regions of a tiled comparison that
+    were split by tile seams: regions ending on a seam and regions starting
+    on it that overlap or touch along it are replaced by their bounding box,
+    transitively, with the kind of the largest part. Returns the regions
+    sorted by y0 and x0.
+    """
+    if not regions:
+        return []
+    boxes = np.array([bbox for bbox, _ in regions], dtype=np.int64).reshape(-1, 4)
+    pairs = []
+    # Vertical seams, then horizontal ones
+    for axis in (0, 1):
+        start, end = boxes[:, axis], boxes[:, axis + 2]
+        across_start, across_end = boxes[:, 1 - axis], boxes[:, 3 - axis]
+        starting = {}
+        for j in np.flatnonzero((start > 0) & (start % tile_size == 0)).tolist():
+            starting.setdefault(int(start[j]), []).append(j)
+        for i in np.flatnonzero(end % tile_size == 0).tolist():
+            for j in starting.get(int(end[i]), ()):
+                if across_start[i] <= across_end[j] and across_start[j] <= across_end[i]:
+                    pairs.append((i, j))
+    if not pairs:
+        return sorted(regions, key=lambda region: (region[0][1], region[0][0]))
 
-                orb = cv2.ORB_create(
-                    nfeatures=10000, scaleFactor=1.1, nlevels=32,
-                    edgeThreshold=31, firstLevel=0, WTA_K=2, 
-                    patchSize=31, fastThreshold=1
+    i, j = np.array(pairs).T
+    graph = coo_matrix((np.ones(len(pairs), dtype=np.int8), (i, j)), shape=(len(boxes),) * 2)
+    count, labels = connected_components(graph, directed=False)
+    stitched = []
+    for label in range(count):
+        members = np.flatnonzero(labels == label)
+        group = boxes[members]
+        largest = members[np.argmax([region_area(box) for box in group.tolist()])]
+        bbox = (*group[:, :2].min(axis=0).tolist(), *group[:, 2:].max(axis=0).tolist())
+        stitched.append((bbox, regions[largest][1]))
+    return sorted(stitched, key=lambda region: (region[0][1], region[0][0]))
+
+def compare_and_save_page_tiled(page_number, page1, page2, output_dir, tile_size, zoom=3, output='raster',
+                                grayscale=False):
+    """
+    Compares one page pair at zoom in tile_size x tile_size tiles and returns
+    the page result, like compare_and_save_page() but holding one tile pair
+    in memory at a time.
+
+    The pages are aligned once on renders downscaled to
+    PDF_TILE_ALIGNMENT_SIZE; every tile of page1 is then rendered by clip
+    rectangle and diffed against the matching area of page2, warped with the
+    global transform. Regions split by tile edges are joined again by
+    stitch_tile_regions(). With
+    the raster output the highlighted tiles are assembled into a one-page
+    PDF, written to output_dir as "image_path"; tiles compared in grayscale
+    are rendered again in color for it.
+    """
+    result = {"page": page_number + 1, "status": "unchanged", "image_path": None}
+    try:
+        align_zoom = min(zoom, settings.PDF_TILE_ALIGNMENT_SIZE / max(page1.rect.width, page1.rect.height))
+        gray1 = render_page(page1, align_zoom, grayscale=True)
+        gray2 = render_page(page2, align_zoom, grayscale=True)
+        H, alignment = get_alignment_engine().align(gray1, gray2)
+        del gray1, gray2
+        if alignment != "identity" and H is None:
+            raise ValueError("Not enough feature matches to align the page.")
+        if alignment != "identity":
+            # Maps page2 pixels at zoom to page1 pixels at zoom
+            scale = np.diag([zoom / align_zoom, zoom / align_zoom, 1])
+            H = scale @ H @ np.linalg.inv(scale)
+
+        width = int(np.ceil(page1.rect.width * zoom))
+        height = int(np.ceil(page1.rect.height * zoom))
+        width2 = int(np.ceil(page2.rect.width * zoom))
+        height2 = int(np.ceil(page2.rect.height * zoom))
+        highlighted_document = highlighted_page = None
+        if output == 'raster':
+            # Sized like the PNG pages images_to_pdf() converts at 96 dpi
+            highlighted_document = fitz.open()
+            highlighted_page = highlighted_document.new_page(width=width * 0.75, height=height * 0.75)
+        regions = []
+        tiles = 0
+        for y0 in range(0, height, tile_size):
+            for x0 in range(0, width, tile_size):
+                x1, y1 = min(x0 + tile_size, width), min(y0 + tile_size, height)
+                tile1 = render_clip(page1, zoom, x0, y0, x1, y1, grayscale)
+                if alignment == "identity":
+                    tile2 = render_clip(page2, zoom, x0, y0, x1, y1, grayscale)
+                else:
+                    # Area of page2 that lands on this tile, with a margin for interpolation
+                    corners = np.float32([[x0, y0], [x1, y0], [x1, y1], [x0, y1]]).reshape(-1, 1, 2)
+                    source = cv2.perspectiveTransform(corners, np.linalg.inv(H)).reshape(-1, 2)
+                    sx0, sy0 = np.floor(source.min(axis=0)).astype(int) - 2
+                    sx1, sy1 = np.ceil(source.max(axis=0)).astype(int) + 2
+                    sx0, sy0 = min(max(sx0, 0), width2 - 1), min(max(sy0, 0), height2 - 1)
+                    sx1, sy1 = max(min(sx1, width2), sx0 + 1), max(min(sy1, height2), sy0 + 1)
+                    clip2 = render_clip(page2, zoom, sx0, sy0, sx1, sy1, grayscale)
+                    transform = translation(-x0, -y0) @ H @ translation(sx0, sy0)
+                    with stage('warp'):
+                        tile2 = cv2.warpPerspective(
+                            clip2, transform, (x1 - x0, y1 - y0), borderValue=(255, 255, 255)
+                        )
+                    del clip2
+
+                color_tile = (lambda: render_clip(page1, zoom, x0, y0, x1, y1)) if grayscale else None
+                highlighted_tile, tile_regions = diff_aligned(
+                    tile1, tile2, highlight=output == 'raster', canvas=color_tile
                 )
+                regions.extend(
+                    ((bx0 + x0, by0 + y0, bx1 + x0, by1 + y0), kind)
+                    for (bx0, by0, bx1, by1), kind in tile_regions
+                )
+                if highlighted_page is not None:
+                    if highlighted_tile is None:
+                        highlighted_tile = color_tile() if grayscale else tile1
+                    with stage('output'):
+                        highlighted_page.insert_image(
+                            fitz.Rect(x0, y0, x1, y1) * 0.75, pixmap=image_pixmap(highlighted_tile)
+                        )
+                tiles += 1
+                del tile1, tile2, highlighted_tile
+    except Exception as e:
+        print(f"Error processing page {page_number + 1}: {e}")
+        result.update(status="error", error=str(e))
+        return result
 
-                kp1, des1 = orb.detectAndCompute(gray1, None)
-                kp2, des2 = orb.detectAndCompute(gray2, None)
+    result.update(alignment=alignment, tiles=tiles)
+    add_page_regions(result, stitch_tile_regions(regions, tile_size), zoom)
+    if highlighted_document is not None:
+        if regions:
+            result["image_path"] = os.path.join(output_dir, f"highlighted_page_{page_number + 1}.pdf")
+            with stage('output'):
+                highlighted_document.save(result["image_path"], deflate=True)
+        highlighted_document.close()
+    return result
 
-                bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-                matches = bf.match(des1, des2)
-                matches = sorted(matches, key=lambda x: x.distance, reverse=False)
+def compare_page_pair(pdf1, pdf2, page_number1, page_number2, output_dir, output='raster', memory_limit=None,
+                      pages_total=1):
+    """
+    Renders and compares page_number1 of pdf1 with page_number2 of pdf2 at
+    the scale render_scale_for() picks within PDF_COMPARE_MEMORY_LIMIT for a
+    request comparing pages_total page pairs, tiling the comparison when
+    comparing the pages whole would take more than memory_limit bytes, the
+    share of the limit this comparison may use (all of it by default). The
+    scale does not depend on that share, so neither does the output of pages
+    compared whole. Grayscale comparisons render page1 in color only to
+    highlight differences. The zoom and colorspace used are recorded on the
+    result.
+    """
+    page1, page2 = pdf1[page_number1], pdf2[page_number2]
+    zoom, grayscale = render_scale_for(page1, pages_total, settings.PDF_COMPARE_MEMORY_LIMIT)
+    try:
+        tile_size = tile_size_for(page1, zoom, memory_limit or settings.PDF_COMPARE_MEMORY_LIMIT, grayscale)
+    except MemoryError as e:
+        print(f"Error processing page {page_number1 + 1}: {e}")
+        return {"page": page_number1 + 1, "status": "error", "image_path": None, "error": str(e)}
+    if tile_size:
+        result = compare_and_save_page_tiled(
+            page_number1, page1, page2, output_dir, tile_size, zoom, output, grayscale
+        )
+    else:
+        result = compare_and_save_page(
+            page_number1, render_page(page1, zoom, grayscale), render_page(page2, zoom, grayscale),
+            output_dir, zoom, output, canvas=(lambda: render_page(page1, zoom)) if grayscale else None,
+        )
+    result.update(zoom=zoom, grayscale=grayscale)
+    return result
 
-                src_pts = np.float32([kp1[m.queryIdx].pt for m in matches]).reshape(-1, 1, 2)
-                dst_pts = np.float32([kp2[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
+# Documents opened once per pool worker by _init_page_worker
+_worker_documents = None
 
-                H, mask = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC)
-                height, width, _ = image1.shape
-                image2_aligned = cv2.warpPerspective(image2, H, (width, height))
+def _init_page_worker(file1_path, file2_path):
+    global _worker_documents
+    _worker_documents = (fitz.open(file1_path), fitz.open(file2_path))
 
-                diff = cv2.absdiff(image1, image2_aligned)
-                diff_gray = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
-                _, diff_thresh = cv2.threshold(diff_gray, 150, 255, cv2.THRESH_BINARY)
+def _compare_page_in_worker(page_pair, output_dir, output, memory_limit, pages_total):
+    """Returns the page result and the stage times of the worker, for the parent to record."""
+    pdf1, pdf2 = _worker_documents
+    with collect_stage_times() as stage_times:
+        result = compare_page_pair(pdf1, pdf2, *page_pair, output_dir, output, memory_limit, pages_total)
+    return result, stage_times
 
-                if cv2.countNonZero(diff_thresh) > 0:
-                    highlighted_image = visualize_differences(image1, image2_aligned)
-                    highlighted_image = cv2.cvtColor(highlighted_image, cv2.COLOR_BGR2RGB)
-                    # Save intermediate images
-                    output_image_path = os.path.join(temp_dir, f"highlighted_page_{page_number + 1}.png")
-                    cv2.imwrite(output_image_path, highlighted_image)
-                    output_images.append(output_image_path)
-                    
-                else:
-                    print(f"Page {page_number + 1} has no differences.")
-            except Exception as e:
-                print(f"Error processing page {page_number + 1}: {e}")
-
-        if output_images:
-            images_to_pdf(output_images, output_pdf_path)
-            response_data = {
-                "highlighted_pdf_url": f"{settings.MEDIA_URL}Highlighted_Output.pdf"
-            }
+# Border drawn around whole inserted or deleted pages in the raster output, in pixels
+UNMATCHED_PAGE_BORDER = 12
+
+def unmatched_page_result(page_number1, page_number2, page, output_dir, output='raster', zoom=3):
+    """
+    Returns the whole-page result for a page only in the first document
+    ("deleted", page is from the first document) or only in the second
+    ("inserted", page is from the second). Its single region covers the
+    page. With the raster output the page is also written to output_dir with
+    a border in the color of the region.
+    """
+    deleted = page_number2 is None
+    kind = "removed" if deleted else "added"
+    width, height = page.rect.width, page.rect.height
+    result = {
+        "page": page_number1 + 1 if deleted else None,
+        "page2": None if deleted else page_number2 + 1,
+        "status": "deleted" if deleted else "inserted",
+        "image_path": None,
+        "width": width,
+        "height": height,
+        "regions": [{"bbox": [0, 0, width, height], "kind": kind}],
+    }
+    if output == 'raster':
+        image = render_page(page, zoom)
+        cv2.rectangle(image, (0, 0), (image.shape[1] - 1, image.shape[0] - 1),
+                      REGION_COLORS[kind], UNMATCHED_PAGE_BORDER)
+        name = f"highlighted_page_{page_number1 + 1}.png" if deleted else f"highlighted_inserted_page_{page_number2 + 1}.png"
+        result["image_path"] = os.path.join(output_dir, name)
+        save_page_image(image, result["image_path"])
+        result["zoom"] = zoom
+    return result
+
+def compare_pdf_pages(file1_path, file2_path, output_dir, workers=1, progress=None, output='raster'):
+    """
+    Compares the two PDFs page by page and returns one result per page, in
+    document order.
+
+    The page sequences are first matched on thumbnail signatures
+    (pagematch.match_pages), so inserted and deleted pages are reported as
+    whole-page results instead of shifting every following pair. Matched
+    pages that render identically are reported as "skipped" without running
+    the full pipeline. With workers > 1 the remaining pairs are fanned out to
+    a process pool; each worker parses both documents once and renders only
+    the pages it is given. progress, if given, is called as
+    progress(pages_done, pages_total).
+    """
+    page_results = {}
+    pairs_to_compare = []
+    page_sizes = {}
+    # Opened once for matching and, without a pool, for diffing
+    with fitz.open(file1_path) as pdf1, fitz.open(file2_path) as pdf2:
+        page_matches = match_pages(pdf1, pdf2, settings.PDF_PAGE_GAP_COST)
+        page_count = len(page_matches)
+        for index, (page_number1, page_number2, identical) in enumerate(page_matches):
+            if page_number1 is None or page_number2 is None:
+                page = pdf1[page_number1] if page_number2 is None else pdf2[page_number2]
+                zoom, _ = render_scale_for(page, page_count, settings.PDF_COMPARE_MEMORY_LIMIT)
+                page_results[index] = unmatched_page_result(
+                    page_number1, page_number2, page, output_dir, output, zoom
+                )
+                continue
+            page_sizes[index] = (pdf1[page_number1].rect.width, pdf1[page_number1].rect.height)
+            if identical:
+                page_results[index] = {"page": page_number1 + 1, "status": "skipped", "image_path": None}
+            else:
+                pairs_to_compare.append((index, page_number1, page_number2))
+
+        def report_progress():
+            if progress:
+                progress(len(page_results), page_count)
+
+        report_progress()
+
+        if workers <= 1 or len(pairs_to_compare) <= 1:
+            # Hold one rendered page pair in memory at a time
+            for index, page_number1, page_number2 in pairs_to_compare:
+                with collect_stage_times() as stage_times:
+                    page_results[index] = compare_page_pair(
+                        pdf1, pdf2, page_number1, page_number2, output_dir, output, pages_total=len(pairs_to_compare)
+                    )
+                observe_page(stage_times)
+                report_progress()
         else:
-            response_data = {"message": "No differences found."}
+            workers = min(workers, len(pairs_to_compare))
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_page_worker,
+                initargs=(file1_path, file2_path),
+            ) as executor:
+                # The memory limit is per request, so the workers tile within their share of it
+                results = executor.map(
+                    _compare_page_in_worker,
+                    [(page_number1, page_number2) for _, page_number1, page_number2 in pairs_to_compare],
+                    [output_dir] * len(pairs_to_compare),
+                    [output] * len(pairs_to_compare),
+                    [settings.PDF_COMPARE_MEMORY_LIMIT // workers] * len(pairs_to_compare),
+                    [len(pairs_to_compare)] * len(pairs_to_compare),
+                )
+                for (index, _, _), (result, stage_times) in zip(pairs_to_compare, results):
+                    page_results[index] = result
+                    # Stage times add up across workers, so they can exceed the wall time
+                    record_all(stage_times)
+                    observe_page(stage_times)
+                    report_progress()
 
-        # Cleanup
-        for temp_file in [file1_path, file2_path]:
-            if os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                except Exception as e:
-                    # Log or handle the exception
-                    print(f"Error removing file {temp_file}: {e}")
+    for index, (width, height) in page_sizes.items():
+        page_results[index]["page2"] = page_matches[index][1] + 1
+        page_results[index]["width"], page_results[index]["height"] = width, height
+    return [page_results[index] for index in range(page_count)]
+
+def text_regions(changes, page1):
+    """
+    Returns the word diff changes as regions on the first page, in displayed
+    coordinates like every other region: removed words where they were, and
+    added words as a marker at their insertion_anchor(), since their boxes
+    are on the second page (they stay in "changes").
+    """
+    boxes = [("removed", word["bbox"]) for change in changes for word in change["old"]]
+    boxes += [("added", change["anchor"]) for change in changes if change.get("anchor")]
+    return [
+        {"bbox": [round(value, 2) for value in fitz.Rect(bbox) * page1.rotation_matrix], "kind": kind}
+        for kind, bbox in boxes
+    ]
+
+def save_text_page_image(page, regions, output_dir, zoom=3):
+    """
+    Renders page at zoom with the text_regions() outlined in the color of
+    their kind, writes it to output_dir and returns its path.
+    """
+    image = render_page(page, zoom)
+    with stage('output'):
+        for region in regions:
+            x0, y0, x1, y1 = (int(round(value * zoom)) for value in region["bbox"])
+            cv2.rectangle(image, (x0, y0), (x1, y1), REGION_COLORS[region["kind"]], 2)
+    path = os.path.join(output_dir, f"highlighted_page_{page.number + 1}.png")
+    save_page_image(image, path)
+    return path
+
+def compare_pdf_text(file1_path, file2_path, output_dir, progress=None, output='raster'):
+    """
+    Compares the text layers of the two PDFs word by word and returns one
+    result per page, in document order. Pages are matched as in
+    compare_pdf_pages(); matched pages where either side has no text layer
+    fall back to the raster pipeline. With the raster output changed pages
+    are written to output_dir with their text_regions() outlined.
+    """
+    page_results = []
+    with fitz.open(file1_path) as pdf1, fitz.open(file2_path) as pdf2:
+        page_matches = match_pages(pdf1, pdf2, settings.PDF_PAGE_GAP_COST)
+        page_count = len(page_matches)
+        if progress:
+            progress(0, page_count)
+
+        for index, (page_number1, page_number2, identical) in enumerate(page_matches):
+            if page_number1 is None or page_number2 is None:
+                page = pdf1[page_number1] if page_number2 is None else pdf2[page_number2]
+                zoom, _ = render_scale_for(page, page_count, settings.PDF_COMPARE_MEMORY_LIMIT)
+                page_results.append(unmatched_page_result(page_number1, page_number2, page, output_dir, output, zoom))
+                if progress:
+                    progress(index + 1, page_count)
+                continue
+
+            page1, page2 = pdf1[page_number1], pdf2[page_number2]
+            with stage('render'):
+                words1, words2 = extract_words(page1), extract_words(page2)
+
+            if words1 and words2:
+                with stage('diff'):
+                    changes = diff_words(words1, words2)
+                result = {
+                    "page": page_number1 + 1,
+                    "status": "changed" if changes else "unchanged",
+                    "image_path": None,
+                    "changes": changes,
+                    "regions": text_regions(changes, page1),
+                }
+                if changes and output == 'raster':
+                    zoom, _ = render_scale_for(page1, page_count, settings.PDF_COMPARE_MEMORY_LIMIT)
+                    result["image_path"] = save_text_page_image(page1, result["regions"], output_dir, zoom)
+                    result["zoom"] = zoom
+            elif identical:
+                result = {"page": page_number1 + 1, "status": "skipped", "image_path": None}
+            else:
+                with collect_stage_times() as stage_times:
+                    result = compare_page_pair(
+                        pdf1, pdf2, page_number1, page_number2, output_dir, output, pages_total=page_count
+                    )
+                observe_page(stage_times)
+
+            result["page2"] = page_number2 + 1
+            result["mode"] = "text" if "changes" in result else "raster"
+            result["width"], result["height"] = page1.rect.width, page1.rect.height
+            page_results.append(result)
+            if progress:
+                progress(index + 1, page_count)
+
+    return page_results
+
+def parse_worker_count(value):
+    """
+    Parses the "workers" request field, falling back to PDF_COMPARE_WORKERS.
+    Raises ValueError when the value is not an integer.
+    """
+    if value in (None, ''):
+        value = settings.PDF_COMPARE_WORKERS
+    return max(1, min(int(value), settings.PDF_COMPARE_MAX_WORKERS))
+
+# "raster" compares rendered pages; "text" diffs the words of the text layer
+COMPARISON_MODES = ('raster', 'text')
+# "raster" builds the highlighted PDF from rendered PNG pages; "vector" draws
+# the highlights onto a copy of the first document
+OUTPUT_FORMATS = ('raster', 'vector')
+
+def run_pdf_comparison(file1_path, file2_path, image_dir, output_pdf_path, workers=1, progress=None,
+                       mode='raster', output='raster'):
+    """
+    Runs the full PDF comparison and returns the response payload.
+    """
+    os.makedirs(image_dir, exist_ok=True)
+    if mode == 'text':
+        page_results = compare_pdf_text(file1_path, file2_path, image_dir, progress=progress, output=output)
+    else:
+        page_results = compare_pdf_pages(
+            file1_path, file2_path, image_dir, workers=workers, progress=progress, output=output
+        )
+
+    response_data = {
+        "mode": mode,
+        "pages_total": len(page_results),
+        "pages_skipped": sum(1 for result in page_results if result["status"] == "skipped"),
+    }
+    # Structured result: regions in PDF points per page, with their stats
+    response_data["pages"] = [
+        {key: value for key, value in result.items() if key != "image_path"}
+        for result in page_results
+    ]
+    response_data["summary"] = summarize_pages(response_data["pages"])
+
+    has_differences = any(result.get("regions") for result in page_results)
+    with stage('output'):
+        if has_differences and output == 'vector':
+            annotate_pdf(file1_path, file2_path, page_results, output_pdf_path)
+        elif has_differences:
+            images_to_pdf([result["image_path"] for result in page_results if result["image_path"]], output_pdf_path)
+
+    if not has_differences:
+        response_data["message"] = "No differences found."
+        return response_data
+
+    response_data["highlighted_pdf_url"] = media_url(output_pdf_path)
+    return response_data
+
+# Bump whenever a pipeline change alters comparison output, so cached results are not reused
+PIPELINE_VERSION = 13
+
+def pipeline_params(mode, output):
+    """Parameters that determine the output of a PDF comparison, for the result cache key."""
+    return {
+        "version": PIPELINE_VERSION,
+        "mode": mode,
+        "output": output,
+        "matcher": settings.PDF_ALIGNMENT_MATCHER,
+        "max_matches": settings.PDF_ALIGNMENT_MAX_MATCHES,
+        "page_gap_cost": settings.PDF_PAGE_GAP_COST,
+        "memory_limit": settings.PDF_COMPARE_MEMORY_LIMIT,
+        "tile_size": settings.PDF_TILE_SIZE,
+        "tile_alignment_size": settings.PDF_TILE_ALIGNMENT_SIZE,
+        "render_zoom": settings.PDF_RENDER_ZOOM,
+        "min_render_zoom": settings.PDF_MIN_RENDER_ZOOM,
+        "render_pixel_budget": settings.PDF_RENDER_PIXEL_BUDGET,
+        "grayscale_pipeline": settings.PDF_GRAYSCALE_PIPELINE,
+        "coarse_size": settings.PDF_ALIGNMENT_COARSE_SIZE,
+        "identity_tolerance": settings.PDF_ALIGNMENT_IDENTITY_TOLERANCE,
+    }
+
+def run_cached_pdf_comparison(upload1, upload2, output_dir=None, workers=1, progress=None,
+                              mode='raster', output='raster'):
+    """
+    Runs run_pdf_comparison() for two IngestedUploads through the result
+    cache. On a hit the stored payload is returned without running the
+    pipeline; otherwise the highlighted PDF is written into the cache entry,
+    or left in output_dir (a new workspace by default) when the cache is
+    disabled. The page images it is built from are removed afterwards.
+    """
+    key = ResultCache.make_key(upload1.sha256, upload2.sha256, 'pdf', pipeline_params(mode, output))
 
+    def compute(pdf_dir):
+        image_dir = os.path.join(pdf_dir, 'pages')
+        try:
+            return run_pdf_comparison(
+                upload1.path, upload2.path, image_dir, os.path.join(pdf_dir, 'Highlighted_Output.pdf'),
+                workers=workers, progress=progress, mode=mode, output=output,
+            )
+        finally:
+            shutil.rmtree(image_dir, ignore_errors=True)
+
+    response_data, cached = get_result_cache().get_or_compute(key, compute, output_dir)
+    if cached and progress:
+        progress(response_data["pages_total"], response_data["pages_total"])
+    return dict(response_data, cached=cached)
+
+@csrf_exempt
+def compare_pdfs(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid HTTP method."}, status=405)
+
+    file1 = request.FILES.get('file1')
+    file2 = request.FILES.get('file2')
+
+    try:
+        check_upload_sizes(request)
+    except UploadTooLarge as e:
+        return JsonResponse({"error": str(e)}, status=413)
+
+    if not file1 or not file2:
+        return JsonResponse({"error": "Both files are required."}, status=400)
+
+    try:
+        workers = parse_worker_count(request.POST.get('workers'))
+    except ValueError:
+        return JsonResponse({"error": "workers must be an integer."}, status=400)
+
+    mode = request.POST.get('mode', 'raster')
+    if mode not in COMPARISON_MODES:
+        return JsonResponse({"error": "mode must be 'raster' or 'text'."}, status=400)
+
+    output = request.POST.get('output', 'raster')
+    if output not in OUTPUT_FORMATS:
+        return JsonResponse({"error": "output must be 'raster' or 'vector'."}, status=400)
+
+    upload1 = upload2 = None
+    try:
+        # Stream uploaded files to disk
+        upload1 = ingest_upload(file1)
+        upload2 = ingest_upload(file2)
+
+        # Compare PDFs
+        response_data = run_cached_pdf_comparison(upload1, upload2, workers=workers, mode=mode, output=output)
         return JsonResponse(response_data)
 
+    except UploadTooLarge as e:
+        return JsonResponse({"error": str(e)}, status=413)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
+    finally:
+        # Cleanup
+        discard_upload(upload1)
+        discard_upload(upload2)
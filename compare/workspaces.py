@@ -0,0 +1,123 @@
+import fcntl
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_reap_lock = threading.Lock()
+_last_reap = None
+
+# Suffix of the lock file next to a workspace that marks it in use
+LOCK_SUFFIX = '.lock'
+
+
+def create_workspace(name=None):
+    """
+    Creates and returns a directory of its own under COMPARE_WORKSPACE_DIR
+    for the artifacts of one comparison, named name or a random one. Old
+    workspaces are reaped in the background at most every
+    COMPARE_WORKSPACE_REAP_INTERVAL seconds.
+    """
+    path = os.path.join(settings.COMPARE_WORKSPACE_DIR, name or uuid.uuid4().hex)
+    os.makedirs(path, exist_ok=True)
+    reap_in_background()
+    return path
+
+@contextmanager
+def workspace_in_use(path):
+    """
+    Marks the workspace at path as in use until the block exits, however
+    long that takes, so reap_workspaces() leaves it alone. The mark is an
+    exclusive lock on path + LOCK_SUFFIX, which the OS releases if the
+    process dies.
+    """
+    lock_path = path.rstrip(os.sep) + LOCK_SUFFIX
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield path
+        finally:
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+
+def in_use(path):
+    """True while a workspace_in_use() block holds the workspace at path."""
+    try:
+        with open(path.rstrip(os.sep) + LOCK_SUFFIX) as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+    except FileNotFoundError:
+        pass
+    return False
+
+def workspaces():
+    """Returns (last used, size in bytes, path) for every workspace, last used being its newest file."""
+    entries = []
+    root = settings.COMPARE_WORKSPACE_DIR
+    if not os.path.isdir(root):
+        return entries
+    for entry in os.scandir(root):
+        if not entry.is_dir(follow_symlinks=False):
+            continue
+        last_used, size = entry.stat().st_mtime, 0
+        for dirpath, _, names in os.walk(entry.path):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(dirpath, name))
+                except FileNotFoundError:
+                    continue
+                last_used, size = max(last_used, stat.st_mtime), size + stat.st_size
+        entries.append((last_used, size, entry.path))
+    return entries
+
+def reap_workspaces(ttl=None, max_bytes=None, grace=None, now=None):
+    """
+    Removes workspaces unused for more than ttl seconds, then the least
+    recently used ones until all fit in max_bytes (COMPARE_WORKSPACE_TTL and
+    COMPARE_WORKSPACE_MAX_BYTES by default). Workspaces in use (see
+    workspace_in_use()) are never removed, and those used in the last grace
+    seconds, e.g. outputs still being downloaded, are kept even over the
+    budget. Lock files left behind by dead processes are removed too.
+    Returns the number of workspaces removed and bytes freed.
+    """
+    ttl = settings.COMPARE_WORKSPACE_TTL if ttl is None else ttl
+    max_bytes = settings.COMPARE_WORKSPACE_MAX_BYTES if max_bytes is None else max_bytes
+    grace = settings.COMPARE_WORKSPACE_GRACE if grace is None else grace
+    now = time.time() if now is None else now
+
+    entries = sorted(workspaces())
+    total = sum(size for _, size, _ in entries)
+    removed = freed = 0
+    for last_used, size, path in entries:
+        if in_use(path) or (now - last_used <= ttl and (total <= max_bytes or now - last_used <= grace)):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed, freed, total = removed + 1, freed + size, total - size
+
+    root = settings.COMPARE_WORKSPACE_DIR
+    for entry in os.scandir(root) if os.path.isdir(root) else ():
+        if entry.name.endswith(LOCK_SUFFIX) and now - entry.stat().st_mtime > grace:
+            path = entry.path[:-len(LOCK_SUFFIX)]
+            if not in_use(path):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+    return removed, freed
+
+def reap_in_background():
+    """Starts reap_workspaces() on a daemon thread unless it ran in the last COMPARE_WORKSPACE_REAP_INTERVAL seconds."""
+    global _last_reap
+    with _reap_lock:
+        if _last_reap is not None and time.monotonic() - _last_reap < settings.COMPARE_WORKSPACE_REAP_INTERVAL:
+            return
+        _last_reap = time.monotonic()
+    threading.Thread(target=reap_workspaces, name='workspace-reaper', daemon=True).start()
@@ -65,6 +65,8 @@ SIMPLE_JWT = {
 }
 
 MIDDLEWARE = [
+    # Server-Timing header and /metrics timings of the comparison pipelines
+    'compare.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -154,6 +156,107 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# PDF comparison
+# Number of processes used to compare pages in parallel (1 = sequential).
+# Requests may ask for a different count with the "workers" form field,
+# capped at PDF_COMPARE_MAX_WORKERS.
+PDF_COMPARE_WORKERS = int(os.environ.get('PDF_COMPARE_WORKERS', 1))
+PDF_COMPARE_MAX_WORKERS = int(os.environ.get('PDF_COMPARE_MAX_WORKERS', os.cpu_count() or 1))
+# Descriptor matcher used to align pages: "flann" (approximate LSH) or "bruteforce"
+PDF_ALIGNMENT_MATCHER = os.environ.get('PDF_ALIGNMENT_MATCHER', 'flann')
+# Best matches kept for homography estimation
+PDF_ALIGNMENT_MAX_MATCHES = 2000
+# Long side, in pixels, of the downscaled pages used for the first alignment pass
+PDF_ALIGNMENT_COARSE_SIZE = 1200
+# Pages whose transform moves no corner by more than this many pixels are not warped
+PDF_ALIGNMENT_IDENTITY_TOLERANCE = 1.0
+# Cost of reporting a page as inserted or deleted when matching the page
+# sequences of two documents. Pairing two pages costs the root mean square
+# difference of their thumbnails (0 to 1), capped at twice this, so pages are
+# only left unpaired when that lets their neighbours pair better.
+PDF_PAGE_GAP_COST = 0.03
+# Memory, in bytes, one comparison request may use to diff pages. Page pairs
+# that would not fit when compared whole are diffed in tiles of at most
+# PDF_TILE_SIZE x PDF_TILE_SIZE pixels; with several workers the limit is
+# shared between them, which only affects tiling, not the render scale.
+PDF_COMPARE_MEMORY_LIMIT = int(os.environ.get('PDF_COMPARE_MEMORY_LIMIT', 1024 * 1024 * 1024))
+PDF_TILE_SIZE = 2048
+# Long side, in pixels, of the renders used to align tiled pages
+PDF_TILE_ALIGNMENT_SIZE = 3000
+# Pages are rendered at PDF_RENDER_ZOOM (1 = 72 dpi) unless the pages compared
+# by one request would exceed PDF_RENDER_PIXEL_BUDGET pixels in total, or a
+# page pair would not fit in PDF_COMPARE_MEMORY_LIMIT; the zoom is then
+# lowered, never below PDF_MIN_RENDER_ZOOM, and renders may fall back to
+# grayscale.
+PDF_RENDER_ZOOM = 3
+PDF_MIN_RENDER_ZOOM = 1
+PDF_RENDER_PIXEL_BUDGET = int(os.environ.get('PDF_RENDER_PIXEL_BUDGET', 200_000_000))
+# Set to 1 to align and diff pages on grayscale renders, rendering color only
+# for pages with differences to highlight them on. It uses less memory, but
+# misses changes of color alone, e.g. text turning from red to green.
+PDF_GRAYSCALE_PIPELINE = os.environ.get('PDF_GRAYSCALE_PIPELINE', '0') == '1'
+
+# Image comparison
+# Feature detector used to align images: "fast" (ORB), "balanced" (AKAZE) or
+# "accurate" (SIFT)
+IMAGE_ALIGNMENT_SPEED = os.environ.get('IMAGE_ALIGNMENT_SPEED', 'balanced')
+# Long side, in pixels, of the downscaled copies features are detected on;
+# the transform is scaled back up to warp the full-resolution image
+IMAGE_ALIGNMENT_SIZE = 1600
+# Threads comparing the candidates of one batch request to its reference, and
+# the most candidates one request may upload
+IMAGE_BATCH_WORKERS = int(os.environ.get('IMAGE_BATCH_WORKERS', os.cpu_count() or 1))
+IMAGE_BATCH_MAX_CANDIDATES = int(os.environ.get('IMAGE_BATCH_MAX_CANDIDATES', 50))
+
+# Uploads
+# Files larger than this are rejected while the request is being parsed.
+COMPARE_MAX_UPLOAD_SIZE = int(os.environ.get('COMPARE_MAX_UPLOAD_SIZE', 200 * 1024 * 1024))
+# Uploads are streamed here (outside MEDIA_ROOT) while they are compared or stored.
+COMPARE_UPLOAD_TEMP_DIR = os.path.join(BASE_DIR, 'tmp', 'uploads')
+FILE_UPLOAD_HANDLERS = [
+    'compare.uploads.UploadSizeLimitHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Content-addressed store for uploaded files and comparison outputs
+BLOB_STORE_ROOT = os.path.join(BASE_DIR, 'blobs')
+
+# Comparison result cache, keyed by input hashes and pipeline parameters.
+# Entries live under MEDIA_ROOT so cached outputs are served directly; least
+# recently used entries are evicted past RESULT_CACHE_MAX_BYTES (0 disables it).
+RESULT_CACHE_DIR = os.path.join(MEDIA_ROOT, 'result_cache')
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+# Bearer token Prometheus sends to scrape /metrics; /metrics answers 403 while
+# it is unset. /api/result-cache/ is for staff users.
+COMPARE_METRICS_TOKEN = os.environ.get('COMPARE_METRICS_TOKEN', '')
+
+# Comparison workspaces
+# Every comparison writes its artifacts to a directory of its own here. Workspaces
+# unused for COMPARE_WORKSPACE_TTL seconds are removed, then the least recently
+# used ones while all of them take more than COMPARE_WORKSPACE_MAX_BYTES, except
+# those used in the last COMPARE_WORKSPACE_GRACE seconds. Workspaces of running
+# comparisons are locked and never removed. The reaper runs in the
+# background at most every COMPARE_WORKSPACE_REAP_INTERVAL seconds, and on demand
+# with "manage.py reap_workspaces".
+COMPARE_WORKSPACE_DIR = os.path.join(MEDIA_ROOT, 'workspaces')
+COMPARE_WORKSPACE_TTL = int(os.environ.get('COMPARE_WORKSPACE_TTL', 24 * 60 * 60))
+COMPARE_WORKSPACE_MAX_BYTES = int(os.environ.get('COMPARE_WORKSPACE_MAX_BYTES', 2 * 1024 ** 3))
+COMPARE_WORKSPACE_GRACE = 10 * 60
+COMPARE_WORKSPACE_REAP_INTERVAL = 5 * 60
+
+# Asynchronous comparison jobs
+# Uploaded inputs are kept here (outside MEDIA_ROOT) until a worker has run the job;
+# results are written to a workspace per attempt, COMPARE_WORKSPACE_DIR/job-<job id>-<attempt>/.
+COMPARISON_JOBS_DIR = os.path.join(BASE_DIR, 'jobs')
+COMPARISON_WORKER_POLL_INTERVAL = 2  # seconds
+# A running job whose worker has not reported progress for COMPARISON_JOB_LEASE
+# seconds is assumed dead and queued again, at most COMPARISON_JOB_MAX_ATTEMPTS
+# runs in total; past that it fails.
+COMPARISON_JOB_LEASE = int(os.environ.get('COMPARISON_JOB_LEASE', 10 * 60))
+COMPARISON_JOB_MAX_ATTEMPTS = 3
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -20,6 +20,8 @@ from django.http import HttpResponse
 from django.conf import settings
 from django.conf.urls.static import static
 
+from compare import views as compare_views
+
 # Optional root handler for `/`
 def root_view(request):
     return HttpResponse("<h1>Welcome to the Django Backend</h1>")
@@ -27,6 +29,7 @@ def root_view(request):
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('compare.urls')),  # Retain API endpoint
+    path('metrics', compare_views.metrics, name='metrics'),  # Prometheus scrape target
     path('', root_view),  # Handle root URL explicitly
 ]
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)